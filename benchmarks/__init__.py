@@ -0,0 +1,5 @@
+"""
+Benchmarks are not collected by `manage.py test`, run them explicitly:
+
+    python manage.py test benchmarks.bench_overdue_scan
+"""
@@ -0,0 +1,99 @@
+"""
+Overdue scan over a large loan table.
+
+    BENCH_ROWS=1000000 python manage.py test benchmarks.bench_overdue_scan
+
+Seeds BENCH_ROWS borrowings (10% of them active and overdue) into the test
+database and times `check_overdue_borrowings` with Telegram stubbed out.
+"""
+import os
+import random
+import time
+from datetime import date, timedelta
+from unittest.mock import patch
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from books.models import Book
+from borrowings.models import Borrowing
+from borrowings.tasks import check_overdue_borrowings
+from users.models import User
+
+ROWS = int(os.getenv("BENCH_ROWS", 1_000_000))
+ACTIVE_RATIO = 0.1
+BATCH_SIZE = 10_000
+
+
+class OverdueScanBenchmark(TransactionTestCase):
+    def seed(self):
+        rng = random.Random(42)
+        today = date.today()
+        password = make_password("benchmark")
+
+        users = User.objects.bulk_create(
+            User(email=f"reader{i}@bench.com", password=password)
+            for i in range(max(ROWS // 100, 1))
+        )
+        books = Book.objects.bulk_create(
+            Book(
+                title=f"Book {i}",
+                author=f"Author {i % 500}",
+                inventory=10,
+                daily_fee="1.00"
+            )
+            for i in range(max(ROWS // 100, 1))
+        )
+
+        for start in range(0, ROWS, BATCH_SIZE):
+            batch = []
+            for _ in range(min(BATCH_SIZE, ROWS - start)):
+                borrow_date = today - timedelta(days=rng.randint(10, 700))
+                expected = borrow_date + timedelta(days=rng.randint(7, 30))
+                active = rng.random() < ACTIVE_RATIO
+                batch.append(
+                    Borrowing(
+                        user=rng.choice(users),
+                        book=rng.choice(books),
+                        borrow_date=borrow_date,
+                        expected_return_date=expected,
+                        actual_return_date=None if active else expected,
+                    )
+                )
+            Borrowing.objects.bulk_create(batch)
+
+    def test_overdue_scan(self):
+        started = time.perf_counter()
+        self.seed()
+        print(
+            f"\nSeeded {ROWS} borrowings "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        plan = (
+            Borrowing.objects.filter(
+                expected_return_date__lte=date.today(),
+                actual_return_date__isnull=True
+            )
+            .order_by("expected_return_date", "id")
+            .explain()
+        )
+        print(f"Scan plan: {plan}")
+
+        with patch("borrowings.tasks.notify") as notify:
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                total = check_overdue_borrowings()
+                elapsed = time.perf_counter() - started
+
+        print(
+            f"Scanned {total} overdue borrowings in {elapsed:.2f}s "
+            f"({total / elapsed:,.0f} rows/s), "
+            f"{len(queries)} queries, {notify.call_count} digests"
+        )
+        self.assertGreater(total, 0)
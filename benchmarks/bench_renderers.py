@@ -0,0 +1,110 @@
+"""
+JSON encoding of a large borrowing list.
+
+    BENCH_ROWS=10000 python manage.py test benchmarks.bench_renderers
+
+Serializes BENCH_ROWS borrowings (with book and payments embedded) once
+and compares encode time and response size of DRF's stdlib
+`JSONRenderer` and `FastJSONRenderer`, raw and compressed.
+"""
+import os
+import time
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.test import TestCase
+from django.utils.text import compress_string
+from rest_framework.renderers import JSONRenderer
+
+from books.models import Book
+from borrowings.models import Borrowing
+from borrowings.serializers import BorrowingSerializer
+from library_service.middleware import brotli
+from library_service.renderers import FastJSONRenderer, orjson
+from payments.models import Payment
+from users.models import User
+
+ROWS = int(os.getenv("BENCH_ROWS", 10_000))
+REPEAT = 5
+
+
+class RendererBenchmark(TestCase):
+    def seed(self):
+        today = date.today()
+        user = User.objects.create(
+            email="reader@bench.com", password=make_password("benchmark")
+        )
+        books = Book.objects.bulk_create(
+            Book(
+                title=f"Book {i}",
+                author=f"Author {i % 500}",
+                inventory=10,
+                daily_fee="1.25"
+            )
+            for i in range(max(ROWS // 10, 1))
+        )
+        borrowings = Borrowing.objects.bulk_create(
+            Borrowing(
+                user=user,
+                book=books[i % len(books)],
+                borrow_date=today - timedelta(days=i % 30),
+                expected_return_date=today + timedelta(days=7),
+            )
+            for i in range(ROWS)
+        )
+        Payment.objects.bulk_create(
+            Payment(
+                borrowing=borrowing,
+                type=Payment.PaymentType.PAYMENT,
+                session_url="https://checkout.stripe.com/c/pay/"
+                f"cs_test_{borrowing.id:0>58}",
+                session_id=f"cs_test_{borrowing.id}",
+                money_to_pay="8.75",
+            )
+            for borrowing in borrowings
+        )
+
+    def time_render(self, renderer, data):
+        best = float("inf")
+        for _ in range(REPEAT):
+            started = time.perf_counter()
+            content = renderer.render(data)
+            best = min(best, time.perf_counter() - started)
+        return content, best
+
+    def test_render_borrowing_list(self):
+        self.seed()
+        data = BorrowingSerializer(
+            Borrowing.objects.select_related("book")
+            .prefetch_related("payments"),
+            many=True,
+        ).data
+
+        print(f"\n{ROWS} borrowings, orjson installed: {orjson is not None}")
+        results = {}
+        for renderer in (JSONRenderer(), FastJSONRenderer()):
+            content, elapsed = self.time_render(renderer, data)
+            results[type(renderer).__name__] = content
+            print(
+                f"{type(renderer).__name__:>17}: {elapsed * 1000:8.1f} ms, "
+                f"{len(content):,} bytes"
+            )
+
+        content = results["FastJSONRenderer"]
+        self.assertEqual(content, results["JSONRenderer"])
+
+        started = time.perf_counter()
+        # Same settings as CompressionMiddleware
+        compressed = compress_string(content)
+        print(
+            f"{'gzip':>17}: {(time.perf_counter() - started) * 1000:8.1f} ms,"
+            f" {len(compressed):,} bytes"
+        )
+        if brotli is not None:
+            started = time.perf_counter()
+            compressed = brotli.compress(content)
+            print(
+                f"{'brotli':>17}: "
+                f"{(time.perf_counter() - started) * 1000:8.1f} ms, "
+                f"{len(compressed):,} bytes"
+            )
@@ -0,0 +1,392 @@
+"""
+Load test of the API running on a local server.
+
+Start the Stripe and Telegram stubs and the server pointed at them, with
+the rate limits raised, otherwise the run measures 429 responses:
+
+    python benchmarks/stub_services.py --port 8010 &
+    STRIPE_API_BASE=http://127.0.0.1:8010 \\
+    TELEGRAM_API_URL=http://127.0.0.1:8010 \\
+    STRIPE_ENDPOINT_SECRET_KEY=whsec_loadtest \\
+    THROTTLE_RATE_READ=100000/s THROTTLE_RATE_WRITE=100000/s \\
+    THROTTLE_RATE_BORROW=100000/s THROTTLE_RATE_STRIPE=100000/s \\
+        python manage.py runserver --noreload
+
+    python benchmarks/load_test.py --users 50 --duration 60 \\
+        --save-baseline benchmarks/baseline.json
+    # after a change
+    python benchmarks/load_test.py --users 50 --duration 60 \\
+        --compare benchmarks/baseline.json
+
+Run the server on PostgreSQL for numbers worth comparing, SQLite lets
+only one writer in at a time and the write endpoints queue behind it.
+
+Every virtual user is a coroutine with its own account replaying the way
+readers use the API: catalogue reads, borrowing a book, polling the
+payment, paying it (a signed Stripe webhook delivery) and returning the
+book, in the proportions of MIX. Books have to be in the catalogue
+already. Reports p50, p95 and p99 latency and RPS per endpoint;
+`--compare` exits with 1 if an endpoint got slower, or its RPS lower,
+than the baseline by more than `--tolerance`.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from itertools import count
+
+import httpx
+
+# Relative weights of the scenarios, those not possible for a user in
+# their current state (e.g. returning without a borrowing) are skipped
+MIX = {
+    "books:list": 40,
+    "books:detail": 20,
+    "borrowings:list": 10,
+    "borrowings:create": 10,
+    "payments:detail": 10,
+    "payments:webhook": 5,
+    "borrowings:return": 10,
+}
+PASSWORD = "load-test-password"
+# SIMPLE_JWT["AUTH_HEADER_NAME"]
+AUTH_HEADER = "Authorize"
+
+_event_ids = count(1)
+
+
+class Stats:
+    def __init__(self):
+        self.recording = False
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def add(self, endpoint, seconds, status):
+        if self.recording:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values"""
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def summarize(stats, elapsed):
+    report = {}
+    for endpoint in MIX:
+        latencies = sorted(stats.latencies.get(endpoint, ()))
+        if not latencies:
+            continue
+        statuses = stats.statuses[endpoint]
+        report[endpoint] = {
+            "requests": len(latencies),
+            "rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "errors": sum(
+                amount for status, amount in statuses.items()
+                if status == "error" or int(status) >= 500
+            ),
+            "statuses": dict(sorted(statuses.items())),
+        }
+    return report
+
+
+class VirtualUser:
+    def __init__(self, client, number, book_ids, stats, webhook_secret):
+        self.client = client
+        self.email = f"loadtest{number}@library.test"
+        self.book_ids = book_ids
+        self.stats = stats
+        self.webhook_secret = webhook_secret
+        self.headers = {}
+        self.borrowing_id = None
+        self.payment_id = None
+        self.session_id = None
+
+    async def login(self):
+        await self.client.post(
+            "/api/user/register/",
+            json={"email": self.email, "password": PASSWORD},
+        )
+        response = await self.client.post(
+            "/api/user/token/",
+            json={"email": self.email, "password": PASSWORD},
+        )
+        response.raise_for_status()
+        self.headers = {AUTH_HEADER: f"Bearer {response.json()['access']}"}
+
+        # Borrowing left active by a previous run
+        response = await self.client.get(
+            "/api/borrowings/borrowings/",
+            params={"is_active": "true", "fields": "id"},
+            headers=self.headers,
+        )
+        results = response.json()["results"]
+        if results:
+            self.borrowing_id = results[0]["id"]
+
+    async def request(self, endpoint, method, url, **kwargs):
+        headers = {**self.headers, **kwargs.pop("headers", {})}
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(
+                method, url, headers=headers, **kwargs
+            )
+        except httpx.HTTPError:
+            self.stats.add(endpoint, time.perf_counter() - started, "error")
+            return None
+        self.stats.add(
+            endpoint,
+            time.perf_counter() - started,
+            str(response.status_code),
+        )
+        return response
+
+    def possible(self, endpoint):
+        if endpoint == "borrowings:create":
+            return self.borrowing_id is None
+        if endpoint == "borrowings:return":
+            return self.borrowing_id is not None
+        if endpoint == "payments:detail":
+            return self.payment_id is not None and self.session_id is None
+        if endpoint == "payments:webhook":
+            return self.session_id is not None
+        return True
+
+    async def run(self, deadline):
+        scenarios = {
+            "books:list": self.list_books,
+            "books:detail": self.book_detail,
+            "borrowings:list": self.list_borrowings,
+            "borrowings:create": self.borrow,
+            "payments:detail": self.poll_payment,
+            "payments:webhook": self.pay,
+            "borrowings:return": self.return_book,
+        }
+        while time.monotonic() < deadline:
+            endpoints = [name for name in MIX if self.possible(name)]
+            endpoint = random.choices(
+                endpoints, [MIX[name] for name in endpoints]
+            )[0]
+            await scenarios[endpoint]()
+
+    async def list_books(self):
+        await self.request("books:list", "GET", "/api/books/books/")
+
+    async def book_detail(self):
+        book_id = random.choice(self.book_ids)
+        await self.request(
+            "books:detail", "GET", f"/api/books/books/{book_id}/"
+        )
+
+    async def list_borrowings(self):
+        await self.request(
+            "borrowings:list", "GET", "/api/borrowings/borrowings/"
+        )
+
+    async def borrow(self):
+        today = date.today()
+        response = await self.request(
+            "borrowings:create",
+            "POST",
+            "/api/borrowings/borrowings/",
+            json={
+                "book_id": random.choice(self.book_ids),
+                "borrow_date": str(today),
+                "expected_return_date": str(today + timedelta(days=7)),
+            },
+        )
+        # Out of stock books are part of the mix, the user tries again
+        if response is not None and response.status_code == 201:
+            self.borrowing_id = response.json()["borrowing"]
+            self.payment_id = response.json()["payment"]
+            self.session_id = None
+
+    async def poll_payment(self):
+        response = await self.request(
+            "payments:detail",
+            "GET",
+            f"/api/payments/payments/{self.payment_id}/",
+        )
+        if response is not None and response.status_code == 200:
+            self.session_id = response.json().get("session_id")
+
+    async def pay(self):
+        event = {
+            "id": f"evt_loadtest_{os.getpid()}_{next(_event_ids)}",
+            "object": "event",
+            "type": "checkout.session.completed",
+            "data": {
+                "object": {
+                    "id": self.session_id,
+                    "object": "checkout.session",
+                    "payment_status": "paid",
+                }
+            },
+        }
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = hmac.new(
+            self.webhook_secret.encode(),
+            f"{timestamp}.{payload}".encode(),
+            hashlib.sha256,
+        ).hexdigest()
+
+        await self.request(
+            "payments:webhook",
+            "POST",
+            "/api/payments/webhooks/stripe/",
+            content=payload,
+            headers={
+                "Content-Type": "application/json",
+                "Stripe-Signature": f"t={timestamp},v1={signature}",
+            },
+        )
+        self.payment_id = self.session_id = None
+
+    async def return_book(self):
+        response = await self.request(
+            "borrowings:return",
+            "POST",
+            f"/api/borrowings/borrowings/{self.borrowing_id}/return_borrow/",
+        )
+        if response is not None and response.status_code in (200, 400):
+            self.borrowing_id = None
+
+
+async def fetch_book_ids(client, limit=1000):
+    book_ids = []
+    url = "/api/books/books/?page_size=100&fields=id"
+    while url and len(book_ids) < limit:
+        response = await client.get(url)
+        response.raise_for_status()
+        book_ids += [book["id"] for book in response.json()["results"]]
+        url = response.json()["next"]
+    return book_ids
+
+
+async def load_test(args):
+    stats = Stats()
+    limits = httpx.Limits(
+        max_connections=args.users, max_keepalive_connections=args.users
+    )
+    async with httpx.AsyncClient(
+        base_url=args.base_url, timeout=args.timeout, limits=limits
+    ) as client:
+        book_ids = await fetch_book_ids(client)
+        if not book_ids:
+            sys.exit("The catalogue is empty, import some books first")
+
+        users = [
+            VirtualUser(client, number, book_ids, stats, args.webhook_secret)
+            for number in range(args.users)
+        ]
+        await asyncio.gather(*(user.login() for user in users))
+
+        async def record():
+            # Caches and connection pools warm up before measuring
+            await asyncio.sleep(args.warmup)
+            stats.recording = True
+
+        deadline = time.monotonic() + args.warmup + args.duration
+        await asyncio.gather(
+            record(), *(user.run(deadline) for user in users)
+        )
+
+    return summarize(stats, args.duration)
+
+
+def print_report(report):
+    print(
+        f"{'endpoint':<20}{'requests':>10}{'rps':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}  statuses"
+    )
+    for endpoint, row in report.items():
+        print(
+            f"{endpoint:<20}{row['requests']:>10}{row['rps']:>10}"
+            f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}"
+            f"{row['errors']:>8}  {row['statuses']}"
+        )
+
+
+def compare(report, baseline, tolerance):
+    """Print changes against the baseline, returns whether it regressed"""
+    regressed = False
+    print(f"\nCompared to the baseline (tolerance {tolerance:.0%}):")
+
+    for endpoint, row in report.items():
+        base = baseline.get(endpoint)
+        if base is None:
+            print(f"{endpoint:<20} not in the baseline")
+            continue
+
+        changes = []
+        for metric, worse in (
+            ("p95_ms", row["p95_ms"] > base["p95_ms"] * (1 + tolerance)),
+            ("p99_ms", row["p99_ms"] > base["p99_ms"] * (1 + tolerance)),
+            ("rps", row["rps"] < base["rps"] * (1 - tolerance)),
+        ):
+            change = (row[metric] / base[metric] - 1) if base[metric] else 0
+            changes.append(
+                f"{metric} {change:+.0%}{' REGRESSION' if worse else ''}"
+            )
+            regressed |= worse
+        print(f"{endpoint:<20} " + ", ".join(changes))
+
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument(
+        "--webhook-secret",
+        default=os.getenv("STRIPE_ENDPOINT_SECRET_KEY", "whsec_loadtest"),
+    )
+    parser.add_argument("--seed", type=int, help="Seed of the scenario mix")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    report = asyncio.run(load_test(args))
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(
+                {
+                    "users": args.users,
+                    "duration": args.duration,
+                    "endpoints": report,
+                },
+                file,
+                indent=2,
+            )
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(report, baseline["endpoints"], args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
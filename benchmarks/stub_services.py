@@ -0,0 +1,115 @@
+"""
+Local stand-in for the Stripe and Telegram APIs, for load tests.
+
+    python benchmarks/stub_services.py --port 8010 --latency-ms 150
+
+Point the server under test at it with
+`STRIPE_API_BASE=http://localhost:8010` and
+`TELEGRAM_API_URL=http://localhost:8010`. Checkout sessions are kept in
+memory and honour idempotency keys like Stripe does; `--latency-ms`
+delays every response to mimic the real round trip.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import parse_qsl
+
+
+class StubState:
+    def __init__(self, latency):
+        self.latency = latency
+        self.sessions = {}
+        self.idempotent_sessions = {}
+        self.telegram_messages = 0
+        self.ids = count(1)
+        self.lock = threading.Lock()
+
+    def create_session(self, params, idempotency_key):
+        with self.lock:
+            if idempotency_key in self.idempotent_sessions:
+                return self.idempotent_sessions[idempotency_key]
+
+            session_id = f"cs_stub_{next(self.ids)}"
+            session = {
+                "id": session_id,
+                "object": "checkout.session",
+                "url": f"https://checkout.stripe.com/c/pay/{session_id}",
+                "payment_status": "unpaid",
+                "client_reference_id": params.get("client_reference_id"),
+            }
+            self.sessions[session_id] = session
+            if idempotency_key:
+                self.idempotent_sessions[idempotency_key] = session
+            return session
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def respond(self, status, data):
+        time.sleep(self.state.latency)
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_form(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return dict(parse_qsl(self.rfile.read(length).decode()))
+
+    def do_POST(self):
+        params = self.read_form()
+
+        if self.path == "/v1/checkout/sessions":
+            session = self.state.create_session(
+                params, self.headers.get("Idempotency-Key")
+            )
+            return self.respond(200, session)
+
+        if self.path.endswith("/sendMessage"):
+            with self.state.lock:
+                self.state.telegram_messages += 1
+            return self.respond(200, {"ok": True, "result": {}})
+
+        self.respond(404, {"error": {"message": "Unknown endpoint"}})
+
+    def do_GET(self):
+        prefix = "/v1/checkout/sessions/"
+        if self.path.startswith(prefix):
+            session = self.state.sessions.get(self.path[len(prefix):])
+            if session is not None:
+                return self.respond(200, session)
+            return self.respond(
+                404, {"error": {"message": "No such checkout.session"}}
+            )
+
+        self.respond(404, {"error": {"message": "Unknown endpoint"}})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, latency_ms=0):
+    StubHandler.state = StubState(latency_ms / 1000)
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency_ms)
+    print(f"Stripe and Telegram stubs on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,76 @@
+"""
+Versioned cache of the public book catalogue.
+
+Every book has its own version and the catalogue has one for all lists,
+both are part of the cache keys and of the ETags. Invalidation only bumps
+the versions, stale entries are never read again and simply expire.
+"""
+import hashlib
+import uuid
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOGUE_VERSION_KEY = "books:catalogue:version"
+BOOK_VERSION_KEY = "books:book:{}:version"
+CACHE_TIMEOUT = 60 * 15
+
+
+def _version(key):
+    return cache.get_or_set(key, uuid.uuid4().hex, timeout=None)
+
+
+def _bump_versions(book_ids):
+    versions = {
+        BOOK_VERSION_KEY.format(book_id): uuid.uuid4().hex
+        for book_id in book_ids
+    }
+    versions[CATALOGUE_VERSION_KEY] = uuid.uuid4().hex
+    cache.set_many(versions, timeout=None)
+
+
+def invalidate_books(book_ids):
+    """
+    Drop cached details of the books and all cached lists. Done right away
+    and once more on commit, so readers which cached the pre-commit state
+    in between don't keep serving it
+    """
+    book_ids = list(book_ids)
+    _bump_versions(book_ids)
+    transaction.on_commit(partial(_bump_versions, book_ids))
+
+
+def invalidate_book(book_id):
+    invalidate_books([book_id])
+
+
+def _bump_catalogue_version():
+    cache.set(CATALOGUE_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def invalidate_catalogue():
+    """Drop all cached lists after writes which bypass the Book signals"""
+    _bump_catalogue_version()
+    transaction.on_commit(_bump_catalogue_version)
+
+
+def list_cache_key(request):
+    url = hashlib.md5(
+        f"{request.accepted_media_type}:{request.build_absolute_uri()}"
+        .encode()
+    ).hexdigest()
+    return f"books:list:{_version(CATALOGUE_VERSION_KEY)}:{url}"
+
+
+def detail_cache_key(request, book_id):
+    version = _version(BOOK_VERSION_KEY.format(book_id))
+    # Query string selects the fields of the response
+    variant = hashlib.md5(
+        f"{request.accepted_media_type}:{request.GET.urlencode()}".encode()
+    ).hexdigest()
+    return f"books:detail:{book_id}:{version}:{variant}"
+
+
+def etag_for(cache_key):
+    return f'W/"{hashlib.md5(cache_key.encode()).hexdigest()}"'
@@ -0,0 +1,150 @@
+"""
+Bulk import of the book catalogue from CSV or JSON Lines feeds.
+
+Rows are streamed from the file and handled in chunks: every chunk is
+validated with the `BookSerializer` rules and written with one upsert on
+the (title, author, cover) natural key, so existing books get their
+inventory and daily fee updated. A feed counts the copies the library
+owns, copies on loan or held for the waitlist aren't on the shelf and
+are left out of the inventory. Invalid rows are reported and skipped,
+they never abort the rest of the import.
+"""
+import codecs
+import csv
+import json
+from collections import Counter
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Count
+
+from books.cache import invalidate_books
+from books.models import Book
+from books.search import index_books
+from books.serializers import BookSerializer
+from borrowings.models import Borrowing, Hold
+
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_FORMATS = ("csv", "jsonl")
+
+NATURAL_KEY = ("title", "author", "cover")
+UPDATE_FIELDS = ("inventory", "daily_fee")
+
+
+class BookImportSerializer(BookSerializer):
+    class Meta(BookSerializer.Meta):
+        fields = ("title", "author", "cover", "inventory", "daily_fee")
+        # Books already in the catalogue are updated, not rejected
+        validators = []
+
+
+def guess_format(file_name):
+    extension = file_name.rsplit(".", 1)[-1].lower()
+    return "jsonl" if extension in ("jsonl", "ndjson") else "csv"
+
+
+def read_rows(file, file_format):
+    """
+    Yield (row number, row) pairs from a binary file,
+    row is None if the line can't be parsed
+    """
+    lines = codecs.iterdecode(file, "utf-8-sig")
+
+    if file_format == "csv":
+        for row_number, row in enumerate(csv.DictReader(lines), start=1):
+            yield row_number, row
+        return
+
+    for row_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row_number, row if isinstance(row, dict) else None
+
+
+def import_books(file, file_format, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Import books from the file. Returns the number of imported (created
+    or updated) books and the errors of rejected rows
+    """
+    result = {"imported": 0, "errors": []}
+    rows = read_rows(file, file_format)
+
+    while chunk := list(islice(rows, chunk_size)):
+        books = {}
+        for row_number, row in chunk:
+            if row is None:
+                result["errors"].append(
+                    {"row": row_number, "errors": ["Malformed row."]}
+                )
+                continue
+
+            serializer = BookImportSerializer(data=row)
+            if not serializer.is_valid():
+                result["errors"].append(
+                    {"row": row_number, "errors": serializer.errors}
+                )
+                continue
+
+            book = Book(**serializer.validated_data)
+            # Upsert can't touch a row twice, the last one in a chunk wins
+            books[_natural_key(book)] = book
+
+        if books:
+            result["imported"] += _write_chunk(list(books.values()))
+
+    return result
+
+
+def _copies_out(book_ids):
+    """Copies of the books on loan or held for the waitlist, by book id"""
+    copies = Counter()
+    for queryset in (
+        Borrowing.objects.filter(actual_return_date__isnull=True),
+        Hold.objects.filter(status=Hold.HoldStatus.OFFERED),
+    ):
+        copies.update(
+            dict(
+                queryset.filter(book_id__in=book_ids)
+                .values("book_id")
+                .annotate(copies=Count("id"))
+                .values_list("book_id", "copies")
+            )
+        )
+    return copies
+
+
+def _natural_key(book):
+    return tuple(getattr(book, field) for field in NATURAL_KEY)
+
+
+def _write_chunk(books):
+    with transaction.atomic():
+        # Locked, so no borrowing or return slips in between the count
+        # of copies out and the upsert
+        existing = {
+            _natural_key(book): book.id
+            for book in Book.objects.select_for_update()
+            .filter(title__in={book.title for book in books})
+            .only(*NATURAL_KEY)
+        }
+        copies_out = _copies_out(existing.values())
+        for book in books:
+            book_id = existing.get(_natural_key(book))
+            if book_id is not None:
+                book.inventory = max(book.inventory - copies_out[book_id], 0)
+
+        books = Book.objects.bulk_create(
+            books,
+            update_conflicts=True,
+            unique_fields=NATURAL_KEY,
+            update_fields=UPDATE_FIELDS,
+        )
+        # Bulk writes skip the Book signals
+        index_books(books)
+        invalidate_books(book.id for book in books)
+
+    return len(books)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from books.importers import (
+    guess_format,
+    import_books,
+    IMPORT_CHUNK_SIZE,
+    IMPORT_FORMATS
+)
+
+
+class Command(BaseCommand):
+    help = "Import books from a CSV or JSONL file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument(
+            "--file-format",
+            choices=IMPORT_FORMATS,
+            help="Defaults to the file extension",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=IMPORT_CHUNK_SIZE
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["file_format"] or guess_format(path)
+
+        with open(path, "rb") as file:
+            result = import_books(
+                file, file_format, chunk_size=options["chunk_size"]
+            )
+
+        for error in result["errors"]:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {result['imported']} books, "
+                f"rejected {len(result['errors'])} rows"
+            )
+        )
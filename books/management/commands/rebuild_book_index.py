@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from books.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of the book catalogue"
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index()
+        self.stdout.write(
+            self.style.SUCCESS(f"Search index rebuilt for {indexed} books")
+        )
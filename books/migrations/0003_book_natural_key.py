@@ -0,0 +1,115 @@
+# Generated by Django 5.1.1 on 2026-10-18 02:45
+
+import os
+
+from django.db import migrations, models
+from django.db.models import Count
+
+NATURAL_KEY = ("title", "author", "cover")
+# Opt-in, merging can't be undone
+MERGE_SETTING = "BOOKS_MERGE_DUPLICATES"
+# Full-text index of SQLite, as created by 0002
+FTS_TABLE = "books_book_fts"
+
+
+def duplicate_groups(Book):
+    """Books sharing a natural key, the first one of each group is kept"""
+    keys = (
+        Book.objects.values(*NATURAL_KEY)
+        .annotate(rows=Count("id"))
+        .filter(rows__gt=1)
+        .order_by(*NATURAL_KEY)
+    )
+    for key in keys:
+        yield list(
+            Book.objects.filter(
+                **{field: key[field] for field in NATURAL_KEY}
+            ).order_by("id")
+        )
+
+
+def describe(group):
+    first = group[0]
+    return (
+        f"{first.title} by {first.author} ({first.cover}): "
+        f"books {', '.join(str(book.id) for book in group)}, "
+        f"inventories {', '.join(str(book.inventory) for book in group)}, "
+        f"daily fees {', '.join(str(book.daily_fee) for book in group)}"
+    )
+
+
+def merge_duplicate_books(apps, schema_editor):
+    """
+    Books could be added twice before, the natural key can't be added
+    while they are. The migration stops and lists them for review,
+    with BOOKS_MERGE_DUPLICATES=True set it merges every duplicate into
+    the first row: borrowings move over and inventories add up. Books
+    with different daily fees are never merged, fix them by hand
+    """
+    Book = apps.get_model("books", "Book")
+    Borrowing = apps.get_model("borrowings", "Borrowing")
+    groups = list(duplicate_groups(Book))
+    if not groups:
+        return
+
+    conflicting = [
+        group for group in groups
+        if len({book.daily_fee for book in group}) > 1
+    ]
+    if conflicting:
+        raise RuntimeError(
+            "These books are in the catalogue more than once with "
+            "different daily fees, make them distinct or give them the "
+            "same fee before migrating:\n"
+            + "\n".join(describe(group) for group in conflicting)
+        )
+    if os.getenv(MERGE_SETTING) != "True":
+        raise RuntimeError(
+            "These books are in the catalogue more than once. Review "
+            f"them and migrate with {MERGE_SETTING}=True to merge each "
+            "into its first book, borrowings move over and inventories "
+            "add up. This can't be undone:\n"
+            + "\n".join(describe(group) for group in groups)
+        )
+
+    for group in groups:
+        first, *copies = group
+        copy_ids = [book.id for book in copies]
+        Borrowing.objects.filter(book_id__in=copy_ids).update(
+            book_id=first.id
+        )
+        Book.objects.filter(id__in=copy_ids).delete()
+        Book.objects.filter(id=first.id).update(
+            inventory=sum(book.inventory for book in group)
+        )
+
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(
+            f"DELETE FROM {FTS_TABLE} "
+            f"WHERE rowid NOT IN (SELECT id FROM books_book)"
+        )
+    elif vendor == "postgresql":
+        # Foreign keys are checked at commit, the pending checks would
+        # stop the constraint below from altering books_book
+        schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0002_book_search_index"),
+        ("borrowings", "0004_borrowing_user_returned_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_books, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name="book",
+            constraint=models.UniqueConstraint(
+                fields=("title", "author", "cover"), name="book_natural_key"
+            ),
+        ),
+    ]
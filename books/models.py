@@ -1,4 +1,70 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Q, When
+
+from books.cache import invalidate_book
+
+
+class BookQuerySet(models.QuerySet):
+    def reserve(self, book_id, copies=1):
+        """
+        Take copies of the book from the inventory with a single
+        conditional UPDATE, so concurrent borrowers can not oversell it.
+        Returns False if there are not enough copies left
+        """
+        reserved = self.filter(pk=book_id, inventory__gte=copies).update(
+            inventory=F("inventory") - copies
+        )
+        if reserved:
+            invalidate_book(book_id)
+        return bool(reserved)
+
+    def reserve_many(self, copies):
+        """
+        Take copies of many books, {book id: copies}, with one conditional
+        UPDATE. All or nothing, returns ids of the books without enough
+        copies left, none are taken then
+        """
+        enough_left = Q()
+        for book_id, count in copies.items():
+            enough_left |= Q(pk=book_id, inventory__gte=count)
+
+        with transaction.atomic():
+            reserved = self.filter(enough_left).update(
+                inventory=Case(
+                    *(
+                        When(pk=book_id, then=F("inventory") - count)
+                        for book_id, count in copies.items()
+                    ),
+                    default=F("inventory"),
+                    output_field=models.PositiveIntegerField(),
+                )
+            )
+            if reserved < len(copies):
+                transaction.set_rollback(True)
+
+        if reserved < len(copies):
+            inventories = dict(
+                self.filter(pk__in=copies).values_list("pk", "inventory")
+            )
+            # Copies may have come back meanwhile, then blame them all
+            return [
+                book_id
+                for book_id, count in copies.items()
+                if inventories.get(book_id, 0) < count
+            ] or list(copies)
+
+        for book_id in copies:
+            invalidate_book(book_id)
+        return []
+
+    def release(self, book_id, copies=1):
+        """Put copies of the book back to the inventory"""
+        released = self.filter(pk=book_id).update(
+            inventory=F("inventory") + copies
+        )
+        if released:
+            invalidate_book(book_id)
+        return bool(released)
 
 
 class Book(models.Model):
@@ -16,5 +82,18 @@ class Book(models.Model):
     inventory = models.PositiveIntegerField()
     daily_fee = models.DecimalField(max_digits=5, decimal_places=2)
 
+    objects = BookQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Natural key of the catalogue, bulk imports upsert on it.
+            # Creating a book that is already there is rejected, the
+            # import updates it instead
+            models.UniqueConstraint(
+                fields=["title", "author", "cover"],
+                name="book_natural_key",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.title}, {self.author}"
@@ -0,0 +1,134 @@
+"""
+Full-text index over book titles and authors.
+
+SQLite keeps the index in an FTS5 virtual table that mirrors `books_book`
+and is updated row by row from the `Book` signals. PostgreSQL uses a GIN
+index on the `tsvector` of the same columns, which the database maintains
+by itself, so there is nothing to sync there.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from books.cache import invalidate_catalogue
+from books.models import Book
+
+FTS_TABLE = "books_book_fts"
+PG_INDEX = "books_book_search_idx"
+PG_VECTOR = "to_tsvector('simple', title || ' ' || author)"
+
+SEARCH_RESULTS_LIMIT = 20
+MAX_SEARCH_RESULTS = 100
+
+
+def create_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5(title, author, "
+            f"tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, title, author) "
+            f"SELECT id, title, author FROM books_book"
+        )
+    elif vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {PG_INDEX} "
+            f"ON books_book USING GIN ({PG_VECTOR})"
+        )
+
+
+def drop_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == "postgresql":
+        schema_editor.execute(f"DROP INDEX IF EXISTS {PG_INDEX}")
+
+
+def index_books(books):
+    """Add or refresh the index entries of the given books"""
+    if connection.vendor != "sqlite":
+        return
+
+    rows = [(book.id, book.title, book.author) for book in books]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid = %s",
+            [(row[0],) for row in rows]
+        )
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE}(rowid, title, author) "
+            f"VALUES (%s, %s, %s)",
+            rows
+        )
+
+
+def unindex_book(book_id):
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [book_id]
+        )
+
+
+def rebuild_index():
+    """Rebuild the whole index in bulk, returns the number of indexed books"""
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}(rowid, title, author) "
+                f"SELECT id, title, author FROM books_book"
+            )
+    elif connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(f"REINDEX INDEX {PG_INDEX}")
+
+    invalidate_catalogue()
+    return Book.objects.count()
+
+
+def search_books(query, limit=SEARCH_RESULTS_LIMIT):
+    """
+    Return up to `limit` books matching every word of `query`
+    (as a prefix), best matches first
+    """
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return []
+
+    if connection.vendor == "sqlite":
+        sql = (
+            f"SELECT rowid FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s"
+        )
+        params = [" ".join(f'"{term}"*' for term in terms), limit]
+    elif connection.vendor == "postgresql":
+        sql = (
+            f"SELECT id FROM books_book "
+            f"WHERE {PG_VECTOR} @@ to_tsquery('simple', %s) "
+            f"ORDER BY ts_rank({PG_VECTOR}, to_tsquery('simple', %s)) DESC, "
+            f"id LIMIT %s"
+        )
+        tsquery = " & ".join(f"{term}:*" for term in terms)
+        params = [tsquery, tsquery, limit]
+    else:
+        queryset = Book.objects.all()
+        for term in terms:
+            queryset = queryset.filter(
+                Q(title__icontains=term) | Q(author__icontains=term)
+            )
+        return list(queryset.order_by("id")[:limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ranked_ids = [row[0] for row in cursor.fetchall()]
+
+    books = Book.objects.in_bulk(ranked_ids)
+    return [books[book_id] for book_id in ranked_ids if book_id in books]
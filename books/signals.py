@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from books.cache import invalidate_book
+from books.models import Book
+from books.search import index_books, unindex_book
+
+
+@receiver(post_save, sender=Book)
+def update_search_index(sender, instance, **kwargs):
+    index_books([instance])
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_cached_book(sender, instance, **kwargs):
+    invalidate_book(instance.id)
+
+
+@receiver(post_delete, sender=Book)
+def remove_from_search_index(sender, instance, **kwargs):
+    unindex_book(instance.id)
@@ -1,10 +1,20 @@
+import json
+from datetime import date, timedelta
+from io import StringIO
+from tempfile import NamedTemporaryFile
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 
 from books.models import Book
+from borrowings.models import Borrowing, Hold
 
 
 class PublicBooksApiTests(TestCase):
@@ -32,8 +42,55 @@ class PublicBooksApiTests(TestCase):
         response = self.client.get(self.url)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
-        self.assertEqual(response.data[0]["title"], self.book_1.title)
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertEqual(
+            response.data["results"][0]["title"], self.book_1.title
+        )
+
+    def test_list_books_cursor_pagination(self):
+        """Test walking the book list page by page with the cursor"""
+        response = self.client.get(self.url, {"page_size": 1})
+
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["id"], self.book_1.id)
+        self.assertIsNone(response.data["previous"])
+
+        response = self.client.get(response.data["next"])
+
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["id"], self.book_2.id)
+        self.assertIsNone(response.data["next"])
+
+    def test_list_books_page_size_is_bounded(self):
+        """Test that page_size can not exceed max_page_size"""
+        Book.objects.bulk_create(
+            Book(
+                title=f"Book {i}",
+                author="Author",
+                inventory=1,
+                daily_fee="1.00"
+            )
+            for i in range(120)
+        )
+        response = self.client.get(self.url, {"page_size": 1000})
+
+        self.assertEqual(len(response.data["results"]), 100)
+        self.assertIsNotNone(response.data["next"])
+
+    def test_sparse_fieldset(self):
+        response = self.client.get(self.url, {"fields": "id,title"})
+
+        self.assertEqual(
+            response.data["results"][0],
+            {"id": self.book_1.id, "title": self.book_1.title}
+        )
+
+        url = reverse("books:book-detail", args=[self.book_1.id])
+        response = self.client.get(url, {"fields": "inventory"})
+        self.assertEqual(response.data, {"inventory": 10})
+        # Full representation is cached separately
+        response = self.client.get(url)
+        self.assertEqual(response.data["title"], self.book_1.title)
 
     def test_retrieve_book(self):
         """Test retrieving exact book without authentication"""
@@ -82,3 +139,276 @@ class PrivateBooksApiTests(APITestCase):
         response = self.client.post(self.url, payload)
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_create_existing_book_is_rejected(self):
+        """Test that the natural key rejects a second copy of a book"""
+        payload = {
+            "title": "Book Four",
+            "author": "Author Four",
+            "cover": "Soft",
+            "inventory": 10,
+            "daily_fee": "1.75"
+        }
+        self.client.post(self.url, payload)
+
+        response = self.client.post(self.url, payload)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("non_field_errors", response.data)
+        self.assertEqual(Book.objects.filter(title="Book Four").count(), 1)
+
+
+class BooksSearchApiTests(TestCase):
+    def setUp(self):
+        self.dune = Book.objects.create(
+            title="Dune",
+            author="Frank Herbert",
+            inventory=3,
+            daily_fee="1.00"
+        )
+        self.messiah = Book.objects.create(
+            title="Dune Messiah",
+            author="Frank Herbert",
+            inventory=2,
+            daily_fee="1.00"
+        )
+        self.hobbit = Book.objects.create(
+            title="The Hobbit",
+            author="J. R. R. Tolkien",
+            inventory=1,
+            daily_fee="2.00"
+        )
+        self.url = reverse("books:book-list")
+
+    def search(self, query):
+        response = self.client.get(self.url, {"q": query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [book["id"] for book in response.data["results"]]
+
+    def test_search_by_title_and_author(self):
+        """Test that every word of the query has to match"""
+        self.assertEqual(
+            sorted(self.search("dune herbert")),
+            [self.dune.id, self.messiah.id]
+        )
+        self.assertEqual(self.search("tolk"), [self.hobbit.id])
+        self.assertEqual(self.search("hobbit herbert"), [])
+
+    def test_search_index_follows_updates_and_deletes(self):
+        """Test that the index is kept in sync with the catalogue"""
+        self.hobbit.title = "The Silmarillion"
+        self.hobbit.save()
+        self.assertEqual(self.search("silmarillion"), [self.hobbit.id])
+        self.assertEqual(self.search("hobbit"), [])
+
+        self.dune.delete()
+        self.assertEqual(self.search("dune"), [self.messiah.id])
+
+    def test_rebuild_book_index_command(self):
+        """Test that the command indexes rows written behind the signals"""
+        Book.objects.filter(id=self.hobbit.id).update(title="Unfinished Tales")
+        if connection.vendor == "sqlite":
+            # PostgreSQL index is maintained by the database itself
+            self.assertEqual(self.search("unfinished"), [])
+
+        call_command("rebuild_book_index", stdout=StringIO())
+
+        self.assertEqual(self.search("unfinished"), [self.hobbit.id])
+
+
+class BooksCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.book = Book.objects.create(
+            title="Cached Book",
+            author="Author",
+            inventory=2,
+            daily_fee="1.00"
+        )
+        self.list_url = reverse("books:book-list")
+        self.detail_url = reverse("books:book-detail", args=[self.book.id])
+
+    def test_reads_are_served_from_cache(self):
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+
+        with self.assertNumQueries(0):
+            list_response = self.client.get(self.list_url)
+            detail_response = self.client.get(self.detail_url)
+
+        self.assertEqual(
+            list_response.data["results"][0]["title"], "Cached Book"
+        )
+        self.assertEqual(detail_response.data["title"], "Cached Book")
+
+    def test_save_invalidates_list_and_detail(self):
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.title = "Renamed Book"
+            self.book.save()
+
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.data["results"][0]["title"], "Renamed Book")
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.data["title"], "Renamed Book")
+
+    def test_inventory_update_invalidates_detail(self):
+        self.client.get(self.detail_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.reserve(self.book.id)
+
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.data["inventory"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.release(self.book.id)
+
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.data["inventory"], 2)
+
+    def test_conditional_get(self):
+        response = self.client.get(self.detail_url)
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                self.detail_url, headers={"If-None-Match": etag}
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Book.objects.reserve(self.book.id)
+
+        response = self.client.get(
+            self.detail_url, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["inventory"], 1)
+
+    def test_conditional_get_of_missing_book(self):
+        response = self.client.get(
+            reverse("books:book-detail", args=[self.book.id + 1]),
+            headers={"If-None-Match": "*"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BooksImportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.admin = get_user_model().objects.create_user(
+            email="admin@example.com", password="password123", is_staff=True
+        )
+        self.client.force_authenticate(user=self.admin)
+        self.book = Book.objects.create(
+            title="Dune",
+            author="Frank Herbert",
+            cover="Hard",
+            inventory=1,
+            daily_fee="1.00"
+        )
+        self.url = reverse("books:book-import-books")
+
+    def upload(self, content, name="books.csv"):
+        return self.client.post(
+            self.url,
+            {"file": SimpleUploadedFile(name, content.encode())},
+            format="multipart",
+        )
+
+    def test_import_csv_upserts_and_reports_errors(self):
+        content = (
+            "title,author,cover,inventory,daily_fee\n"
+            "Dune,Frank Herbert,Hard,7,1.25\n"
+            "Emma,Jane Austen,Soft,3,0.50\n"
+            "Broken,Nobody,Wooden,1,1.00\n"
+            "Emma,Jane Austen,Soft,4,0.50\n"
+        )
+
+        response = self.upload(content)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["imported"], 2)
+        self.assertEqual(len(response.data["errors"]), 1)
+        self.assertEqual(response.data["errors"][0]["row"], 3)
+        self.assertIn("cover", response.data["errors"][0]["errors"])
+
+        self.assertEqual(Book.objects.count(), 2)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 7)
+        self.assertEqual(Book.objects.get(title="Emma").inventory, 4)
+
+        response = self.client.get(reverse("books:book-list"), {"q": "emma"})
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_import_leaves_out_copies_on_loan(self):
+        reader = get_user_model().objects.create_user(
+            email="reader@example.com", password="password123"
+        )
+        today = date.today()
+        Borrowing.objects.create(
+            book=self.book,
+            user=reader,
+            borrow_date=today,
+            expected_return_date=today + timedelta(days=7),
+        )
+        # Returned copies are back on the shelf
+        Borrowing.objects.create(
+            book=self.book,
+            user=reader,
+            borrow_date=today,
+            expected_return_date=today + timedelta(days=7),
+            actual_return_date=today,
+        )
+        Hold.objects.create(
+            book=self.book, user=reader, status=Hold.HoldStatus.OFFERED
+        )
+
+        response = self.upload(
+            "title,author,cover,inventory,daily_fee\n"
+            "Dune,Frank Herbert,Hard,7,1.00\n"
+        )
+
+        self.assertEqual(response.data["imported"], 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 5)
+
+    def test_import_is_staff_only(self):
+        user = get_user_model().objects.create_user(
+            email="reader@example.com", password="password123"
+        )
+        self.client.force_authenticate(user=user)
+
+        response = self.upload("title,author,cover,inventory,daily_fee\n")
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_import_books_command(self):
+        rows = [
+            {
+                "title": f"Book {i}",
+                "author": "Author",
+                "cover": "Soft",
+                "inventory": i,
+                "daily_fee": "1.00",
+            }
+            for i in range(5)
+        ]
+        with NamedTemporaryFile("w", suffix=".jsonl") as file:
+            file.write("\n".join(json.dumps(row) for row in rows))
+            file.write("\nnot json\n")
+            file.flush()
+
+            out, err = StringIO(), StringIO()
+            call_command(
+                "import_books", file.name, chunk_size=2, stdout=out, stderr=err
+            )
+
+        self.assertIn("Imported 5 books, rejected 1 rows", out.getvalue())
+        self.assertIn("Row 6", err.getvalue())
+        self.assertEqual(Book.objects.filter(author="Author").count(), 5)
@@ -1,11 +1,140 @@
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from functools import partial
+
+from django.core.cache import cache
+from django.utils.http import parse_etags
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser, IsAuthenticatedOrReadOnly
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
+from books.cache import (
+    CACHE_TIMEOUT,
+    detail_cache_key,
+    etag_for,
+    list_cache_key
+)
+from books.importers import guess_format, import_books, IMPORT_FORMATS
 from books.models import Book
+from books.search import (
+    search_books,
+    SEARCH_RESULTS_LIMIT,
+    MAX_SEARCH_RESULTS
+)
 from books.serializers import BookSerializer
+from library_service.fieldsets import FIELDSET_PARAMETERS, SparseFieldsetMixin
+from library_service.pagination import IdCursorPagination
 
 
-class BookViewSet(ModelViewSet):
+class BookViewSet(SparseFieldsetMixin, ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = IdCursorPagination
+
+    @extend_schema(
+        parameters=FIELDSET_PARAMETERS + [
+            OpenApiParameter(
+                "q",
+                OpenApiTypes.STR,
+                description="Full-text search by title and author, "
+                "results are ranked by relevance instead of paginated",
+            ),
+            OpenApiParameter(
+                "limit",
+                OpenApiTypes.INT,
+                description="Maximum number of search results "
+                f"(up to {MAX_SEARCH_RESULTS})",
+            ),
+        ]
+    )
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request,
+            list_cache_key(request),
+            partial(self.list_books, request, *args, **kwargs)
+        )
+
+    @extend_schema(parameters=FIELDSET_PARAMETERS)
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request,
+            detail_cache_key(request, kwargs[self.lookup_field]),
+            partial(super().retrieve, request, *args, **kwargs)
+        )
+
+    @staticmethod
+    def cached_response(request, cache_key, get_response):
+        """
+        Serve catalogue reads from the cache, ETag follows the cache key
+        so a conditional GET of a cached entry doesn't touch the DB.
+        A missing book raises 404 before the ETag is compared
+        """
+        data = cache.get(cache_key)
+        if data is None:
+            data = get_response().data
+            cache.set(cache_key, data, CACHE_TIMEOUT)
+
+        etag = etag_for(cache_key)
+        if_none_match = request.headers.get("If-None-Match", "")
+        if if_none_match == "*" or etag in parse_etags(if_none_match):
+            return Response(
+                status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+            )
+        return Response(data, headers={"ETag": etag})
+
+    def list_books(self, request, *args, **kwargs):
+        query = request.query_params.get("q")
+        if not query:
+            return super().list(request, *args, **kwargs)
+
+        try:
+            limit = int(
+                request.query_params.get("limit", SEARCH_RESULTS_LIMIT)
+            )
+        except ValueError:
+            raise ValidationError("Invalid limit parameter")
+        limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+
+        books = search_books(query, limit=limit)
+        serializer = self.get_serializer(books, many=True)
+        return Response({"results": serializer.data})
+
+    @extend_schema(
+        request={
+            "multipart/form-data": {
+                "type": "object",
+                "properties": {
+                    "file": {"type": "string", "format": "binary"},
+                    "file_format": {"type": "string", "enum": IMPORT_FORMATS},
+                },
+            }
+        },
+        responses={200: OpenApiTypes.OBJECT},
+    )
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path="import",
+        permission_classes=[IsAdminUser],
+        parser_classes=[MultiPartParser],
+    )
+    def import_books(self, request):
+        """Bulk import of books from a CSV or JSONL file (staff only)"""
+        file = request.FILES.get("file")
+        if file is None:
+            raise ValidationError({"file": "No file was submitted."})
+
+        file_format = request.data.get("file_format") or guess_format(
+            file.name
+        )
+        if file_format not in IMPORT_FORMATS:
+            raise ValidationError(
+                {"file_format": f"Supported formats: {IMPORT_FORMATS}"}
+            )
+
+        return Response(import_books(file, file_format))
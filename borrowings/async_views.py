@@ -0,0 +1,62 @@
+"""
+Async version of borrowing creation, served under ASGI.
+
+Validation and the reservation transaction run in a thread, as
+transactions aren't supported by the async ORM, then the Stripe session
+is created with `httpx` instead of a Celery task, so the reader gets the
+checkout URL in the response. `BorrowingViewSet.create` stays as it is.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import ValidationError
+
+from borrowings.serializers import BorrowingSerializer
+from library_service.throttling import throttle_response
+from payments.async_views import open_checkout_session, unauthorized
+from users.authentication import authenticate_async
+
+
+def _create_borrowing(request, data):
+    serializer = BorrowingSerializer(
+        data=data, context={"request": request, "queue_session": False}
+    )
+    serializer.is_valid(raise_exception=True)
+    return serializer.create(serializer.validated_data)
+
+
+@csrf_exempt
+@require_POST
+async def create_borrowing(request):
+    user = await authenticate_async(request)
+    if user is None:
+        return unauthorized()
+    request.user = user
+    if throttled := await throttle_response(request, "borrow"):
+        return throttled
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"detail": "JSON parse error."}, status=400)
+
+    try:
+        result = await sync_to_async(_create_borrowing)(request, data)
+    except ValidationError as error:
+        return JsonResponse(error.detail, status=400, safe=False)
+
+    borrowing, payment = result["borrowing"], result["payment"]
+    payment.borrowing = borrowing
+
+    return JsonResponse(
+        {
+            "borrowing": borrowing.id,
+            "payment": payment.id,
+            # None if Stripe failed, then poll the payment for it
+            "url": await open_checkout_session(payment),
+        },
+        status=201,
+    )
@@ -0,0 +1,109 @@
+"""
+Waitlist of out of stock books.
+
+Readers queue up for a book instead of polling it. A returned copy does
+not go back to the inventory while someone is waiting, it is offered to
+the head of the queue only, so there is no rush of readers competing for
+one copy. An offer which is not claimed in time, or is cancelled, moves
+on to the next reader in the queue.
+"""
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from books.models import Book
+from borrowings.models import Hold
+
+
+def offer_copy(book_id):
+    """
+    Offer a copy of the book to the first reader in its queue, the copy
+    goes back to the inventory if nobody is waiting. Has to run inside
+    a transaction, returns the offered hold or None
+    """
+    # Concurrent returns of the same book take different readers
+    hold = (
+        Hold.objects.select_for_update(skip_locked=True)
+        .filter(book_id=book_id, status=Hold.HoldStatus.WAITING)
+        .order_by("id")
+        .first()
+    )
+    if hold is None:
+        Book.objects.release(book_id)
+        return None
+
+    hold.status = Hold.HoldStatus.OFFERED
+    hold.expires_at = timezone.now() + timedelta(
+        minutes=settings.HOLD_OFFER_MINUTES
+    )
+    hold.save(update_fields=["status", "expires_at"])
+
+    # Tasks import this module for `expire_offers`
+    from borrowings.tasks import notify_hold_offered
+
+    transaction.on_commit(partial(notify_hold_offered.delay, hold.id))
+
+    return hold
+
+
+def offered_holds(user, book_id):
+    return Hold.objects.filter(
+        user=user,
+        book_id=book_id,
+        status=Hold.HoldStatus.OFFERED,
+        expires_at__gt=timezone.now(),
+    )
+
+
+def claim_hold(user, book_id):
+    """Take the copy offered to the user, returns False if there is none"""
+    return bool(
+        offered_holds(user, book_id).update(status=Hold.HoldStatus.FULFILLED)
+    )
+
+
+def cancel_hold(hold):
+    """Leave the queue, a copy offered to the reader moves on"""
+    with transaction.atomic():
+        # Lock the row, the hold may have been offered in the meantime
+        hold = (
+            Hold.objects.select_for_update()
+            .filter(
+                id=hold.id,
+                status__in=[Hold.HoldStatus.WAITING, Hold.HoldStatus.OFFERED],
+            )
+            .first()
+        )
+        if hold is None:
+            return False
+
+        offered = hold.status == Hold.HoldStatus.OFFERED
+        hold.status = Hold.HoldStatus.CANCELLED
+        hold.save(update_fields=["status"])
+        if offered:
+            offer_copy(hold.book_id)
+
+    return True
+
+
+def expire_offers():
+    """Pass lapsed offers on to the next readers, returns their number"""
+    now = timezone.now()
+    lapsed = Hold.objects.filter(
+        status=Hold.HoldStatus.OFFERED, expires_at__lte=now
+    ).values_list("id", "book_id")
+
+    expired = 0
+    for hold_id, book_id in lapsed:
+        with transaction.atomic():
+            # The reader could have claimed the copy in the meantime
+            if Hold.objects.filter(
+                id=hold_id, status=Hold.HoldStatus.OFFERED
+            ).update(status=Hold.HoldStatus.EXPIRED):
+                offer_copy(book_id)
+                expired += 1
+
+    return expired
@@ -0,0 +1,102 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from borrowings.seeding import (
+    LibrarySeeder,
+    seed_email_domain,
+    SEED_BATCH_SIZE,
+    SEED_PASSWORD
+)
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Fill the database with a synthetic library for scale testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--books", type=int, default=10_000)
+        parser.add_argument("--users", type=int, default=100_000)
+        parser.add_argument("--borrowings", type=int, default=1_000_000)
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Same seed, same library; users get its email domain",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=SEED_BATCH_SIZE
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=365,
+            help="How far back the borrowing history goes",
+        )
+        parser.add_argument(
+            "--zipf",
+            type=float,
+            default=1.1,
+            help="Exponent of the book popularity, higher is more skewed",
+        )
+        parser.add_argument("--active-ratio", type=float, default=0.05)
+        parser.add_argument(
+            "--overdue-ratio",
+            type=float,
+            default=0.3,
+            help="Share of the active borrowings past the return date",
+        )
+        parser.add_argument(
+            "--late-ratio",
+            type=float,
+            default=0.1,
+            help="Share of the returned borrowings returned late",
+        )
+        parser.add_argument("--paid-ratio", type=float, default=0.95)
+        parser.add_argument("--password", default=SEED_PASSWORD)
+
+    def handle(self, *args, **options):
+        domain = seed_email_domain(options["seed"])
+        if User.objects.filter(email__endswith=f"@{domain}").exists():
+            raise CommandError(
+                f"Seed {options['seed']} is already in the database, "
+                "pick another one"
+            )
+        if options["borrowings"] and not (
+            options["books"] and options["users"]
+        ):
+            raise CommandError("Borrowings need books and users")
+
+        seeder = LibrarySeeder(
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            days=options["days"],
+            zipf=options["zipf"],
+            active_ratio=options["active_ratio"],
+            overdue_ratio=options["overdue_ratio"],
+            late_ratio=options["late_ratio"],
+            paid_ratio=options["paid_ratio"],
+        )
+
+        start = time.perf_counter()
+        books = seeder.seed_books(options["books"])
+        self.report(f"Created {len(books)} books", start)
+
+        start = time.perf_counter()
+        user_ids = seeder.seed_users(options["users"], options["password"])
+        self.report(f"Created {len(user_ids)} users", start)
+
+        start = time.perf_counter()
+        borrowings, payments = seeder.seed_borrowings(
+            options["borrowings"], books, user_ids
+        )
+        self.report(
+            f"Created {borrowings} borrowings and {payments} payments", start
+        )
+
+    def report(self, message, start):
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{message} in {time.perf_counter() - start:.1f}s"
+            )
+        )
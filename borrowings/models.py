@@ -1,7 +1,6 @@
 from django.db import models
 
 from books.models import Book
-from borrowings.utils import create_stripe_session_for_fine
 from users.models import User
 
 
@@ -20,6 +19,21 @@ class Borrowing(models.Model):
         related_name="borrowings"
     )
 
+    class Meta:
+        indexes = [
+            # Active borrowing check and `is_active` filter per user
+            models.Index(
+                fields=["user", "actual_return_date"],
+                name="borrowing_user_returned_idx",
+            ),
+            # Only active loans, the overdue scan never reads returned ones
+            models.Index(
+                fields=["expected_return_date"],
+                condition=models.Q(actual_return_date__isnull=True),
+                name="borrowing_active_due_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"Borrowing for {self.book.title} by {self.user.email}"
 
@@ -32,24 +46,67 @@ class Borrowing(models.Model):
         daily_rate = self.book.daily_fee
         return days_borrowed * daily_rate
 
-    def create_fine_payment(self, days_of_overdue):
-        """
-            Creation of fine payment for borrowing
-        """
-        from payments.models import Payment
-
-        daily_fee = self.book.daily_fee  # Daily payment for book
-        fine_amount = days_of_overdue * daily_fee * self.FINE_MULTIPLIER
-
-        # Create Stripe session for fine payment
-        payment = create_stripe_session_for_fine(self, fine_amount)
-
-        # Create record of payment in database
-        Payment.objects.create(
-            borrowing=self,
-            money_to_pay=fine_amount,
-            status=Payment.PaymentStatus.PAID,
-            type=Payment.PaymentType.FINE,
-            session_url=payment['session_url'],
-            session_id=payment['session_id']
-        )
+    def calculate_fine(self, return_date):
+        """Fine for every day past the expected return date"""
+        days_of_overdue = (return_date - self.expected_return_date).days
+        if days_of_overdue <= 0:
+            return 0
+        return days_of_overdue * self.book.daily_fee * self.FINE_MULTIPLIER
+
+
+class Hold(models.Model):
+    """
+    Place in the FIFO waitlist of an out of stock book. A returned copy
+    is offered to the head of the queue for a limited time instead of
+    going back to the inventory
+    """
+
+    class HoldStatus(models.TextChoices):
+        WAITING = "WAITING", "Waiting"
+        OFFERED = "OFFERED", "Offered"
+        FULFILLED = "FULFILLED", "Fulfilled"
+        EXPIRED = "EXPIRED", "Expired"
+        CANCELLED = "CANCELLED", "Cancelled"
+
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE,
+        related_name="holds"
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        related_name="holds"
+    )
+    status = models.CharField(
+        max_length=9,
+        choices=HoldStatus,
+        default=HoldStatus.WAITING
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when a copy is offered, the offer lapses after it
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["book", "user"],
+                condition=models.Q(status__in=["WAITING", "OFFERED"]),
+                name="hold_open_per_user_book",
+            ),
+        ]
+        indexes = [
+            # Head of the queue of a book
+            models.Index(
+                fields=["book", "id"],
+                condition=models.Q(status="WAITING"),
+                name="hold_waiting_queue_idx",
+            ),
+            # Offers to expire
+            models.Index(
+                fields=["expires_at"],
+                condition=models.Q(status="OFFERED"),
+                name="hold_offered_expiry_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Hold of {self.book_id} for {self.user_id}: {self.status}"
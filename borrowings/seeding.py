@@ -0,0 +1,266 @@
+"""
+Synthetic library for scale testing.
+
+Everything is drawn from one seeded RNG, so a seed always gives the same
+library. Book popularity follows Zipf's law, a few titles get most of
+the loans. A share of loans is still active, some of them overdue, and
+late returns are charged a fine, the way `settle_return()` does it.
+
+Rows are generated batch by batch and written with `bulk_create`, memory
+stays flat however many rows are asked for. All users share one
+precomputed password hash, hashing is what makes creating users one by
+one slow.
+"""
+import random
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+
+from books.cache import invalidate_books
+from books.models import Book
+from books.search import index_books
+from borrowings.models import Borrowing
+from payments.models import Payment
+from users.models import User
+
+SEED_BATCH_SIZE = 5000
+SEED_PASSWORD = "library-seed"
+
+ADJECTIVES = (
+    "Silent", "Hidden", "Broken", "Golden", "Last", "Lost", "Northern",
+    "Burning", "Quiet", "Secret", "Endless", "Winter", "Crimson", "Wild",
+)
+NOUNS = (
+    "River", "Kingdom", "Garden", "Letters", "Shadow", "Harbor", "Empire",
+    "Orchard", "Voyage", "Mirror", "Forest", "Bridge", "Winds", "House",
+)
+FIRST_NAMES = (
+    "Olena", "Taras", "Iryna", "Andrii", "Maria", "John", "Emma", "Lesia",
+    "Ivan", "Sofia", "Mykola", "Anna", "Petro", "Olga", "Mark", "Daria",
+)
+LAST_NAMES = (
+    "Shevchenko", "Franko", "Kostenko", "Smith", "Brown", "Ukrainka",
+    "Kotsiubynsky", "Stus", "Zhadan", "Andrukhovych", "Wilson", "Taylor",
+)
+
+
+def seed_email_domain(seed):
+    return f"seed{seed}.library.test"
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+class LibrarySeeder:
+    def __init__(
+        self,
+        seed=0,
+        batch_size=SEED_BATCH_SIZE,
+        days=365,
+        zipf=1.1,
+        active_ratio=0.05,
+        overdue_ratio=0.3,
+        late_ratio=0.1,
+        paid_ratio=0.95,
+    ):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        # Own stream, so the batch size doesn't change the data
+        self.payment_rng = random.Random(f"{seed}-payments")
+        self.batch_size = batch_size
+        self.days = days
+        self.zipf = zipf
+        self.active_ratio = active_ratio
+        self.overdue_ratio = overdue_ratio
+        self.late_ratio = late_ratio
+        self.paid_ratio = paid_ratio
+        self.today = timezone.localdate()
+
+    def seed_books(self, count):
+        rng = self.rng
+        fees = [Decimal(cents) / 100 for cents in range(50, 325, 25)]
+
+        books = []
+        for batch in _batches(range(count), self.batch_size):
+            batch = Book.objects.bulk_create(
+                Book(
+                    # Seed and number keep the natural key unique
+                    title=f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} "
+                    f"({self.seed}-{number})",
+                    author=f"{rng.choice(FIRST_NAMES)} "
+                    f"{rng.choice(LAST_NAMES)}",
+                    cover=rng.choice(Book.CoverType.values),
+                    inventory=rng.randint(1, 20),
+                    daily_fee=rng.choice(fees),
+                )
+                for number in batch
+            )
+            # Bulk writes skip the Book signals
+            index_books(batch)
+            invalidate_books(book.id for book in batch)
+            books.extend(batch)
+        return books
+
+    def seed_users(self, count, password=SEED_PASSWORD):
+        password = make_password(password)
+        domain = seed_email_domain(self.seed)
+
+        user_ids = []
+        for batch in _batches(range(count), self.batch_size):
+            users = User.objects.bulk_create(
+                User(email=f"reader{number}@{domain}", password=password)
+                for number in batch
+            )
+            user_ids.extend(user.id for user in users)
+        return user_ids
+
+    def seed_borrowings(self, count, books, user_ids):
+        """Returns the numbers of borrowings and payments"""
+        rng = self.rng
+
+        # Popularity doesn't follow the order of the catalogue
+        ranked = rng.sample(books, len(books))
+        cum_weights = list(
+            accumulate(
+                1 / rank ** self.zipf for rank in range(1, len(ranked) + 1)
+            )
+        )
+
+        # A reader has one active borrowing at most, the last ones are
+        # active, each of a different reader
+        active = min(int(count * self.active_ratio), len(user_ids))
+        active_users = rng.sample(user_ids, active)
+        first_active = count - active
+
+        def rows(numbers):
+            for number in numbers:
+                book = rng.choices(ranked, cum_weights=cum_weights)[0]
+                if number >= first_active:
+                    user_id = active_users[number - first_active]
+                else:
+                    user_id = rng.choice(user_ids)
+                yield self._borrowing(
+                    book, user_id, is_active=number >= first_active
+                )
+
+        payments = 0
+        for batch in _batches(range(count), self.batch_size):
+            borrowings = Borrowing.objects.bulk_create(rows(batch))
+            payments += self._create_payments(
+                [
+                    payment
+                    for borrowing in borrowings
+                    for payment in self._payments(borrowing)
+                ]
+            )
+        return count, payments
+
+    def _create_payments(self, payments):
+        """
+        Inserted with plain SQL, so every row is written once with the
+        generated `created_at`. `bulk_create()` would let `auto_now_add`
+        replace it with the current time
+        """
+        fields = [
+            field for field in Payment._meta.concrete_fields
+            if not field.primary_key
+        ]
+        columns = ", ".join(
+            connection.ops.quote_name(field.column) for field in fields
+        )
+        placeholders = ", ".join(["%s"] * len(fields))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {Payment._meta.db_table} ({columns}) "
+                f"VALUES ({placeholders})",
+                [
+                    [
+                        field.get_db_prep_save(
+                            getattr(payment, field.attname), connection
+                        )
+                        for field in fields
+                    ]
+                    for payment in payments
+                ]
+            )
+        return len(payments)
+
+    def _borrowing(self, book, user_id, is_active):
+        rng = self.rng
+        duration = rng.randint(3, 21)
+
+        if is_active:
+            if rng.random() < self.overdue_ratio:
+                ago = rng.randint(duration + 1, duration + 60)
+            else:
+                ago = rng.randint(0, duration)
+            actual_return_date = None
+        elif rng.random() < self.late_ratio:
+            ago = rng.randint(duration + 31, max(self.days, duration + 31))
+            late_by = rng.randint(1, 30)
+        else:
+            ago = rng.randint(duration, max(self.days, duration))
+            late_by = -rng.randint(0, duration)
+
+        borrow_date = self.today - timedelta(days=ago)
+        expected_return_date = borrow_date + timedelta(days=duration)
+        if not is_active:
+            actual_return_date = expected_return_date + timedelta(
+                days=late_by
+            )
+
+        return Borrowing(
+            book=book,
+            user_id=user_id,
+            borrow_date=borrow_date,
+            expected_return_date=expected_return_date,
+            actual_return_date=actual_return_date,
+        )
+
+    def _payment(self, borrowing, payment_type, money_to_pay, day):
+        rng = self.payment_rng
+        created_at = datetime.combine(
+            day, time.min, tzinfo=dt_timezone.utc
+        ) + timedelta(seconds=rng.randint(8 * 3600, 20 * 3600))
+
+        paid = rng.random() < self.paid_ratio
+        session_id = f"cs_seed_{payment_type.lower()}_{borrowing.id}"
+        return Payment(
+            borrowing=borrowing,
+            type=payment_type,
+            status=Payment.PaymentStatus.PAID
+            if paid
+            else Payment.PaymentStatus.PENDING,
+            money_to_pay=money_to_pay,
+            session_id=session_id,
+            session_url=f"https://checkout.stripe.com/c/pay/{session_id}",
+            created_at=created_at,
+            paid_at=created_at + timedelta(seconds=rng.randint(30, 3600))
+            if paid
+            else None,
+        )
+
+    def _payments(self, borrowing):
+        yield self._payment(
+            borrowing,
+            Payment.PaymentType.PAYMENT,
+            borrowing.calculate_amount_to_pay(),
+            borrowing.borrow_date,
+        )
+
+        if borrowing.actual_return_date is not None:
+            fine = borrowing.calculate_fine(borrowing.actual_return_date)
+            if fine:
+                yield self._payment(
+                    borrowing,
+                    Payment.PaymentType.FINE,
+                    fine,
+                    borrowing.actual_return_date,
+                )
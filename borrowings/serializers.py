@@ -1,13 +1,30 @@
+from collections import Counter, defaultdict
+from functools import partial
+from uuid import uuid4
+
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 from books.models import Book
 from books.serializers import BookSerializer
-from borrowings.models import Borrowing
-from borrowings.telegram import send_telegram_message
-from borrowings.utils import create_stripe_session
+from borrowings.holds import claim_hold, offered_holds
+from borrowings.models import Borrowing, Hold
+from borrowings.tasks import checkout_digest, notify
+from borrowings.utils import create_pending_payment
+from library_service.fieldsets import SparseFieldsetSerializerMixin
+from payments.models import Payment
 from payments.serializers import PaymentSerializer
+from payments.tasks import create_batch_payment_session
+from users.models import User
+
+BATCH_BORROWING_LIMIT = 200
 
 
-class BorrowingSerializer(serializers.ModelSerializer):
+class BorrowingSerializer(
+    SparseFieldsetSerializerMixin, serializers.ModelSerializer
+):
+    expandable_fields = ("book", "payments")
+
     book = BookSerializer(read_only=True)
     book_id = serializers.PrimaryKeyRelatedField(
         queryset=Book.objects.all(),
@@ -35,9 +52,15 @@ class BorrowingSerializer(serializers.ModelSerializer):
         user = self.context["request"].user
         book = data["book"]
 
-        # Checking if book is available
-        if book.inventory <= 0:
-            raise serializers.ValidationError("This book is out of stock.")
+        # Checking if book is available, a copy may be held for the user
+        if (
+            book.inventory <= 0
+            and not offered_holds(user, book.id).exists()
+        ):
+            raise serializers.ValidationError(
+                "This book is out of stock. Join the waitlist to get "
+                "notified when a copy is returned."
+            )
 
         # Checking if user has an active borrowing
         active_borrowings = Borrowing.objects.filter(
@@ -57,18 +80,33 @@ class BorrowingSerializer(serializers.ModelSerializer):
         and connect current"""
         book = validated_data["book"]
 
-        # Decrease amount of books for 1
-        book.inventory -= 1
-        book.save()
-
         # Add current user to borrowing
         user = self.context["request"].user
 
         validated_data.pop("user", None)
-        borrowing = Borrowing.objects.create(user=user, **validated_data)
 
-        # Call func for creation session Stripe
-        session = create_stripe_session(borrowing)
+        # Reservation, borrowing and payment are committed all together
+        with transaction.atomic():
+            # Copy held for the user is taken first. `validate()` saw
+            # a possibly stale inventory, the conditional UPDATE
+            # is the real check
+            if not (
+                claim_hold(user, book.id) or Book.objects.reserve(book.id)
+            ):
+                raise serializers.ValidationError(
+                    "This book is out of stock."
+                )
+
+            borrowing = Borrowing.objects.create(user=user, **validated_data)
+
+            # Stripe session is created by a Celery task after commit,
+            # unless the view creates it itself
+            payment = create_pending_payment(
+                borrowing,
+                borrowing.calculate_amount_to_pay(),
+                Payment.PaymentType.PAYMENT,
+                queue_session=self.context.get("queue_session", True),
+            )
 
         message = (
             f"New borrowing created:\n"
@@ -78,10 +116,151 @@ class BorrowingSerializer(serializers.ModelSerializer):
             f"Expected return date: {borrowing.expected_return_date}"
         )
 
-        send_telegram_message(message)
+        transaction.on_commit(partial(notify, message))
 
-        # Return the borrowing and session URL
+        # Return the borrowing and its pending payment
         return {
             "borrowing": borrowing,
-            "session_url": session.url
+            "payment": payment
+        }
+
+
+class BatchBorrowingItemSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField()
+    book_id = serializers.IntegerField()
+    expected_return_date = serializers.DateField()
+
+
+class BatchBorrowingSerializer(serializers.Serializer):
+    """
+    Desk check-out of many books at once, for one patron or a class.
+    Users and books are looked up with one query each, the inventory
+    is reserved with one UPDATE and borrowings and payments are
+    inserted in bulk. Each patron pays all their books in one Stripe
+    session. Staff lends past the one active borrowing limit of
+    readers, copies held for the waitlist are not claimed
+    """
+
+    borrow_date = serializers.DateField(default=timezone.localdate)
+    items = BatchBorrowingItemSerializer(
+        many=True, allow_empty=False, max_length=BATCH_BORROWING_LIMIT
+    )
+
+    def validate(self, data):
+        items = data["items"]
+        users = User.objects.in_bulk({item["user_id"] for item in items})
+        books = Book.objects.in_bulk({item["book_id"] for item in items})
+
+        errors = []
+        for item in items:
+            item_errors = {}
+            if item["user_id"] not in users:
+                item_errors["user_id"] = "User not found."
+            if item["book_id"] not in books:
+                item_errors["book_id"] = "Book not found."
+            if item["expected_return_date"] <= data["borrow_date"]:
+                item_errors["expected_return_date"] = (
+                    "Must be after the borrow date."
+                )
+            errors.append(item_errors)
+            item["user"] = users.get(item["user_id"])
+            item["book"] = books.get(item["book_id"])
+
+        if any(errors):
+            raise serializers.ValidationError({"items": errors})
+        return data
+
+    def create(self, validated_data):
+        items = validated_data["items"]
+        copies = Counter(item["book"].id for item in items)
+
+        with transaction.atomic():
+            out_of_stock = Book.objects.reserve_many(copies)
+            if out_of_stock:
+                raise serializers.ValidationError(
+                    {"out_of_stock": sorted(out_of_stock)}
+                )
+
+            borrowings = Borrowing.objects.bulk_create(
+                Borrowing(
+                    user=item["user"],
+                    book=item["book"],
+                    borrow_date=validated_data["borrow_date"],
+                    expected_return_date=item["expected_return_date"],
+                )
+                for item in items
+            )
+            # Patron's payments share a batch, the per-payment checkout
+            # endpoints leave its session to the batch task
+            batches = defaultdict(uuid4)
+            payments = Payment.objects.bulk_create(
+                Payment(
+                    borrowing=borrowing,
+                    money_to_pay=borrowing.calculate_amount_to_pay(),
+                    status=Payment.PaymentStatus.PENDING,
+                    type=Payment.PaymentType.PAYMENT,
+                    batch=batches[borrowing.user_id],
+                )
+                for borrowing in borrowings
+            )
+
+            # One Stripe session per patron, created after commit
+            patron_payments = defaultdict(list)
+            for payment in payments:
+                patron_payments[payment.borrowing.user_id].append(
+                    payment.id
+                )
+            for payment_ids in patron_payments.values():
+                transaction.on_commit(
+                    partial(create_batch_payment_session.delay, payment_ids)
+                )
+
+        for message in checkout_digest(borrowings):
+            transaction.on_commit(partial(notify, message))
+
+        return {
+            "borrowings": borrowings,
+            "payments": payments
         }
+
+
+class HoldSerializer(serializers.ModelSerializer):
+    book = BookSerializer(read_only=True)
+    book_id = serializers.PrimaryKeyRelatedField(
+        queryset=Book.objects.all(),
+        source="book",
+        write_only=True
+    )
+
+    class Meta:
+        model = Hold
+        fields = (
+            "id",
+            "book",
+            "book_id",
+            "status",
+            "created_at",
+            "expires_at",
+        )
+        read_only_fields = ("status", "created_at", "expires_at")
+
+    def validate(self, data):
+        user = self.context["request"].user
+        book = data["book"]
+
+        if book.inventory > 0:
+            raise serializers.ValidationError(
+                "This book is available, borrow it instead."
+            )
+
+        open_holds = Hold.objects.filter(
+            user=user,
+            book=book,
+            status__in=[Hold.HoldStatus.WAITING, Hold.HoldStatus.OFFERED],
+        )
+        if open_holds.exists():
+            raise serializers.ValidationError(
+                "You are already on the waitlist of this book."
+            )
+
+        return data
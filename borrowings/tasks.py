@@ -1,24 +1,153 @@
-from datetime import timedelta, datetime
+from datetime import timedelta
+from itertools import islice
 
 from celery import shared_task
+from django.conf import settings
+from django.core.mail import send_mail
+from django.utils import timezone
 
-from borrowings.models import Borrowing
-from borrowings.telegram import send_telegram_message
+from borrowings.holds import expire_offers
+from borrowings.models import Borrowing, Hold
+from borrowings.telegram import (
+    buffer_message,
+    flush_buffer,
+    MESSAGE_LIMIT,
+    TelegramError,
+    TelegramRateLimited
+)
 
+OVERDUE_SCAN_CHUNK_SIZE = 500
 
-@shared_task
-def check_overdue_borrowings():
-    tomorrow = datetime.now() + timedelta(days=1)
-    overdue_borrowings = Borrowing.objects.filter(
-        expected_return_date__lte=tomorrow,
-        actual_return_date__isnull=True
+
+def notify(message):
+    """
+    Queue Telegram message. Messages queued within
+    TELEGRAM_BATCH_WINDOW seconds are merged into one API call
+    """
+    if buffer_message(message):
+        flush_telegram_messages.apply_async(
+            countdown=settings.TELEGRAM_BATCH_WINDOW
+        )
+
+
+@shared_task(bind=True, max_retries=10)
+def flush_telegram_messages(self):
+    try:
+        complete = flush_buffer()
+    except TelegramRateLimited as e:
+        countdown = e.retry_after
+    except TelegramError:
+        # Unsent messages stay buffered, a later flush sends them too
+        countdown = 2 ** self.request.retries
+    else:
+        if complete:
+            return
+        # A message is still being written or another flush is running,
+        # pick it up in a moment
+        countdown = 1
+
+    # Without a broker a retry would run right away, in the request,
+    # and ignore the countdown. The next notify schedules a flush
+    if self.request.is_eager:
+        return
+    raise self.retry(countdown=countdown)
+
+
+def digest(header, lines):
+    """
+    Header and lines in as few Telegram messages as they fit into,
+    every line is listed
+    """
+    messages = []
+    text = header
+
+    for line in lines:
+        if len(text) + 1 + len(line) > MESSAGE_LIMIT:
+            messages.append(text)
+            text = f"{header} (continued)"
+        text = f"{text}\n{line}"
+
+    messages.append(text)
+    return messages
+
+
+def overdue_digest(rows):
+    """Telegram messages for a chunk of overdue borrowings"""
+    return digest(
+        f"Overdue borrowings alert ({len(rows)}):",
+        [
+            f"{email}: {title}, "
+            f"borrowed {borrow_date}, expected {expected_return_date}"
+            for email, title, expected_return_date, borrow_date in rows
+        ],
+    )
+
+
+def checkout_digest(borrowings):
+    """Telegram messages for a desk check-out"""
+    readers = len({borrowing.user_id for borrowing in borrowings})
+    return digest(
+        f"Desk check-out of {len(borrowings)} books "
+        f"for {readers} readers:",
+        [
+            f"{borrowing.user.email}: {borrowing.book.title}, "
+            f"expected {borrowing.expected_return_date}"
+            for borrowing in borrowings
+        ],
     )
-    for borrowing in overdue_borrowings:
-        message = (
-            f"Overdue borrowing alert:\n"
-            f"User: {borrowing.user.email}\n"
-            f"Book: {borrowing.book.title}\n"
-            f"Expected return date: {borrowing.expected_return_date}\n"
-            f"Borrow date: {borrowing.borrow_date}"
+
+
+@shared_task
+def check_overdue_borrowings(chunk_size=OVERDUE_SCAN_CHUNK_SIZE):
+    """
+    Stream active borrowings due by tomorrow in one query (served by the
+    partial `borrowing_active_due_idx` index) and queue a digest per chunk,
+    split into as many messages as it takes
+    """
+    tomorrow = timezone.localdate() + timedelta(days=1)
+    overdue_borrowings = (
+        Borrowing.objects.filter(
+            expected_return_date__lte=tomorrow,
+            actual_return_date__isnull=True
+        )
+        .order_by("expected_return_date", "id")
+        .values_list(
+            "user__email",
+            "book__title",
+            "expected_return_date",
+            "borrow_date",
         )
-        send_telegram_message(message)
+        .iterator(chunk_size=chunk_size)
+    )
+
+    total = 0
+    while rows := list(islice(overdue_borrowings, chunk_size)):
+        for message in overdue_digest(rows):
+            notify(message)
+        total += len(rows)
+
+    return total
+
+
+@shared_task
+def notify_hold_offered(hold_id):
+    """Tell the reader at the head of the waitlist the copy is theirs"""
+    hold = Hold.objects.select_related("book", "user").get(id=hold_id)
+    if hold.status != Hold.HoldStatus.OFFERED:
+        return
+
+    send_mail(
+        subject=f"\"{hold.book.title}\" is waiting for you",
+        message=(
+            f"A copy of \"{hold.book.title}\" by {hold.book.author} "
+            f"is held for you until {hold.expires_at:%Y-%m-%d %H:%M %Z}. "
+            f"Borrow it before then, otherwise it goes to the next reader."
+        ),
+        from_email=None,
+        recipient_list=[hold.user.email],
+    )
+
+
+@shared_task
+def expire_holds():
+    return expire_offers()
@@ -1,24 +1,188 @@
+import logging
+import time
+
 import requests
 from django.conf import settings
+from django.core.cache import cache
 from requests.exceptions import RequestException
 
+from library_service.metrics import track_external_call
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects longer messages
+MESSAGE_LIMIT = 4096
+
+BUFFER_SEQ_KEY = "telegram:buffer:seq"
+BUFFER_SENT_KEY = "telegram:buffer:sent"
+BUFFER_MESSAGE_KEY = "telegram:buffer:message:{}"
+BUFFER_GAP_KEY = "telegram:buffer:gap"
+FLUSH_SCHEDULED_KEY = "telegram:buffer:flush-scheduled"
+FLUSH_LOCK_KEY = "telegram:buffer:flush-lock"
+# A lost flush task must not stop new ones from being scheduled forever
+FLUSH_SCHEDULED_TIMEOUT = 60
+# Longer than a flush can take, a crashed flush frees the lock after it
+FLUSH_LOCK_TIMEOUT = 120
+# A taken sequence number without a message for this long is skipped,
+# its writer died or the cache evicted the message
+GAP_TIMEOUT = 5
+# Seconds to wait after a 429 that doesn't say how long
+RETRY_AFTER = 1
+
+# One pooled session, so messages reuse keep-alive connections to Telegram
+session = requests.Session()
+
+
+class TelegramError(Exception):
+    pass
+
+
+class TelegramRateLimited(TelegramError):
+    def __init__(self, retry_after):
+        super().__init__(f"Telegram rate limit, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def retry_after(response):
+    """
+    Seconds to wait after a 429. Telegram puts them into the JSON body,
+    a proxy in front of it may only set the Retry-After header
+    """
+    try:
+        return int(response.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        pass
+    try:
+        return int(response.headers.get("Retry-After", RETRY_AFTER))
+    except ValueError:
+        return RETRY_AFTER
+
 
 def send_telegram_message(message):
     bot_token = settings.TELEGRAM_BOT_TOKEN
     chat_id = settings.TELEGRAM_CHAT_ID
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+    url = f"{settings.TELEGRAM_API_URL}/bot{bot_token}/sendMessage"
     payload = {
         "chat_id": chat_id,
         "text": message,
     }
 
     try:
-        response = requests.post(url, data=payload, timeout=10)
+        with track_external_call("telegram"):
+            response = session.post(url, data=payload, timeout=10)
+        if response.status_code == 429:
+            raise TelegramRateLimited(retry_after(response))
         # Raises an exception for 4xx/5xx responses
         response.raise_for_status()
     except RequestException as e:
         """Logging of exception for further analysis"""
-        print(f"Failed to send Telegram message: {e}")
-        return None
+        logger.error(f"Failed to send Telegram message: {e}")
+        raise TelegramError(str(e)) from e
 
     return response.json()
+
+
+def buffer_message(message):
+    """
+    Put message into the shared buffer. Returns True for the first message
+    of a batch window, the caller has to schedule a flush for it
+    """
+    cache.add(BUFFER_SEQ_KEY, 0, timeout=None)
+    seq = cache.incr(BUFFER_SEQ_KEY)
+    cache.set(BUFFER_MESSAGE_KEY.format(seq), message, timeout=None)
+
+    return cache.add(
+        FLUSH_SCHEDULED_KEY, True, timeout=FLUSH_SCHEDULED_TIMEOUT
+    )
+
+
+def merge_messages(messages):
+    """
+    Join (seq, message) pairs into as few Telegram messages as possible.
+    Returns (text, last seq in the text) pairs
+    """
+    batches = []
+    text, last_seq = "", None
+
+    for seq, message in messages:
+        message = message[:MESSAGE_LIMIT]
+        if text and len(text) + 2 + len(message) > MESSAGE_LIMIT:
+            batches.append((text, last_seq))
+            text = ""
+        text = f"{text}\n\n{message}" if text else message
+        last_seq = seq
+
+    if text:
+        batches.append((text, last_seq))
+    return batches
+
+
+def _gap_expired(seq):
+    """Whether the missing message `seq` has been waited for long enough"""
+    gap = cache.get(BUFFER_GAP_KEY)
+    if gap is None or gap[0] != seq:
+        cache.set(BUFFER_GAP_KEY, (seq, time.time()), timeout=None)
+        return False
+    return time.time() - gap[1] >= GAP_TIMEOUT
+
+
+def flush_buffer():
+    """
+    Send everything buffered so far. Returns False if the buffer holds
+    a message that is still being written, or another flush is running,
+    the flush has to be repeated. Messages are deleted only once sent
+    """
+    if not cache.add(FLUSH_LOCK_KEY, True, timeout=FLUSH_LOCK_TIMEOUT):
+        return False
+
+    try:
+        return _flush_buffer()
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
+
+
+def _flush_buffer():
+    # Messages buffered from now on schedule the next flush
+    cache.delete(FLUSH_SCHEDULED_KEY)
+
+    sent = cache.get(BUFFER_SENT_KEY, 0)
+    last = cache.get(BUFFER_SEQ_KEY, 0)
+    keys = {
+        seq: BUFFER_MESSAGE_KEY.format(seq)
+        for seq in range(sent + 1, last + 1)
+    }
+    buffered = cache.get_many(keys.values())
+
+    messages = []
+    # Last sequence number either read or given up on
+    reached = sent
+    for seq, key in keys.items():
+        if key in buffered:
+            messages.append((seq, buffered[key]))
+        elif _gap_expired(seq):
+            logger.warning(f"Telegram message {seq} was lost, skipping it")
+        else:
+            # Sequence number is taken, but the message isn't stored yet
+            break
+        reached = seq
+
+    for text, last_seq in merge_messages(messages):
+        try:
+            send_telegram_message(text)
+        except TelegramError:
+            # Keep later messages from scheduling a competing flush,
+            # the failed ones stay buffered for the retry
+            cache.set(
+                FLUSH_SCHEDULED_KEY, True, timeout=FLUSH_SCHEDULED_TIMEOUT
+            )
+            raise
+
+        cache.set(BUFFER_SENT_KEY, last_seq, timeout=None)
+        cache.delete_many(
+            [keys[seq] for seq in range(sent + 1, last_seq + 1)]
+        )
+        sent = last_seq
+
+    if reached > sent:
+        cache.set(BUFFER_SENT_KEY, reached, timeout=None)
+    return reached == last
@@ -1,11 +1,50 @@
+import csv
+import gzip
+import json
+import threading
+import time
+from base64 import b64decode
 from datetime import date, timedelta
+from io import StringIO
+from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qs, urlparse
 
+from celery.exceptions import Retry
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from requests.exceptions import RequestException
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
 
 from books.models import Book
-from borrowings.models import Borrowing
+from borrowings.models import Borrowing, Hold
+from borrowings.tasks import (
+    check_overdue_borrowings,
+    expire_holds,
+    flush_telegram_messages,
+    overdue_digest
+)
+from borrowings.telegram import (
+    BUFFER_SEQ_KEY,
+    buffer_message,
+    flush_buffer,
+    FLUSH_LOCK_KEY,
+    GAP_TIMEOUT,
+    MESSAGE_LIMIT,
+    send_telegram_message,
+    TelegramError,
+    TelegramRateLimited
+)
+from payments.models import Payment
+from payments.tasks import create_payment_session
+from payments.tests.fake_stripe import FakeStripe
 from users.models import User
 
 
@@ -78,6 +117,81 @@ class PrivateBorrowingApiTests(APITestCase):
         self.assertEqual(borrowing.book, self.book)
         self.assertEqual(borrowing.user, self.user)
 
+        # Payment is pending until Stripe session is created in background
+        payment = Payment.objects.get(id=response.data["payment"])
+        self.assertEqual(payment.borrowing, borrowing)
+        self.assertEqual(payment.status, Payment.PaymentStatus.PENDING)
+        self.assertEqual(payment.session_url, "")
+
+    def test_list_borrowings_cursor_pagination(self):
+        """Test walking borrowings of the same day page by page"""
+        Borrowing.objects.bulk_create(
+            Borrowing(
+                book=self.book,
+                user=self.user,
+                borrow_date=date.today(),
+                expected_return_date=date.today() + timedelta(days=7),
+                actual_return_date=date.today(),
+            )
+            for _ in range(25)
+        )
+
+        ids = []
+        response = self.client.get(self.borrow_url, {"page_size": 10})
+        while True:
+            ids += [borrowing["id"] for borrowing in response.data["results"]]
+            if response.data["next"] is None:
+                break
+            # Every page is a keyset lookup, the cursor has no offset
+            cursor = parse_qs(urlparse(response.data["next"]).query)
+            self.assertNotIn(
+                "o", parse_qs(b64decode(cursor["cursor"][0]).decode())
+            )
+            response = self.client.get(response.data["next"])
+
+        self.assertEqual(
+            ids,
+            list(
+                Borrowing.objects.order_by("-id").values_list("id", flat=True)
+            ),
+        )
+
+    async def test_async_create_borrowing(self):
+        """Async path returns the checkout URL right away"""
+        url = reverse("borrowings:borrowing-create-async")
+        data = {
+            "book_id": self.book.id,
+            "borrow_date": str(date.today()),
+            "expected_return_date": str(date.today() + timedelta(days=7)),
+        }
+        headers = {"Authorize": f"Bearer {AccessToken.for_user(self.user)}"}
+
+        response = await self.async_client.post(
+            url, data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 401)
+
+        with FakeStripe() as fake_stripe:
+            response = await self.async_client.post(
+                url, data, content_type="application/json", headers=headers
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+            payment = await Payment.objects.aget(id=response.json()["payment"])
+            self.assertEqual(payment.borrowing_id, response.json()["borrowing"])
+            self.assertEqual(response.json()["url"], payment.session_url)
+            self.assertEqual(len(fake_stripe.create_calls), 1)
+
+            await self.book.arefresh_from_db()
+            self.assertEqual(self.book.inventory, 9)
+
+            """Validation errors come back as 400"""
+            response = await self.async_client.post(
+                url, data, content_type="application/json", headers=headers
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(len(fake_stripe.create_calls), 1)
+
     def test_create_borrowing_invalid(self):
         """Test creating a borrowing with invalid data (missing book)"""
         data = {
@@ -98,7 +212,7 @@ class PrivateBorrowingApiTests(APITestCase):
 
         response = self.client.get(self.borrow_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data["results"]), 1)
 
     def test_get_borrowing_detail(self):
         """Test retrieving a single borrowing by id"""
@@ -113,6 +227,80 @@ class PrivateBorrowingApiTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["id"], borrowing.id)
 
+    def test_return_borrowing_releases_copy_once(self):
+        """Test that returning a borrowing twice gives one copy back"""
+        borrowing = Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            borrow_date=date.today(),
+            expected_return_date=date.today() + timedelta(days=7),
+        )
+        url = reverse(
+            "borrowings:borrowing-return-borrow", args=[borrowing.id]
+        )
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.book.refresh_from_db()
+        borrowing.refresh_from_db()
+        self.assertEqual(self.book.inventory, 11)
+        self.assertEqual(borrowing.actual_return_date, date.today())
+
+    def test_late_return_charges_one_fine(self):
+        """Test that a late return writes one pending fine payment"""
+        borrowing = Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            borrow_date=date.today() - timedelta(days=10),
+            expected_return_date=date.today() - timedelta(days=3),
+        )
+        url = reverse(
+            "borrowings:borrowing-return-borrow", args=[borrowing.id]
+        )
+
+        with FakeStripe() as stripe_mock, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # 3 days overdue * daily fee * FINE_MULTIPLIER
+        self.book.refresh_from_db()
+        expected_fine = 3 * self.book.daily_fee * Borrowing.FINE_MULTIPLIER
+        self.assertEqual(response.data["fine_amount"], expected_fine)
+
+        fines = Payment.objects.filter(
+            borrowing=borrowing, type=Payment.PaymentType.FINE
+        )
+        self.assertEqual(fines.count(), 1)
+        fine = fines.get()
+        self.assertEqual(response.data["payment"], fine.id)
+        self.assertEqual(fine.status, Payment.PaymentStatus.PENDING)
+        self.assertEqual(fine.money_to_pay, expected_fine)
+        self.assertEqual(len(stripe_mock.create_calls), 1)
+        self.assertIn(fine.session_id, stripe_mock.sessions)
+
+    def test_return_in_time_has_no_fine(self):
+        borrowing = Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            borrow_date=date.today() - timedelta(days=7),
+            expected_return_date=date.today(),
+        )
+        url = reverse(
+            "borrowings:borrowing-return-borrow", args=[borrowing.id]
+        )
+
+        response = self.client.post(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("payment", response.data)
+        self.assertFalse(
+            Payment.objects.filter(type=Payment.PaymentType.FINE).exists()
+        )
+
     def test_delete_borrowing(self):
         """Test deleting a borrowing"""
         borrowing = Borrowing.objects.create(
@@ -125,3 +313,774 @@ class PrivateBorrowingApiTests(APITestCase):
         response = self.client.delete(url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Borrowing.objects.count(), 0)
+
+
+class BorrowingQueryCountTests(APITestCase):
+    """The list and detail endpoints must not issue queries per row"""
+
+    def setUp(self):
+        self.admin = sample_user(email="admin@email.com", is_staff=True)
+        self.client.force_authenticate(user=self.admin)
+
+        for i in range(5):
+            borrowing = Borrowing.objects.create(
+                book=sample_book(title=f"Book {i}"),
+                user=sample_user(email=f"reader{i}@email.com"),
+                borrow_date=date.today(),
+                expected_return_date=date.today() + timedelta(days=7),
+            )
+            for payment_type in Payment.PaymentType:
+                Payment.objects.create(
+                    borrowing=borrowing,
+                    type=payment_type,
+                    session_url="https://checkout.stripe.com/test",
+                    session_id=f"session_{i}_{payment_type}",
+                    money_to_pay=10,
+                )
+
+    def test_list_query_count_is_constant(self):
+        # borrowings joined with books + one prefetch for all payments
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("borrowings:borrowing-list"))
+
+        self.assertEqual(len(response.data["results"]), 5)
+        self.assertEqual(len(response.data["results"][0]["book"]), 6)
+        self.assertEqual(len(response.data["results"][0]["payments"]), 2)
+
+    def test_detail_query_count_is_constant(self):
+        borrowing = Borrowing.objects.first()
+        url = reverse("borrowings:borrowing-detail", args=[borrowing.id])
+
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+
+        self.assertEqual(len(response.data["payments"]), 2)
+
+    def test_expand_only_requested_relations(self):
+        url = reverse("borrowings:borrowing-list")
+
+        # No join and no prefetch for collapsed relations
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {"expand": ""})
+        borrowing = response.data["results"][0]
+        self.assertIsInstance(borrowing["book"], int)
+        self.assertNotIn("payments", borrowing)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {"expand": "book"})
+        borrowing = response.data["results"][0]
+        self.assertEqual(len(borrowing["book"]), 6)
+        self.assertNotIn("payments", borrowing)
+
+        response = self.client.get(url, {"expand": "user"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sparse_fieldset_narrows_columns(self):
+        url = reverse("borrowings:borrowing-list")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {"fields": "id,book"})
+
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("expected_return_date", queries[0]["sql"])
+        borrowing = response.data["results"][0]
+        self.assertEqual(set(borrowing), {"id", "book"})
+        self.assertEqual(borrowing["book"]["title"][:5], "Book ")
+
+
+@patch("borrowings.telegram.send_telegram_message")
+class BorrowingInventoryConcurrencyTests(TransactionTestCase):
+    """Simultaneous borrowers must never take more copies than exist"""
+
+    copies = 3
+    borrowers = 12
+
+    def setUp(self):
+        self.stripe = FakeStripe()
+        self.stripe.__enter__()
+        self.addCleanup(self.stripe.__exit__)
+
+    def test_concurrent_borrows_do_not_oversell(self, send_telegram_message):
+        book = sample_book(inventory=self.copies)
+        users = [
+            sample_user(email=f"reader{i}@email.com")
+            for i in range(self.borrowers)
+        ]
+        barrier = threading.Barrier(self.borrowers)
+        status_codes = []
+
+        def borrow(user):
+            client = APIClient()
+            client.force_authenticate(user=user)
+            barrier.wait()
+            try:
+                response = client.post(
+                    reverse("borrowings:borrowing-list"),
+                    {
+                        "book_id": book.id,
+                        "borrow_date": date.today(),
+                        "expected_return_date": (
+                            date.today() + timedelta(days=7)
+                        ),
+                    },
+                    format="json",
+                )
+                status_codes.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=borrow, args=(user,)) for user in users
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        book.refresh_from_db()
+        created = status_codes.count(status.HTTP_201_CREATED)
+        self.assertEqual(len(status_codes), self.borrowers)
+        self.assertEqual(created, self.copies)
+        self.assertEqual(book.inventory, 0)
+        self.assertEqual(Borrowing.objects.count(), self.copies)
+        self.assertEqual(
+            Payment.objects.filter(session_id__isnull=False).count(),
+            self.copies
+        )
+
+
+def telegram_response(status_code=200, retry_after=None):
+    response = MagicMock(status_code=status_code, headers={})
+    response.json.return_value = (
+        {"ok": False, "parameters": {"retry_after": retry_after}}
+        if retry_after else {"ok": True}
+    )
+    return response
+
+
+@patch("borrowings.telegram.session.post")
+class TelegramNotificationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_messages_within_window_are_sent_in_one_call(self, post):
+        post.return_value = telegram_response()
+
+        # Only the first message of the window schedules a flush
+        self.assertTrue(buffer_message("first"))
+        self.assertFalse(buffer_message("second"))
+        self.assertFalse(buffer_message("third"))
+
+        flush_telegram_messages.apply()
+
+        post.assert_called_once()
+        self.assertEqual(
+            post.call_args.kwargs["data"]["text"], "first\n\nsecond\n\nthird"
+        )
+
+        # Nothing is sent twice
+        flush_telegram_messages.apply()
+        post.assert_called_once()
+
+    def test_rate_limited_flush_is_retried(self, post):
+        post.return_value = telegram_response(429, retry_after=3)
+        buffer_message("overdue")
+
+        # Without a broker the task runs in the request, it isn't retried
+        # right away against the rate limit
+        flush_telegram_messages.apply()
+        post.assert_called_once()
+
+        # A worker waits as long as Telegram asks
+        with patch.object(
+            flush_telegram_messages, "retry", side_effect=Retry
+        ) as retry:
+            with self.assertRaises(Retry):
+                flush_telegram_messages()
+
+        retry.assert_called_once_with(countdown=3)
+        self.assertEqual(post.call_count, 2)
+
+    def test_rate_limit_without_json_body(self, post):
+        response = telegram_response(429)
+        response.json.side_effect = ValueError("not JSON")
+        response.headers = {"Retry-After": "7"}
+        post.return_value = response
+
+        with self.assertRaises(TelegramRateLimited) as raised:
+            send_telegram_message("overdue")
+        self.assertEqual(raised.exception.retry_after, 7)
+
+        response.headers = {}
+        with self.assertRaises(TelegramRateLimited) as raised:
+            send_telegram_message("overdue")
+        self.assertEqual(raised.exception.retry_after, 1)
+
+    def test_failed_send_keeps_messages(self, post):
+        post.side_effect = [RequestException("down"), telegram_response()]
+        buffer_message("overdue")
+
+        with self.assertRaises(TelegramError):
+            flush_buffer()
+        self.assertTrue(flush_buffer())
+
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(post.call_args.kwargs["data"]["text"], "overdue")
+
+    def test_failed_flush_is_not_retried_in_request(self, post):
+        post.side_effect = RequestException("down")
+        buffer_message("overdue")
+
+        # Without a broker the task runs in the request
+        flush_telegram_messages.apply()
+        post.assert_called_once()
+
+        post.side_effect = None
+        post.return_value = telegram_response()
+        flush_telegram_messages.apply()
+
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(post.call_args.kwargs["data"]["text"], "overdue")
+
+    def test_lost_message_is_skipped(self, post):
+        post.return_value = telegram_response()
+        # Writer died between taking the sequence number and the write
+        cache.add(BUFFER_SEQ_KEY, 0, timeout=None)
+        cache.incr(BUFFER_SEQ_KEY)
+        buffer_message("after")
+
+        self.assertFalse(flush_buffer())
+        post.assert_not_called()
+
+        with patch(
+            "borrowings.telegram.time.time",
+            return_value=time.time() + GAP_TIMEOUT,
+        ):
+            self.assertTrue(flush_buffer())
+        post.assert_called_once()
+        self.assertEqual(post.call_args.kwargs["data"]["text"], "after")
+
+    def test_one_flush_at_a_time(self, post):
+        post.return_value = telegram_response()
+        buffer_message("overdue")
+        cache.add(FLUSH_LOCK_KEY, True)
+
+        self.assertFalse(flush_buffer())
+        post.assert_not_called()
+
+        cache.delete(FLUSH_LOCK_KEY)
+        self.assertTrue(flush_buffer())
+        post.assert_called_once()
+
+    def test_long_batches_are_split(self, post):
+        post.return_value = telegram_response()
+        for i in range(3):
+            buffer_message(str(i) * 3000)
+
+        flush_telegram_messages.apply()
+
+        self.assertEqual(post.call_count, 3)
+
+    def test_borrowing_notification_is_queued_after_commit(self, post):
+        post.return_value = telegram_response()
+        user = sample_user()
+        book = sample_book()
+        self.client.force_authenticate(user=user)
+
+        with FakeStripe(), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("borrowings:borrowing-list"),
+                {
+                    "book_id": book.id,
+                    "borrow_date": date.today(),
+                    "expected_return_date": date.today() + timedelta(days=7),
+                },
+                format="json",
+            )
+
+        post.assert_called_once()
+        self.assertIn(book.title, post.call_args.kwargs["data"]["text"])
+
+
+@patch("borrowings.tasks.notify")
+class OverdueBorrowingsScanTests(APITestCase):
+    def setUp(self):
+        book = sample_book(title="Overdue Book")
+        today = date.today()
+        for i in range(5):
+            Borrowing.objects.create(
+                book=book,
+                user=sample_user(email=f"late{i}@email.com"),
+                borrow_date=today - timedelta(days=20),
+                expected_return_date=today - timedelta(days=i),
+            )
+        # Returned and not yet due borrowings are not reported
+        Borrowing.objects.create(
+            book=book,
+            user=sample_user(email="returned@email.com"),
+            borrow_date=today - timedelta(days=20),
+            expected_return_date=today - timedelta(days=10),
+            actual_return_date=today - timedelta(days=9),
+        )
+        Borrowing.objects.create(
+            book=book,
+            user=sample_user(email="early@email.com"),
+            borrow_date=today,
+            expected_return_date=today + timedelta(days=7),
+        )
+
+    def test_digest_per_chunk_in_one_query(self, notify):
+        with self.assertNumQueries(1):
+            total = check_overdue_borrowings(chunk_size=2)
+
+        self.assertEqual(total, 5)
+        self.assertEqual(notify.call_count, 3)
+        digest = "".join(call.args[0] for call in notify.call_args_list)
+        self.assertIn("late4@email.com: Overdue Book", digest)
+        self.assertNotIn("returned@email.com", digest)
+        self.assertNotIn("early@email.com", digest)
+
+    def test_digest_fits_telegram_limit(self, notify):
+        rows = [
+            ("reader@email.com", "A" * 200, date.today(), date.today())
+        ] * 100
+
+        messages = overdue_digest(rows)
+
+        self.assertGreater(len(messages), 1)
+        for message in messages:
+            self.assertLessEqual(len(message), MESSAGE_LIMIT)
+        # Every row is listed, none is only counted
+        self.assertEqual(
+            sum(message.count("reader@email.com") for message in messages),
+            100,
+        )
+
+
+class BorrowingExportTests(APITestCase):
+    def setUp(self):
+        self.admin = sample_user(email="admin@email.com", is_staff=True)
+        self.client.force_authenticate(user=self.admin)
+        book = sample_book(title="Exported Book")
+        today = date.today()
+        self.active = Borrowing.objects.create(
+            book=book,
+            user=sample_user(email="active@email.com"),
+            borrow_date=today - timedelta(days=3),
+            expected_return_date=today + timedelta(days=4),
+        )
+        self.returned = Borrowing.objects.create(
+            book=book,
+            user=sample_user(email="returned@email.com"),
+            borrow_date=today - timedelta(days=30),
+            expected_return_date=today - timedelta(days=20),
+            actual_return_date=today - timedelta(days=21),
+        )
+        self.url = reverse("borrowings:borrowing-export")
+
+    def test_export_csv_with_filters(self):
+        response = self.client.get(
+            self.url,
+            {"status": "active", "date_from": date.today() - timedelta(7)},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(
+            b"".join(response.streaming_content).decode().splitlines()
+        ))
+        self.assertEqual(rows[0][:3], ["id", "user__email", "book__title"])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][1], "active@email.com")
+
+    def test_export_jsonl_gzip(self):
+        response = self.client.get(
+            self.url, {"file_format": "jsonl", "compress": "true"}
+        )
+
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertIn("borrowings.jsonl.gz", response["Content-Disposition"])
+        lines = gzip.decompress(
+            b"".join(response.streaming_content)
+        ).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)["id"] for line in lines],
+            [self.active.id, self.returned.id],
+        )
+
+    def test_export_is_staff_only(self):
+        self.client.force_authenticate(user=sample_user())
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_rejects_invalid_filters(self):
+        for params in (
+            {"date_to": "yesterday"},
+            {"status": "lost"},
+            {"file_format": "xml"},
+        ):
+            response = self.client.get(self.url, params)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
+
+
+class WaitlistTests(APITestCase):
+    def setUp(self):
+        self.book = sample_book(inventory=0)
+        self.first = sample_user(email="first@email.com")
+        self.second = sample_user(email="second@email.com")
+        self.loan = Borrowing.objects.create(
+            book=self.book,
+            user=sample_user(email="reader@email.com"),
+            borrow_date=date.today(),
+            expected_return_date=date.today() + timedelta(days=7),
+        )
+        self.holds_url = reverse("borrowings:hold-list")
+
+    def join(self, user):
+        self.client.force_authenticate(user=user)
+        return self.client.post(self.holds_url, {"book_id": self.book.id})
+
+    def return_loan(self):
+        self.client.force_authenticate(user=self.loan.user)
+        url = reverse("borrowings:borrowing-return-borrow", args=[self.loan.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def borrow(self, user):
+        self.client.force_authenticate(user=user)
+        return self.client.post(
+            reverse("borrowings:borrowing-list"),
+            {
+                "book_id": self.book.id,
+                "borrow_date": date.today(),
+                "expected_return_date": date.today() + timedelta(days=7),
+            },
+        )
+
+    def test_join_waitlist_once_and_only_when_out_of_stock(self):
+        self.assertEqual(
+            self.join(self.first).status_code, status.HTTP_201_CREATED
+        )
+        self.assertEqual(
+            self.join(self.first).status_code, status.HTTP_400_BAD_REQUEST
+        )
+
+        Book.objects.filter(id=self.book.id).update(inventory=1)
+        self.assertEqual(
+            self.join(self.second).status_code, status.HTTP_400_BAD_REQUEST
+        )
+
+    def test_returned_copy_is_held_for_head_of_queue(self):
+        self.join(self.first)
+        self.join(self.second)
+
+        self.return_loan()
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+        hold = Hold.objects.get(user=self.first)
+        self.assertEqual(hold.status, Hold.HoldStatus.OFFERED)
+        self.assertEqual(
+            Hold.objects.get(user=self.second).status,
+            Hold.HoldStatus.WAITING,
+        )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["first@email.com"])
+
+        # Second reader can't take the copy held for the first one
+        response = self.borrow(self.second)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.borrow(self.first)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        hold.refresh_from_db()
+        self.assertEqual(hold.status, Hold.HoldStatus.FULFILLED)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+
+    def test_lapsed_and_cancelled_offers_move_on(self):
+        self.join(self.first)
+        self.join(self.second)
+        self.return_loan()
+        Hold.objects.filter(user=self.first).update(
+            expires_at=timezone.now() - timedelta(minutes=1)
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(expire_holds(), 1)
+
+        self.assertEqual(
+            Hold.objects.get(user=self.first).status,
+            Hold.HoldStatus.EXPIRED,
+        )
+        hold = Hold.objects.get(user=self.second)
+        self.assertEqual(hold.status, Hold.HoldStatus.OFFERED)
+        self.assertEqual(mail.outbox[-1].to, ["second@email.com"])
+
+        # Nobody else is waiting, the copy goes back to the inventory
+        self.client.force_authenticate(user=self.second)
+        response = self.client.delete(
+            reverse("borrowings:hold-detail", args=[hold.id])
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        hold.refresh_from_db()
+        self.assertEqual(hold.status, Hold.HoldStatus.CANCELLED)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 1)
+
+
+@patch("borrowings.serializers.notify")
+class BatchBorrowingTests(APITestCase):
+    def setUp(self):
+        # Token buckets of the staff user live in the cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.admin = sample_user(email="admin@email.com", is_staff=True)
+        self.client.force_authenticate(user=self.admin)
+        self.url = reverse("borrowings:borrowing-batch")
+        self.due = date.today() + timedelta(days=7)
+        self.books = [
+            sample_book(title=f"Book {i}", inventory=2) for i in range(3)
+        ]
+        self.readers = [
+            sample_user(email=f"reader{i}@email.com") for i in range(3)
+        ]
+
+    def items(self, pairs):
+        return {
+            "items": [
+                {
+                    "user_id": self.readers[reader].id,
+                    "book_id": self.books[book].id,
+                    "expected_return_date": self.due,
+                }
+                for reader, book in pairs
+            ]
+        }
+
+    def test_batch_borrowing(self, notify):
+        # A stack for the first reader, one book for the second
+        pairs = [(0, 0), (0, 1), (0, 2), (1, 0)]
+
+        with FakeStripe() as fake_stripe:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    self.url, self.items(pairs), format="json"
+                )
+
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(response.data["borrowings"]), 4)
+            self.assertEqual(
+                [book.inventory for book in Book.objects.order_by("id")],
+                [0, 1, 1],
+            )
+
+            # One session per reader, paying for all their books
+            self.assertEqual(len(fake_stripe.create_calls), 2)
+            payments = Payment.objects.filter(
+                borrowing__user=self.readers[0]
+            )
+            self.assertEqual(
+                len({payment.session_id for payment in payments}), 1
+            )
+            session = fake_stripe.sessions[payments[0].session_id]
+            self.assertEqual(
+                session.amount_total,
+                sum(int(payment.money_to_pay * 100) for payment in payments),
+            )
+
+            # Paying the session pays every book in it
+            fake_stripe.pay(session.id)
+            response = self.client.get(
+                reverse("payments:payment_success"),
+                {"session_id": session.id},
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(payments.values_list("status", flat=True)),
+            {Payment.PaymentStatus.PAID},
+        )
+
+        notify.assert_called_once()
+        self.assertIn("4 books for 2 readers", notify.call_args.args[0])
+
+    def test_checkout_waits_for_batch_session(self, notify):
+        # Batch session is not created yet, the task runs after commit
+        self.client.post(self.url, self.items([(0, 0), (0, 1)]), format="json")
+        payments = Payment.objects.filter(borrowing__user=self.readers[0])
+        url = reverse(
+            "payments:payment-create-checkout-session",
+            args=[payments[0].borrowing_id],
+        )
+
+        with FakeStripe() as fake_stripe:
+            # A session of its own would charge for the book twice
+            self.assertIsNone(
+                create_payment_session.delay(payments[0].id).get()
+            )
+            self.assertEqual(fake_stripe.create_calls, [])
+
+            self.client.force_authenticate(user=self.readers[0])
+            response = self.client.post(url)
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        # Polling queued the session of the whole batch instead
+        self.assertEqual(len(fake_stripe.create_calls), 1)
+        session_ids = {payment.session_id for payment in payments}
+        self.assertEqual(len(session_ids), 1)
+        self.assertIn(session_ids.pop(), fake_stripe.sessions)
+
+    def test_batch_query_count_is_constant(self, notify):
+        def queries(pairs):
+            with CaptureQueriesContext(connection) as captured:
+                self.client.post(self.url, self.items(pairs), format="json")
+            return len(captured)
+
+        self.assertEqual(
+            queries([(0, 0)]),
+            queries([(1, 1), (1, 2), (2, 1), (2, 2)]),
+        )
+
+    def test_batch_is_all_or_nothing(self, notify):
+        response = self.client.post(
+            self.url, self.items([(0, 0), (1, 0), (2, 0), (0, 1)]),
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["out_of_stock"], [str(self.books[0].id)]
+        )
+        self.assertEqual(Borrowing.objects.count(), 0)
+        self.assertEqual(
+            [book.inventory for book in Book.objects.order_by("id")],
+            [2, 2, 2],
+        )
+        notify.assert_not_called()
+
+    def test_batch_validation(self, notify):
+        data = self.items([(0, 0)])
+        data["items"].append(
+            {
+                "user_id": 0,
+                "book_id": self.books[1].id,
+                "expected_return_date": date.today(),
+            }
+        )
+
+        response = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["items"][0], {})
+        self.assertEqual(
+            set(response.data["items"][1]),
+            {"user_id", "expected_return_date"},
+        )
+
+    def test_batch_is_staff_only(self, notify):
+        self.client.force_authenticate(user=self.readers[0])
+
+        response = self.client.post(
+            self.url, self.items([(0, 0)]), format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class SeedLibraryTests(APITestCase):
+    def setUp(self):
+        # Catalogue lists are cached
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def seed(self, seed=7):
+        call_command(
+            "seed_library",
+            books=20,
+            users=30,
+            borrowings=200,
+            seed=seed,
+            batch_size=64,
+            active_ratio=0.1,
+            late_ratio=0.3,
+            stdout=StringIO(),
+        )
+
+    @staticmethod
+    def snapshot():
+        return list(
+            Borrowing.objects.order_by("id").values_list(
+                "book__title",
+                "user__email",
+                "borrow_date",
+                "expected_return_date",
+                "actual_return_date",
+            )
+        )
+
+    def test_seed_library(self):
+        self.seed()
+
+        self.assertEqual(Book.objects.count(), 20)
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Borrowing.objects.count(), 200)
+        self.assertTrue(
+            User.objects.first().check_password("library-seed")
+        )
+
+        active = Borrowing.objects.filter(actual_return_date__isnull=True)
+        self.assertEqual(active.count(), 20)
+        self.assertEqual(
+            active.values("user").distinct().count(), active.count()
+        )
+
+        self.assertEqual(
+            Payment.objects.filter(type=Payment.PaymentType.PAYMENT).count(),
+            200,
+        )
+        for fine in Payment.objects.filter(type=Payment.PaymentType.FINE):
+            borrowing = fine.borrowing
+            self.assertGreater(
+                borrowing.actual_return_date, borrowing.expected_return_date
+            )
+            self.assertEqual(
+                fine.money_to_pay,
+                borrowing.calculate_fine(borrowing.actual_return_date),
+            )
+        self.assertFalse(
+            Payment.objects.filter(
+                status=Payment.PaymentStatus.PENDING, paid_at__isnull=False
+            ).exists()
+        )
+        # Spread over the history, not stamped with the time of seeding
+        self.assertGreater(
+            Payment.objects.values("created_at__date").distinct().count(), 1
+        )
+
+    def test_seeded_books_are_listed(self):
+        url = reverse("books:book-list")
+        self.assertEqual(self.client.get(url).data["results"], [])
+
+        self.seed()
+
+        self.assertEqual(len(self.client.get(url).data["results"]), 20)
+
+    def test_seed_library_is_deterministic(self):
+        self.seed()
+        first = self.snapshot()
+        Borrowing.objects.all().delete()
+        Book.objects.all().delete()
+        User.objects.all().delete()
+
+        self.seed()
+        self.assertEqual(self.snapshot(), first)
+
+        with self.assertRaises(CommandError):
+            self.seed()
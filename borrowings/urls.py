@@ -1,11 +1,21 @@
 from django.urls import path, include
 from rest_framework import routers
 
-from borrowings.views import BorrowingViewSet
+from borrowings.async_views import create_borrowing
+from borrowings.views import BorrowingViewSet, HoldViewSet
 
 router = routers.DefaultRouter()
 router.register("borrowings", BorrowingViewSet)
+router.register("holds", HoldViewSet)
 
-urlpatterns = [path("", include(router.urls))]
+urlpatterns = [
+    path("", include(router.urls)),
+    # Async (ASGI) version of borrowing creation
+    path(
+        "async/borrowings/",
+        create_borrowing,
+        name="borrowing-create-async"
+    ),
+]
 
 app_name = "borrowings"
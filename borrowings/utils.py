@@ -1,85 +1,68 @@
-from decimal import Decimal
+from functools import partial
 
-import stripe
-from django.conf import settings
-from payments.models import Payment
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-
-def create_stripe_session(borrowing):
+from django.db import transaction
+from django.utils import timezone
 
-    # Use method for calculation of total price
-    total_price = Decimal(borrowing.book.daily_fee) * Decimal(
-        (borrowing.expected_return_date - borrowing.borrow_date).days
-    )
+from borrowings.holds import offer_copy
+from borrowings.models import Borrowing
+from payments.models import Payment
+from payments.tasks import create_payment_session
 
-    # Create Stripe session
-    session = stripe.checkout.Session.create(
-        payment_method_types=["card"],
-        line_items=[
-            {
-                "price_data": {
-                    "currency": "usd",
-                    "product_data": {
-                        "name": borrowing.book.title,
-                    },
-                    # Stripe uses amount in cents
-                    "unit_amount": int(total_price * 100),
-                },
-                "quantity": 1,
-            }
-        ],
-        mode="payment",
-        success_url=settings.STRIPE_SUCCESS_URL,
-        cancel_url=settings.STRIPE_CANCEL_URL,
-        client_reference_id=borrowing.id,
-    )
 
-    # Create new payment and connect it to the Borrowing
-    Payment.objects.create(
+def create_pending_payment(
+    borrowing, money_to_pay, payment_type, queue_session=True
+):
+    """
+    Create pending payment for the borrowing. Stripe session is created
+    by a Celery task once the surrounding transaction commits, the task
+    fills in `session_url` for clients to poll. Async views create
+    the session themselves and pass `queue_session=False`
+    """
+    payment = Payment.objects.create(
         borrowing=borrowing,
-        session_url=session.url,
-        session_id=session.id,
-        money_to_pay=total_price,
+        money_to_pay=money_to_pay,
         status=Payment.PaymentStatus.PENDING,  # Set payment status
-        type=Payment.PaymentType.PAYMENT,  # Set payment type
+        type=payment_type,  # Set payment type
     )
+    if queue_session:
+        transaction.on_commit(
+            partial(create_payment_session.delay, payment.id)
+        )
 
-    return session
+    return payment
 
 
-def create_stripe_session_for_fine(borrowing, fine_amount):
-    stripe.api_key = settings.STRIPE_SECRET_KEY
+class BorrowingAlreadyReturned(Exception):
+    pass
 
-    session = stripe.checkout.Session.create(
-        payment_method_types=["card"],
-        line_items=[
-            {
-                "price_data": {
-                    "currency": "usd",
-                    "product_data": {
-                        "name": f'Stripe Fine Payment for'
-                                f' "{borrowing.book.title}"',
-                    },
-                    "unit_amount": int(fine_amount * 100),  # in cents
-                },
-                "quantity": 1,
-            }
-        ],
-        mode="payment",
-        success_url=settings.STRIPE_SUCCESS_URL,
-        cancel_url=settings.STRIPE_CANCEL_URL,
-        client_reference_id=borrowing.id,
-    )
 
-    Payment.objects.create(
-        borrowing=borrowing,
-        session_url=session.url,
-        session_id=session.id,
-        money_to_pay=fine_amount,
-        status=Payment.PaymentStatus.PENDING,  # Set payment status
-        type=Payment.PaymentType.FINE,  # Set payment type
-    )
+def settle_return(borrowing, return_date=None):
+    """
+    Close the borrowing, give the copy back and charge a fine for a late
+    return in one transaction. Returns the fine payment, None if the book
+    came back in time. Used by the return endpoint
+    """
+    return_date = return_date or timezone.localdate()
+
+    with transaction.atomic():
+        # Only the call that actually closes the borrowing gives
+        # the copy back, a concurrent second return is a no-op
+        returned = Borrowing.objects.filter(
+            pk=borrowing.pk, actual_return_date__isnull=True
+        ).update(actual_return_date=return_date)
+        if not returned:
+            raise BorrowingAlreadyReturned()
+
+        # Goes to the first reader on the waitlist, if there is one
+        offer_copy(borrowing.book_id)
+        borrowing.actual_return_date = return_date
+
+        fine_amount = borrowing.calculate_fine(return_date)
+        if not fine_amount:
+            return None
 
-    return {"session_url": session.url, "session_id": session.id}
+        # The only ledger row for the fine, its Stripe session
+        # is created by a Celery task after commit
+        return create_pending_payment(
+            borrowing, fine_amount, Payment.PaymentType.FINE
+        )
@@ -1,17 +1,42 @@
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-from datetime import datetime
-
-from drf_spectacular.utils import extend_schema
-from rest_framework import viewsets, status
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import (
+    extend_schema,
+    extend_schema_view,
+    OpenApiParameter
+)
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
-from borrowings.models import Borrowing
-from borrowings.serializers import BorrowingSerializer
-from borrowings.telegram import send_telegram_message
-from borrowings.utils import create_stripe_session, create_stripe_session_for_fine
+from borrowings.holds import cancel_hold
+from borrowings.models import Borrowing, Hold
+from borrowings.serializers import (
+    BatchBorrowingSerializer,
+    BorrowingSerializer,
+    HoldSerializer
+)
+from borrowings.utils import BorrowingAlreadyReturned, settle_return
+from library_service.fieldsets import FIELDSET_PARAMETERS, SparseFieldsetMixin
+from library_service.pagination import BorrowingCursorPagination
+from library_service.streaming import (
+    EXPORT_PARAMETERS,
+    export_response,
+    parse_export_params
+)
+
+BORROWING_EXPORT_COLUMNS = (
+    "id",
+    "user__email",
+    "book__title",
+    "borrow_date",
+    "expected_return_date",
+    "actual_return_date",
+)
+BORROWING_EXPORT_STATUSES = ("active", "returned", "overdue")
 
 
 @extend_schema(
@@ -26,21 +51,34 @@ from borrowings.utils import create_stripe_session, create_stripe_session_for_fi
         200: BorrowingSerializer(many=True),
     },
 )
-class BorrowingViewSet(viewsets.ModelViewSet):
-    FINE_MULTIPLIER = 2  # multiplier for fine calculatio
-
-    queryset = Borrowing.objects.select_related("book", "user")
+@extend_schema_view(
+    list=extend_schema(parameters=FIELDSET_PARAMETERS),
+    retrieve=extend_schema(parameters=FIELDSET_PARAMETERS),
+)
+class BorrowingViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
+    # Book and payments are joined by SparseFieldsetMixin when expanded
+    queryset = Borrowing.objects.all()
     serializer_class = BorrowingSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = BorrowingCursorPagination
+
+    @property
+    def throttle_scope(self):
+        """
+        Borrowing a book has its own rate, returns and staff edits
+        fall back to the "read" and "write" ones
+        """
+        if self.action == "create":
+            return "borrow"
+        return None
 
     def get_queryset(self):
         user = self.request.user
+        queryset = super().get_queryset()
 
         """If user is not admin, show only his borrowings"""
         if not user.is_staff:
-            queryset = Borrowing.objects.filter(user=user)
-        else:
-            queryset = Borrowing.objects.all()
+            queryset = queryset.filter(user=user)
 
         """Filtration by parameter 'is_active'"""
         is_active = self.request.query_params.get("is_active")
@@ -61,81 +99,43 @@ class BorrowingViewSet(viewsets.ModelViewSet):
 
         return queryset
 
-    @action(detail=True, methods=["POST"], permission_classes=[IsAuthenticated])
+    @action(
+        detail=True, methods=["POST"], permission_classes=[IsAuthenticated]
+    )
     def return_borrow(self, request, pk=None):
         """Return of book`s borrow"""
         borrowing = self.get_object()
 
         if borrowing.actual_return_date is not None:
-            return Response(
-                {"error": "This borrowing has already been returned."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-
-        # Update date of return
-        borrowing.actual_return_date = timezone.now()
-        # borrowing.save()
-
-        # Check if book returned in time
-        expected_return_datetime = timezone.make_aware(
-            datetime.combine(borrowing.expected_return_date, datetime.min.time())
-        )
-
-        if borrowing.actual_return_date > expected_return_datetime:
-            actual_return_date = borrowing.actual_return_date
-            overdue_duration = actual_return_date - expected_return_datetime
-            days_of_overdue = overdue_duration.days
-
-            # payment for fine amount
-            daily_fee = borrowing.book.daily_fee
-            fine_amount = days_of_overdue * daily_fee * self.FINE_MULTIPLIER
-
-            # Create Stripe session for fine
-            stripe_session = create_stripe_session_for_fine(borrowing, fine_amount)
+            return self._already_returned()
 
-            # Create payment for fine
-            borrowing.create_fine_payment(days_of_overdue)
-            borrowing.book.inventory += 1
-            borrowing.book.save()
-            borrowing.save()
+        try:
+            fine_payment = settle_return(borrowing)
+        except BorrowingAlreadyReturned:
+            return self._already_returned()
 
+        if fine_payment is not None:
             return Response(
                 {
                     "message": "The book has been "
                     "successfully returned with a fine.",
-                    "fine_amount": fine_amount,
-                    "payment_url": stripe_session["session_url"],
+                    "fine_amount": fine_payment.money_to_pay,
+                    "payment": fine_payment.id,
                 },
                 status=status.HTTP_200_OK,
             )
 
-        # Update date of return and increase inventory +1
-        borrowing.book.inventory += 1
-
-        borrowing.book.save()
-
-        borrowing.save()
-
         return Response(
             {"message": "The book has been successfully returned."},
             status=status.HTTP_200_OK,
         )
 
-    def perform_create(self, serializer):
-        """Method for handle of creation borrowing logic"""
-        # Save a new borrow and add user
-        borrowing = serializer.save(user=self.request.user)
-        payment = create_stripe_session(borrowing)  # Create Stripe session
-
-        # If session was successfully created, send message in Telegram
-        if payment:
-            message = (
-                f"New borrow:"
-                f" '{borrowing.book.title}' for user: "
-                f"{borrowing.user.username}. "
-                f"payment: {payment.money_to_pay} USD."
-            )
-            send_telegram_message(message)  # Send msg in Telegram
+    @staticmethod
+    def _already_returned():
+        return Response(
+            {"error": "This borrowing has already been returned."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -145,8 +145,113 @@ class BorrowingViewSet(viewsets.ModelViewSet):
         return Response(
             {
                 "borrowing": result["borrowing"].id,
-                # Return URL of stripe session
-                "session_url": result["session_url"],
+                # Poll the payment for URL of stripe session
+                "payment": result["payment"].id,
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+    @extend_schema(request=BatchBorrowingSerializer)
+    @action(
+        detail=False,
+        methods=["POST"],
+        permission_classes=[IsAdminUser],
+        serializer_class=BatchBorrowingSerializer,
+    )
+    def batch(self, request):
+        """Check out many books for one or many readers (staff only)"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = serializer.create(serializer.validated_data)
+
+        return Response(
+            {
+                "borrowings": [
+                    borrowing.id for borrowing in result["borrowings"]
+                ],
+                # Poll the payments for URLs of stripe sessions
+                "payments": [payment.id for payment in result["payments"]],
             },
             status=status.HTTP_201_CREATED,
         )
+
+    @extend_schema(
+        parameters=EXPORT_PARAMETERS + [
+            OpenApiParameter(
+                "status",
+                OpenApiTypes.STR,
+                enum=BORROWING_EXPORT_STATUSES,
+            ),
+        ],
+        responses={200: OpenApiTypes.BINARY},
+    )
+    @action(detail=False, methods=["GET"], permission_classes=[IsAdminUser])
+    def export(self, request):
+        """Stream borrowings as CSV or JSONL file (staff only)"""
+        params = parse_export_params(request.query_params)
+        queryset = Borrowing.objects.order_by("id")
+
+        """Filtration by borrow date"""
+        if params["date_from"]:
+            queryset = queryset.filter(borrow_date__gte=params["date_from"])
+        if params["date_to"]:
+            queryset = queryset.filter(borrow_date__lte=params["date_to"])
+
+        borrowing_status = request.query_params.get("status")
+        if borrowing_status == "active":
+            queryset = queryset.filter(actual_return_date__isnull=True)
+        elif borrowing_status == "returned":
+            queryset = queryset.filter(actual_return_date__isnull=False)
+        elif borrowing_status == "overdue":
+            queryset = queryset.filter(
+                actual_return_date__isnull=True,
+                expected_return_date__lt=timezone.localdate(),
+            )
+        elif borrowing_status is not None:
+            raise ValidationError(
+                {"status": f"Supported: {BORROWING_EXPORT_STATUSES}"}
+            )
+
+        return export_response(
+            queryset,
+            BORROWING_EXPORT_COLUMNS,
+            "borrowings",
+            params["file_format"],
+            params["compress"],
+        )
+
+
+@extend_schema(
+    summary="Waitlist of out of stock books",
+    description="Join the queue of an out of stock book instead of polling "
+    "it. A returned copy is held for the first reader in the queue, who is "
+    "notified by email and can borrow it until the hold expires.",
+)
+class HoldViewSet(
+    mixins.ListModelMixin,
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.DestroyModelMixin,
+    viewsets.GenericViewSet,
+):
+    queryset = Hold.objects.select_related("book")
+    serializer_class = HoldSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            user=self.request.user
+        ).order_by("-id")
+
+    def perform_create(self, serializer):
+        try:
+            with transaction.atomic():
+                serializer.save(user=self.request.user)
+        except IntegrityError:
+            raise ValidationError(
+                "You are already on the waitlist of this book."
+            )
+
+    def perform_destroy(self, instance):
+        """Cancel the hold, it stays in the history"""
+        cancel_hold(instance)
@@ -0,0 +1,123 @@
+"""
+Sparse fieldsets and opt-in expansion of related objects.
+
+`?fields=id,borrow_date` keeps only the listed fields of a response and
+`?expand=book` embeds only the listed relations, the other expandable
+ones are rendered as their primary key (to-one) or left out (to-many).
+Without `expand` every relation is embedded, as it always was. The
+queryset is narrowed to match: `only()` the needed columns, joins and
+prefetches just for the expanded relations.
+"""
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+FIELDSET_PARAMETERS = [
+    OpenApiParameter(
+        "fields",
+        OpenApiTypes.STR,
+        description="Comma separated fields to return",
+    ),
+    OpenApiParameter(
+        "expand",
+        OpenApiTypes.STR,
+        description="Comma separated relations to embed, "
+        "all of them if not given",
+    ),
+]
+
+
+def _names(value):
+    return [name for name in value.split(",") if name]
+
+
+class SparseFieldsetSerializerMixin:
+    """
+    Takes `fields` and `expand` arguments. `expandable_fields` lists
+    relations which are embedded only when expanded
+    """
+
+    expandable_fields = ()
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if expand is not None:
+            for name in self.expandable_fields:
+                if name in expand or name not in self.fields:
+                    continue
+                if self.Meta.model._meta.get_field(name).many_to_one:
+                    self.fields[name] = serializers.IntegerField(
+                        source=f"{name}_id", read_only=True
+                    )
+                else:
+                    self.fields.pop(name)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class SparseFieldsetMixin:
+    """ViewSet side: parses the parameters and narrows the queryset"""
+
+    def get_fieldset(self):
+        """Requested (fields, expand), None stands for all of them"""
+        if self.request.method not in SAFE_METHODS:
+            return None, None
+
+        fields = self.request.query_params.get("fields")
+        expand = self.request.query_params.get("expand")
+        fields = _names(fields) if fields is not None else None
+        expand = _names(expand) if expand is not None else None
+
+        expandable = self.get_serializer_class().expandable_fields
+        unknown = set(expand or ()) - set(expandable)
+        if unknown:
+            raise ValidationError(
+                {"expand": f"Expandable fields: {', '.join(expandable)}"}
+            )
+        return fields, expand
+
+    def get_serializer(self, *args, **kwargs):
+        fields, expand = self.get_fieldset()
+        if fields is not None:
+            kwargs.setdefault("fields", fields)
+        if expand is not None:
+            kwargs.setdefault("expand", expand)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields, expand = self.get_fieldset()
+        model = queryset.model
+
+        expanded = self.get_serializer_class().expandable_fields
+        if expand is not None:
+            expanded = [name for name in expanded if name in expand]
+        if fields is not None:
+            expanded = [name for name in expanded if name in fields]
+
+        for name in expanded:
+            if model._meta.get_field(name).many_to_one:
+                queryset = queryset.select_related(name)
+            else:
+                queryset = queryset.prefetch_related(name)
+
+        if fields is not None:
+            queryset = queryset.only(*self.get_columns(model, fields))
+        return queryset
+
+    def get_columns(self, model, fields):
+        concrete = {field.name for field in model._meta.concrete_fields}
+        columns = {model._meta.pk.name}
+        columns.update(name for name in fields if name in concrete)
+
+        # Cursor pagination reads the ordering fields of the page edges
+        ordering = getattr(self.pagination_class, "ordering", ())
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        columns.update(name.lstrip("-") for name in ordering)
+        return columns
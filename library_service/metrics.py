@@ -0,0 +1,341 @@
+"""
+Request metrics in the Prometheus text format.
+
+`MetricsMiddleware` records per resolved view (`BorrowingViewSet.create`,
+`stripe_webhook`, ...) the latency histogram, SQL query count and time,
+and time spent calling Stripe and Telegram. Queries are counted by an
+execute wrapper installed on every database connection, outbound calls
+are wrapped in `track_external_call()`.
+
+Samples are added up in one Redis hash with HINCRBYFLOAT, so all worker
+processes and nodes report into the same counters. Without the Redis
+cache the counters are kept per process.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import (
+    iscoroutinefunction,
+    markcoroutinefunction,
+    sync_to_async
+)
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from redis.exceptions import RedisError
+
+from library_service.redis_utils import get_redis, make_key
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = "metrics"
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+# Outbound calls made outside of a request, e.g. by Celery tasks
+BACKGROUND_VIEW = "background"
+
+METRICS = {
+    "http_requests_total": (
+        "counter", "Requests by view, method and status"
+    ),
+    "http_request_duration_seconds": (
+        "histogram", "Request latency by view and method"
+    ),
+    "db_queries_total": ("counter", "SQL queries by view"),
+    "db_query_duration_seconds_total": (
+        "counter", "Time spent in SQL queries by view"
+    ),
+    "external_calls_total": (
+        "counter", "Calls of external services by view"
+    ),
+    "external_call_duration_seconds_total": (
+        "counter", "Time spent calling external services by view"
+    ),
+}
+
+_current = ContextVar("request_metrics", default=None)
+
+# Counters of this process, used when the cache isn't Redis
+_local_samples = defaultdict(float)
+_local_lock = threading.Lock()
+
+
+class RequestMetrics:
+    """What a request spent on the database and external services"""
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.external = defaultdict(lambda: [0, 0.0])
+
+
+def _escape(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\n", "\\n")
+        .replace('"', '\\"')
+    )
+
+
+def sample_name(name, **labels):
+    """`name{label="value",...}`, the field of a sample in the hash"""
+    if not labels:
+        return name
+    labels = ",".join(
+        f'{label}="{_escape(value)}"' for label, value in labels.items()
+    )
+    return f"{name}{{{labels}}}"
+
+
+def increment(samples):
+    """Add {sample name: amount} to the shared counters"""
+    redis = get_redis()
+    if redis is None:
+        with _local_lock:
+            for sample, amount in samples.items():
+                _local_samples[sample] += amount
+        return
+
+    try:
+        pipeline = redis.pipeline(transaction=False)
+        for sample, amount in samples.items():
+            pipeline.hincrbyfloat(make_key(METRICS_KEY), sample, amount)
+        pipeline.execute()
+    except RedisError as error:
+        # Losing a few samples beats failing the request
+        logger.warning(f"Failed to record metrics: {error}")
+
+
+def read_samples():
+    redis = get_redis()
+    if redis is None:
+        with _local_lock:
+            return dict(_local_samples)
+
+    return {
+        sample.decode(): float(amount)
+        for sample, amount in redis.hgetall(make_key(METRICS_KEY)).items()
+    }
+
+
+def reset():
+    redis = get_redis()
+    if redis is None:
+        with _local_lock:
+            _local_samples.clear()
+    else:
+        redis.delete(make_key(METRICS_KEY))
+
+
+def external_samples(view, external):
+    samples = {}
+    for service, (calls, seconds) in external.items():
+        samples[sample_name(
+            "external_calls_total", view=view, service=service
+        )] = calls
+        samples[sample_name(
+            "external_call_duration_seconds_total",
+            view=view,
+            service=service,
+        )] = seconds
+    return samples
+
+
+def request_samples(view, method, status, duration, metrics):
+    samples = {
+        sample_name(
+            "http_requests_total", view=view, method=method, status=status
+        ): 1,
+        sample_name(
+            "http_request_duration_seconds_sum", view=view, method=method
+        ): duration,
+        sample_name(
+            "http_request_duration_seconds_count", view=view, method=method
+        ): 1,
+        sample_name("db_queries_total", view=view): metrics.queries,
+        sample_name(
+            "db_query_duration_seconds_total", view=view
+        ): metrics.query_seconds,
+    }
+    # Buckets are cumulative, an observation counts in all above it.
+    # The others get 0, so a series has every bucket from the start
+    for bucket in (*LATENCY_BUCKETS, "+Inf"):
+        samples[sample_name(
+            "http_request_duration_seconds_bucket",
+            view=view,
+            method=method,
+            le=bucket,
+        )] = int(bucket == "+Inf" or duration <= bucket)
+    samples.update(external_samples(view, metrics.external))
+    return samples
+
+
+@contextmanager
+def track_external_call(service):
+    """Time a call of an external service, like Stripe or Telegram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics = _current.get()
+        if metrics is None:
+            increment(
+                external_samples(BACKGROUND_VIEW, {service: [1, seconds]})
+            )
+        else:
+            metrics.external[service][0] += 1
+            metrics.external[service][1] += seconds
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.query_seconds += time.perf_counter() - start
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+def view_name(request):
+    """`Class.action` for viewsets, class or function name otherwise"""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unresolved"
+
+    view_class = getattr(match.func, "cls", None) or getattr(
+        match.func, "view_class", None
+    )
+    if view_class is None:
+        return match.func.__name__
+
+    actions = getattr(match.func, "actions", None)
+    if actions and request.method.lower() in actions:
+        return f"{view_class.__name__}.{actions[request.method.lower()]}"
+    return view_class.__name__
+
+
+class MetricsMiddleware:
+    """Goes first in MIDDLEWARE, so the latency covers the whole stack"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        # Connections opened before the signal was connected
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        self.record(request, response, time.perf_counter() - start, metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        await sync_to_async(self.record, thread_sensitive=False)(
+            request, response, time.perf_counter() - start, metrics
+        )
+        return response
+
+    @staticmethod
+    def record(request, response, duration, metrics):
+        increment(
+            request_samples(
+                view_name(request),
+                request.method,
+                response.status_code,
+                duration,
+                metrics,
+            )
+        )
+
+
+def _family(sample):
+    name = sample.split("{", 1)[0]
+    for suffix in ("_bucket", "_sum", "_count"):
+        family = name.removesuffix(suffix)
+        if family != name and METRICS.get(family, ("",))[0] == "histogram":
+            return family
+    return name
+
+
+def _sort_key(item):
+    # Buckets go in the order of their bounds, +Inf last
+    sample, _ = item
+    base, _, bound = sample.partition(',le="')
+    return base, float(bound.rstrip('"}')) if bound else 0
+
+
+def _format(amount):
+    return str(int(amount)) if amount.is_integer() else repr(amount)
+
+
+def render_metrics():
+    families = defaultdict(list)
+    for sample, amount in sorted(read_samples().items(), key=_sort_key):
+        families[_family(sample)].append(f"{sample} {_format(amount)}")
+
+    lines = []
+    for family, samples in families.items():
+        metric_type, help_text = METRICS.get(family, ("untyped", ""))
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {metric_type}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """
+    Metrics for Prometheus, behind the METRICS_TOKEN bearer token.
+    Without a token they are only served with DEBUG on
+    """
+    token = settings.METRICS_TOKEN
+    if not token and not settings.DEBUG:
+        return HttpResponse(status=404)
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponse(status=401)
+
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4"
+    )
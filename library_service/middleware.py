@@ -0,0 +1,85 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def accepted_encodings(header):
+    """Encodings from Accept-Encoding the client did not refuse (q=0)"""
+    encodings = set()
+    for item in header.split(","):
+        encoding, _, params = item.strip().partition(";")
+        quality = params.strip().removeprefix("q=")
+        try:
+            refused = params and float(quality) == 0
+        except ValueError:
+            refused = False
+        if encoding and not refused:
+            encodings.add(encoding.strip().lower())
+    return encodings
+
+
+class CompressionMiddleware:
+    """
+    Compress responses above COMPRESSION_MIN_SIZE bytes with brotli
+    (when installed) or gzip, whichever the client accepts. Streaming
+    responses are left alone, exports compress themselves
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    @staticmethod
+    def compress(request, response):
+        if (
+            response.streaming
+            or response.has_header("Content-Encoding")
+            or len(response.content) < settings.COMPRESSION_MIN_SIZE
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encodings = accepted_encodings(
+            request.META.get("HTTP_ACCEPT_ENCODING", "")
+        )
+        if brotli is not None and "br" in encodings:
+            content, encoding = brotli.compress(response.content), "br"
+        elif "gzip" in encodings:
+            # Random bytes in the gzip header mitigate BREACH
+            content, encoding = compress_string(
+                response.content,
+                max_random_bytes=GZipMiddleware.max_random_bytes,
+            ), "gzip"
+        else:
+            return response
+
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response["Content-Length"] = str(len(content))
+        response["Content-Encoding"] = encoding
+        # The body differs per encoding, a strong ETag has to be weakened
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        return response
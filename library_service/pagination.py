@@ -0,0 +1,24 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the primary key: every page is a
+    `WHERE id > <cursor> ORDER BY id LIMIT n` lookup, so deep pages
+    cost the same as the first one
+    """
+
+    ordering = "id"
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class BorrowingCursorPagination(IdCursorPagination):
+    """
+    Newest borrowings first. The cursor only keys on the first ordering
+    field, so it has to be the unique `id`: with `borrow_date` first,
+    borrowings of a busy day would be paged by offset
+    """
+
+    ordering = "-id"
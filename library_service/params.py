@@ -0,0 +1,18 @@
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+
+def parse_date_range(query_params):
+    """Validate optional `date_from` and `date_to` query parameters"""
+    dates = {}
+
+    for name in ("date_from", "date_to"):
+        value = query_params.get(name)
+        try:
+            dates[name] = parse_date(value) if value else None
+        except ValueError:
+            dates[name] = None
+        if value and dates[name] is None:
+            raise ValidationError({name: "Expected date as YYYY-MM-DD."})
+
+    return dates["date_from"], dates["date_to"]
@@ -0,0 +1,19 @@
+"""
+Raw Redis access for features which need more than the cache API,
+like atomic scripts. The Redis behind the default cache is used.
+"""
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+
+def get_redis():
+    """Client of the default cache's Redis, None if the cache isn't Redis"""
+    cache = caches["default"]
+    if not isinstance(cache, RedisCache):
+        return None
+    return cache._cache.get_client(write=True)
+
+
+def make_key(key):
+    """Key with the cache prefix and version, like the cache API makes"""
+    return caches["default"].make_key(key)
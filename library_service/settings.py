@@ -29,7 +29,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv("DJANGO_SECRET_KEY")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.getenv("DJANGO_DEBUG", "True") == "True"
 
 ALLOWED_HOSTS = []
 
@@ -46,17 +46,18 @@ INSTALLED_APPS = [
     "rest_framework",
     "rest_framework_simplejwt",
     "drf_spectacular",
-    "debug_toolbar",
     "books",
     "users",
     "borrowings",
     "payments",
+    "reports",
     "django_celery_beat",
 ]
 
 MIDDLEWARE = [
+    "library_service.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "library_service.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -65,6 +66,16 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# The toolbar middleware is sync only, under ASGI it makes Django run
+# every request in a thread. Keep it to development
+if DEBUG:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index("library_service.middleware.CompressionMiddleware")
+        + 1,
+        "debug_toolbar.middleware.DebugToolbarMiddleware",
+    )
+
 ROOT_URLCONF = "library_service.urls"
 
 TEMPLATES = [
@@ -89,12 +100,56 @@ WSGI_APPLICATION = "library_service.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+if os.getenv("POSTGRES_DB"):
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("POSTGRES_DB"),
+            "USER": os.getenv("POSTGRES_USER"),
+            "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
+            "HOST": os.getenv("POSTGRES_HOST", "localhost"),
+            "PORT": os.getenv("POSTGRES_PORT", "5432"),
+            # Keep connections open between requests
+            # and check them before reuse
+            "CONN_MAX_AGE": int(os.getenv("POSTGRES_CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+            # Transaction pooling in pgbouncer can't keep named cursors
+            # open between transactions
+            "DISABLE_SERVER_SIDE_CURSORS": (
+                os.getenv("POSTGRES_PGBOUNCER", "False") == "True"
+            ),
+            "OPTIONS": {},
+        }
+    }
+
+    if os.getenv("POSTGRES_POOL", "False") == "True":
+        # psycopg pool keeps the connections instead of Django,
+        # persistent connections have to be turned off for it
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.getenv("POSTGRES_POOL_MIN_SIZE", 2)),
+            "max_size": int(os.getenv("POSTGRES_POOL_MAX_SIZE", 10)),
+            "timeout": int(os.getenv("POSTGRES_POOL_TIMEOUT", 10)),
+        }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "OPTIONS": {
+                # Take the write lock when the transaction starts so that
+                # concurrent writers wait for it instead of failing
+                # with "database is locked" on lock upgrade
+                "transaction_mode": "IMMEDIATE",
+                "timeout": 20,
+            },
+            "TEST": {
+                # A file database, so concurrent connections in tests
+                # honour the busy timeout like they do in production
+                "NAME": BASE_DIR / "test_db.sqlite3",
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -146,11 +201,39 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
-
-    )
+        "users.authentication.CachedJWTAuthentication",
+    ),
+    "DEFAULT_RENDERER_CLASSES": (
+        "library_service.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "library_service.renderers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
+    # Token buckets per user or IP, see library_service/throttling.py
+    "DEFAULT_THROTTLE_CLASSES": (
+        "library_service.throttling.TokenBucketThrottle",
+    ),
+    # Load tests raise them with THROTTLE_RATE_<SCOPE> variables
+    "DEFAULT_THROTTLE_RATES": {
+        "read": os.getenv("THROTTLE_RATE_READ", "300/min"),
+        "write": os.getenv("THROTTLE_RATE_WRITE", "60/min"),
+        "borrow": os.getenv("THROTTLE_RATE_BORROW", "10/min"),
+        # Endpoints which call Stripe
+        "stripe": os.getenv("THROTTLE_RATE_STRIPE", "20/min"),
+    },
 }
 
+# Responses smaller than this are not worth compressing. Brotli is used
+# when the `brotli` package is installed, gzip otherwise
+COMPRESSION_MIN_SIZE = 1024
+
+# Bearer token Prometheus has to send to scrape /metrics. Without it
+# /metrics is open with DEBUG on and answers 404 otherwise
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "library_service_api",
     "DESCRIPTION": "Documentation for library_service_api",
@@ -171,25 +254,79 @@ SIMPLE_JWT = {
     "AUTH_HEADER_NAME": "HTTP_AUTHORIZE",
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+REDIS_URL = os.getenv("REDIS_URL")
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+# Messages queued within this many seconds are sent in one API call
+TELEGRAM_BATCH_WINDOW = int(os.getenv("TELEGRAM_BATCH_WINDOW", 5))
+
+# Readers on a waitlist are notified by email
+EMAIL_BACKEND = os.getenv(
+    "EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend"
+)
+EMAIL_HOST = os.getenv("EMAIL_HOST", "localhost")
+EMAIL_PORT = int(os.getenv("EMAIL_PORT", 25))
+EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER", "")
+EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD", "")
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "False") == "True"
+DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "library@localhost")
+
+# How long a returned copy is held for the first reader on the waitlist
+HOLD_OFFER_MINUTES = int(os.getenv("HOLD_OFFER_MINUTES", 120))
 
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
 CELERY_TIMEZONE = "Europe/Kyiv"
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+# Without a broker (local runs, tests) tasks are executed in-process
+CELERY_TASK_ALWAYS_EAGER = not CELERY_BROKER_URL
 
 CELERY_BEAT_SCHEDULE = {
     "check-overdue-borrowings-every-day": {
         "task": "borrowings.tasks.check_overdue_borrowings",
         "schedule": crontab(hour="21", minute="02")
     },
+    "update-daily-rollups-every-hour": {
+        "task": "reports.tasks.update_daily_rollups",
+        "schedule": crontab(minute="5")
+    },
+    "expire-holds-every-minute": {
+        "task": "borrowings.tasks.expire_holds",
+        "schedule": crontab(minute="*")
+    },
+    # Picks up webhook events whose processing task got lost
+    "process-stripe-events-every-minute": {
+        "task": "payments.tasks.process_stripe_events",
+        "schedule": crontab(minute="*")
+    },
 }
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY")
 STRIPE_ENDPOINT_SECRET_KEY = os.getenv("STRIPE_ENDPOINT_SECRET_KEY")
+# REST API used by the async views, which don't go through the SDK
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "https://api.stripe.com")
+STRIPE_API_TIMEOUT = float(os.getenv("STRIPE_API_TIMEOUT", 10))
 
 STRIPE_SUCCESS_URL = (
     "http://localhost:8000/api/payments/"
@@ -0,0 +1,288 @@
+import gzip
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from io import BytesIO
+from unittest.mock import patch
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.base import BaseHandler
+from django.test import override_settings, SimpleTestCase
+from django.urls import reverse
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from books.models import Book
+from library_service import metrics
+from library_service.middleware import accepted_encodings
+from library_service.renderers import FastJSONParser, FastJSONRenderer
+from library_service.throttling import TokenBucketThrottle
+from payments.tests.fake_stripe import FakeStripe
+from users.models import User
+
+
+class FastJSONTests(APITestCase):
+    def test_renderer_matches_drf(self):
+        data = {
+            "fee": Decimal("1.50"),
+            "day": date(2024, 10, 1),
+            "at": datetime(2024, 10, 1, 12, 30, 5, 123456, timezone.utc),
+            "label": gettext_lazy("Hardcover"),
+            "rows": [{"id": 1, "title": "Кобзар"}],
+        }
+
+        self.assertEqual(
+            FastJSONRenderer().render(data), JSONRenderer().render(data)
+        )
+
+    def test_renderer_pretty_prints_through_drf(self):
+        rendered = FastJSONRenderer().render(
+            {"id": 1}, "application/json; indent=4"
+        )
+
+        self.assertEqual(rendered, b'{\n    "id": 1\n}')
+
+    def test_parser(self):
+        parser = FastJSONParser()
+
+        self.assertEqual(
+            parser.parse(BytesIO('{"title": "Кобзар"}'.encode())),
+            {"title": "Кобзар"},
+        )
+        with self.assertRaises(ParseError):
+            parser.parse(BytesIO(b"{not json"))
+
+
+class CompressionMiddlewareTests(APITestCase):
+    def setUp(self):
+        Book.objects.bulk_create(
+            Book(
+                title=f"Book {i}",
+                author="Author",
+                inventory=1,
+                daily_fee="1.00"
+            )
+            for i in range(50)
+        )
+        self.url = reverse("books:book-list")
+
+    def test_large_response_is_gzipped(self):
+        response = self.client.get(
+            self.url, {"page_size": 50}, HTTP_ACCEPT_ENCODING="gzip, br;q=0"
+        )
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertIn(b"Book 49", gzip.decompress(response.content))
+
+    def test_small_or_unaccepted_responses_are_not_compressed(self):
+        response = self.client.get(
+            self.url, {"page_size": 1}, HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+        response = self.client.get(self.url, {"page_size": 50})
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    async def test_large_async_response_is_gzipped(self):
+        response = await self.async_client.get(
+            self.url, {"page_size": 50}, headers={"Accept-Encoding": "gzip"}
+        )
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn(b"Book 49", gzip.decompress(response.content))
+
+    def test_accepted_encodings(self):
+        self.assertEqual(
+            accepted_encodings("gzip;q=0.8, br;q=0, deflate, identity"),
+            {"gzip", "deflate", "identity"},
+        )
+
+
+# The stack with DEBUG off, the debug toolbar is added for development.
+# DEBUG on makes Django log every middleware it has to adapt
+@override_settings(
+    DEBUG=True,
+    MIDDLEWARE=[
+        middleware for middleware in settings.MIDDLEWARE
+        if not middleware.startswith("debug_toolbar")
+    ],
+)
+class AsyncMiddlewareTests(SimpleTestCase):
+    def test_async_chain_is_not_adapted(self):
+        handler = BaseHandler()
+        with self.assertNoLogs("django.request", "DEBUG"):
+            handler.load_middleware(is_async=True)
+
+        # Async views are awaited without a thread in between
+        self.assertTrue(iscoroutinefunction(handler._middleware_chain))
+
+
+@override_settings(
+    REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        "DEFAULT_THROTTLE_RATES": {"read": "2/min", "borrow": "1/min"},
+    }
+)
+class TokenBucketThrottleTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.now = 1000.0
+        patcher = patch.object(
+            TokenBucketThrottle, "timer", lambda throttle: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bucket_refills_over_time(self):
+        url = reverse("books:book-list")
+
+        for _ in range(2):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        # One token is refilled every 30 seconds
+        self.assertEqual(response["Retry-After"], "30")
+
+        self.now += 30
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 429)
+
+    def test_scopes_and_users_have_own_buckets(self):
+        user = User.objects.create_user(email="reader@test.com", password="x")
+        other = User.objects.create_user(email="other@test.com", password="x")
+        url = reverse("borrowings:borrowing-list")
+
+        self.client.force_authenticate(user)
+        self.client.post(url, {}, format="json")
+        self.assertEqual(
+            self.client.post(url, {}, format="json").status_code, 429
+        )
+        # Reads are limited separately
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.client.force_authenticate(other)
+        self.assertEqual(
+            self.client.post(url, {}, format="json").status_code, 400
+        )
+
+    def test_only_borrowing_uses_borrow_bucket(self):
+        user = User.objects.create_user(email="reader@test.com", password="x")
+        self.client.force_authenticate(user)
+
+        self.client.post(reverse("borrowings:borrowing-list"), {})
+        response = self.client.post(
+            reverse("borrowings:borrowing-return-borrow", args=[1])
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(METRICS_TOKEN="secret")
+class MetricsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def scrape(self):
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def samples(self):
+        return dict(
+            line.rsplit(" ", 1)
+            for line in self.scrape().splitlines()
+            if not line.startswith("#")
+        )
+
+    def test_request_latency_and_queries_per_view(self):
+        for _ in range(2):
+            self.client.get(reverse("books:book-list"))
+
+        samples = self.samples()
+        view = 'view="BookViewSet.list",method="GET"'
+        self.assertEqual(
+            samples[f'http_requests_total{{{view},status="200"}}'], "2"
+        )
+        self.assertEqual(
+            samples[f'http_request_duration_seconds_count{{{view}}}'], "2"
+        )
+        self.assertEqual(
+            samples[f'http_request_duration_seconds_bucket{{{view},le="+Inf"}}'],
+            "2",
+        )
+        self.assertGreater(
+            float(samples['db_queries_total{view="BookViewSet.list"}']), 0
+        )
+
+    def test_external_calls_per_view(self):
+        with FakeStripe():
+            self.client.get(
+                reverse("payments:payment_success"),
+                {"session_id": "cs_test_missing"},
+            )
+
+        samples = self.samples()
+        self.assertEqual(
+            samples[
+                'external_calls_total'
+                '{view="PaymentSuccessView",service="stripe"}'
+            ],
+            "1",
+        )
+
+    def test_buckets_are_ordered_by_bound(self):
+        self.client.get(reverse("books:book-list"))
+
+        content = self.scrape()
+        bounds = [
+            line.split('le="')[1].split('"')[0]
+            for line in content.splitlines()
+            if line.startswith("http_request_duration_seconds_bucket")
+        ]
+        self.assertEqual(bounds[-1], "+Inf")
+        self.assertEqual(
+            [float(bound) for bound in bounds],
+            sorted(float(bound) for bound in bounds),
+        )
+        self.assertIn(
+            "# TYPE http_request_duration_seconds histogram", content
+        )
+
+    def test_every_bucket_is_reported(self):
+        self.client.get(reverse("books:book-list"))
+
+        samples = self.samples()
+        view = 'view="BookViewSet.list",method="GET"'
+        for bucket in (*metrics.LATENCY_BUCKETS, "+Inf"):
+            self.assertIn(
+                f'http_request_duration_seconds_bucket{{{view},le="{bucket}"}}',
+                samples,
+            )
+
+    def test_token_required(self):
+        url = reverse("metrics")
+
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(
+            self.client.get(
+                url, HTTP_AUTHORIZATION="Bearer secret"
+            ).status_code,
+            200,
+        )
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_closed_without_token(self):
+        url = reverse("metrics")
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get(url).status_code, 200)
@@ -0,0 +1,141 @@
+"""
+Token-bucket rate limits per user, or per IP for anonymous clients.
+
+Every scope has a bucket of `num` tokens refilled at `num` per period,
+a request takes one token, so bursts up to the bucket size are fine
+while the average rate is capped. Rates come from
+`REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"]`, e.g. `"read": "300/min"`.
+
+With the Redis cache the bucket is updated by a Lua script, atomically
+and with the Redis clock, so the limits hold across all web nodes.
+Other caches keep the bucket in the cache, which is only good for
+a single process.
+"""
+import math
+import time
+from functools import cache as memoize
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import JsonResponse
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from library_service.redis_utils import get_redis, make_key
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# KEYS[1] bucket, ARGV[1] capacity, ARGV[2] tokens per second.
+# Returns whether the request is allowed and the tokens left
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate))
+return {allowed, tostring(tokens)}
+"""
+
+
+def parse_rate(rate):
+    """`"10/min"` to (capacity, tokens per second)"""
+    num, period = rate.split("/")
+    num = int(num)
+    return num, num / PERIODS[period[0]]
+
+
+@memoize
+def _token_bucket_script():
+    # Script object runs EVALSHA and loads the script when it's missing
+    return get_redis().register_script(TOKEN_BUCKET_SCRIPT)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Scope is the view's `throttle_scope`, or "read" for safe methods
+    and "write" for the others. Scopes without a rate are not limited
+    """
+
+    cache_format = "throttle:{scope}:{ident}"
+    timer = time.time
+
+    def get_scope(self, request, view):
+        scope = getattr(view, "throttle_scope", None)
+        if scope:
+            return scope
+        return "read" if request.method in SAFE_METHODS else "write"
+
+    def get_ident(self, request):
+        if request.user and request.user.is_authenticated:
+            return f"user:{request.user.pk}"
+        return f"ip:{super().get_ident(request)}"
+
+    def allow_request(self, request, view):
+        return self.allow_scope(request, self.get_scope(request, view))
+
+    def allow_scope(self, request, scope):
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if rate is None:
+            return True
+
+        key = self.cache_format.format(
+            scope=scope, ident=self.get_ident(request)
+        )
+        return self.consume(key, *parse_rate(rate))
+
+    def consume(self, key, capacity, rate):
+        """Take a token from the bucket, False if it is empty"""
+        redis = get_redis()
+        if redis is not None:
+            allowed, tokens = _token_bucket_script()(
+                keys=[make_key(key)], args=[capacity, rate], client=redis
+            )
+            allowed, tokens = bool(allowed), float(tokens)
+        else:
+            allowed, tokens = self._consume_cached(key, capacity, rate)
+
+        # Time until the next token, for the Retry-After header
+        self._wait = 0 if allowed else (1 - tokens) / rate
+        return allowed
+
+    def _consume_cached(self, key, capacity, rate):
+        now = self.timer()
+        tokens, ts = cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + max(0, now - ts) * rate)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        cache.set(key, (tokens, now), math.ceil(capacity / rate))
+        return allowed, tokens
+
+    def wait(self):
+        return getattr(self, "_wait", None)
+
+
+async def throttle_response(request, scope):
+    """
+    Throttling for plain async views, which DRF doesn't throttle.
+    Returns the 429 response if the request is over the limit
+    """
+    throttle = TokenBucketThrottle()
+    if await sync_to_async(throttle.allow_scope)(request, scope):
+        return None
+
+    response = JsonResponse({"detail": "Request was throttled."}, status=429)
+    response["Retry-After"] = str(math.ceil(throttle.wait()))
+    return response
@@ -24,6 +24,8 @@ from drf_spectacular.views import (
     SpectacularRedocView
 )
 
+from library_service.metrics import metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path(
@@ -39,6 +41,10 @@ urlpatterns = [
         include("payments.urls", namespace="payments")
     ),
     path("api/user/", include("users.urls", namespace="users")),
+    path(
+        "api/reports/",
+        include("reports.urls", namespace="reports")
+    ),
     path(
         "api/media_api/schema/",
         SpectacularAPIView.as_view(),
@@ -54,5 +60,8 @@ urlpatterns = [
         SpectacularRedocView.as_view(url_name="schema"),
         name="redoc",
     ),
-    path("__debug__/", include("debug_toolbar.urls")),
+    path("metrics", metrics_view, name="metrics"),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+if "debug_toolbar" in settings.INSTALLED_APPS:
+    urlpatterns.append(path("__debug__/", include("debug_toolbar.urls")))
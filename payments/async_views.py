@@ -0,0 +1,135 @@
+"""
+Async versions of the payment endpoints, served under ASGI.
+
+Stripe is called with `httpx` and the database with the async ORM, so
+a request waiting on Stripe doesn't take up a worker. The sync views in
+`payments.views` stay as they are.
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from borrowings.models import Borrowing
+from borrowings.utils import create_pending_payment
+from library_service.throttling import throttle_response
+from payments.models import Payment
+from payments.stripe_async import (
+    StripeAPIError,
+    create_checkout_session as create_stripe_session,
+    retrieve_checkout_session,
+)
+from payments.tasks import queue_payment_session
+from users.authentication import authenticate_async
+
+logger = logging.getLogger(__name__)
+
+
+def unauthorized():
+    return JsonResponse(
+        {"detail": "Authentication credentials were not provided."},
+        status=401,
+    )
+
+
+async def open_checkout_session(payment):
+    """
+    Create Stripe session of the pending payment and return its URL.
+    If Stripe fails the Celery task takes over and None is returned
+    """
+    try:
+        session = await create_stripe_session(payment)
+    except StripeAPIError as error:
+        logger.warning(f"Payment {payment.id} session is queued: {error}")
+        await sync_to_async(queue_payment_session)(payment)
+        return None
+
+    await Payment.objects.filter(
+        pk=payment.pk, session_id__isnull=True
+    ).aupdate(session_id=session["id"], session_url=session["url"])
+    return session["url"]
+
+
+@csrf_exempt
+@require_POST
+async def create_checkout_session(request, pk):
+    """Return Stripe Checkout URL of the borrowing, 202 if it is queued"""
+    user = await authenticate_async(request)
+    if user is None:
+        return unauthorized()
+    request.user = user
+    if throttled := await throttle_response(request, "stripe"):
+        return throttled
+
+    borrowings = Borrowing.objects.select_related("book")
+    if not user.is_staff:
+        borrowings = borrowings.filter(user=user)
+    try:
+        borrowing = await borrowings.aget(pk=pk)
+    except Borrowing.DoesNotExist:
+        return JsonResponse({"detail": "Not found."}, status=404)
+
+    # Reuse pending payment, so repeated calls don't open new sessions
+    payment = await borrowing.payments.filter(
+        status=Payment.PaymentStatus.PENDING,
+        type=Payment.PaymentType.PAYMENT,
+    ).afirst()
+    if payment is None:
+        payment = await sync_to_async(create_pending_payment)(
+            borrowing,
+            borrowing.calculate_amount_to_pay(),
+            Payment.PaymentType.PAYMENT,
+            queue_session=False,
+        )
+
+    url = payment.session_url
+    if not url and payment.batch:
+        # Desk check-outs are paid through one session of the batch
+        await sync_to_async(queue_payment_session)(payment)
+    elif not url:
+        payment.borrowing = borrowing
+        url = await open_checkout_session(payment)
+
+    return JsonResponse(
+        {"payment": payment.id, "url": url}, status=200 if url else 202
+    )
+
+
+@require_GET
+async def payment_success(request):
+    if throttled := await throttle_response(request, "stripe"):
+        return throttled
+
+    session_id = request.GET.get("session_id")
+    if not session_id:
+        return JsonResponse(
+            {"error": "Session ID not provided"}, status=400
+        )
+
+    try:
+        session = await retrieve_checkout_session(session_id)
+    except StripeAPIError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    if session.get("payment_status") != "paid":
+        return JsonResponse({"error": "Payment not completed"}, status=400)
+
+    # Only the first of concurrent requests marks the payment paid
+    await Payment.objects.filter(
+        session_id=session_id, status=Payment.PaymentStatus.PENDING
+    ).aupdate(status=Payment.PaymentStatus.PAID, paid_at=timezone.now())
+
+    payment = await Payment.objects.filter(session_id=session_id).afirst()
+    if payment is None:
+        return JsonResponse({"error": "Payment not found"}, status=404)
+
+    return JsonResponse(
+        {
+            "message": "Payment successful",
+            "session_id": session_id,
+            "status": payment.status,
+        }
+    )
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.1 on 2026-10-18 02:36
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def detach_duplicate_sessions(apps, schema_editor):
+    """
+    Fine payments used to be recorded twice with the same Stripe session,
+    keep the session on the first row only
+    """
+    Payment = apps.get_model("payments", "Payment")
+    duplicates = (
+        Payment.objects.exclude(session_id__isnull=True)
+        .exclude(session_id="")
+        .values("session_id")
+        .annotate(rows=Count("id"), first_id=Min("id"))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        Payment.objects.filter(session_id=duplicate["session_id"]).exclude(
+            id=duplicate["first_id"]
+        ).update(session_id=None)
+
+    # Blank ids would collide on the unique index as well
+    Payment.objects.filter(session_id="").update(session_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0003_payment_session_filled_by_task"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            detach_duplicate_sessions, migrations.RunPython.noop
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="session_id",
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
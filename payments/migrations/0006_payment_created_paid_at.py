@@ -0,0 +1,65 @@
+# Generated by Django 5.1.1 on 2026-10-18 02:49
+
+from datetime import datetime, time, timezone as dt_timezone
+
+import django.utils.timezone
+from django.db import migrations, models
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def backfill_payment_dates(apps, schema_editor):
+    """
+    Date old payments by their borrowing instead of the migration time:
+    a payment is opened on the borrow date, a fine on the return date.
+    The hour is unknown, so noon UTC is used, and payment time is taken
+    to be the creation time.
+    """
+    Payment = apps.get_model("payments", "Payment")
+    payments = Payment.objects.select_related("borrowing").only(
+        "type",
+        "status",
+        "borrowing__borrow_date",
+        "borrowing__actual_return_date",
+    )
+    batch = []
+    for payment in payments.iterator(chunk_size=BACKFILL_BATCH_SIZE):
+        borrowing = payment.borrowing
+        day = borrowing.borrow_date
+        if payment.type == "FINE" and borrowing.actual_return_date:
+            day = borrowing.actual_return_date
+        payment.created_at = datetime.combine(
+            day, time(12), tzinfo=dt_timezone.utc
+        )
+        payment.paid_at = (
+            payment.created_at if payment.status == "PAID" else None
+        )
+        batch.append(payment)
+        if len(batch) == BACKFILL_BATCH_SIZE:
+            Payment.objects.bulk_update(batch, ["created_at", "paid_at"])
+            batch = []
+    Payment.objects.bulk_update(batch, ["created_at", "paid_at"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0005_stripe_event"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="created_at",
+            field=models.DateTimeField(
+                auto_now_add=True, db_index=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="paid_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_payment_dates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 03:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0007_payment_session_id_shared"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="batch",
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0008_payment_batch"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="session_claimed_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -21,12 +21,53 @@ class Payment(models.Model):
     )
     borrowing = models.ForeignKey(
         "borrowings.Borrowing",
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        related_name="payments"
+    )
+    # Filled in by the Celery task that creates Stripe session. Payments
+    # of a desk check-out share one session of the patron
+    session_url = models.URLField(blank=True)
+    session_id = models.CharField(
+        max_length=255, null=True, blank=True, db_index=True
+    )
+    # Desk check-out the payment belongs to, its session is opened for
+    # the whole batch and never for the payment alone
+    batch = models.UUIDField(null=True, blank=True, editable=False)
+    # Set while the batch task creates the session, outside of any
+    # transaction. Claims of a crashed task expire
+    session_claimed_at = models.DateTimeField(
+        null=True, blank=True, editable=False
     )
-    session_url = models.URLField()
-    session_id = models.CharField(max_length=255)
     money_to_pay = models.DecimalField(max_digits=8, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Set when the status becomes PAID, daily revenue is counted by it
+    paid_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         return (f"Payment for {self.borrowing.book.title}"
                 f" - {self.get_status_display()}")
+
+
+class StripeEvent(models.Model):
+    """
+    Inbox of verified Stripe webhook events. The unique event ID drops
+    redeliveries, events are applied in batches by a Celery task
+    """
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=255)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=models.Q(processed_at__isnull=True),
+                name="stripe_event_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.type} ({self.event_id})"
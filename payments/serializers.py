@@ -1,16 +1,22 @@
 from rest_framework import serializers
 
+from library_service.fieldsets import SparseFieldsetSerializerMixin
 from payments.models import Payment
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(
+    SparseFieldsetSerializerMixin, serializers.ModelSerializer
+):
     class Meta:
         model = Payment
         fields = (
+            "id",
             "status",
             "type",
             "borrowing",
             "session_url",
             "session_id",
             "money_to_pay",
+            "created_at",
+            "paid_at",
         )
@@ -0,0 +1,92 @@
+"""
+Async client of the Stripe REST API for the ASGI views.
+
+Calls go through `httpx` instead of the blocking `stripe` SDK, so awaiting
+Stripe doesn't hold a worker thread. Requests mirror the SDK calls made
+by the sync views and Celery tasks, including the idempotency keys, so
+both paths can create the same session without duplicating it.
+"""
+import asyncio
+import weakref
+from urllib.parse import urlencode
+
+import httpx
+from django.conf import settings
+
+from library_service.metrics import track_external_call
+from payments.utils import checkout_idempotency_key, checkout_session_params
+
+# Connection pools can't be shared between event loops
+_clients = weakref.WeakKeyDictionary()
+
+
+class StripeAPIError(Exception):
+    pass
+
+
+def get_client():
+    """Pooled HTTP client of the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            base_url=settings.STRIPE_API_BASE,
+            auth=(settings.STRIPE_SECRET_KEY or "", ""),
+            timeout=settings.STRIPE_API_TIMEOUT,
+        )
+        _clients[loop] = client
+    return client
+
+
+def form_encode(params, prefix=None):
+    """Flatten nested params the way Stripe expects: `a[0][b]=c`"""
+    if isinstance(params, dict):
+        items = params.items()
+    else:
+        items = enumerate(params)
+
+    pairs = []
+    for key, value in items:
+        key = f"{prefix}[{key}]" if prefix is not None else str(key)
+        if isinstance(value, (dict, list, tuple)):
+            pairs.extend(form_encode(value, key))
+        elif value is not None:
+            pairs.append((key, str(value)))
+    return pairs
+
+
+async def _request(method, url, **kwargs):
+    try:
+        with track_external_call("stripe"):
+            response = await get_client().request(method, url, **kwargs)
+    except httpx.HTTPError as error:
+        raise StripeAPIError(f"Stripe is unreachable: {error}") from error
+
+    try:
+        data = response.json()
+    except ValueError:
+        data = {}
+    if response.is_error:
+        error = data.get("error") or {}
+        raise StripeAPIError(error.get("message", response.reason_phrase))
+    return data
+
+
+async def create_checkout_session(payment):
+    """
+    Create Stripe Checkout session for the payment,
+    `payment.borrowing.book` has to be loaded already
+    """
+    return await _request(
+        "POST",
+        "/v1/checkout/sessions",
+        content=urlencode(form_encode(checkout_session_params(payment))),
+        headers={
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Idempotency-Key": checkout_idempotency_key(payment),
+        },
+    )
+
+
+async def retrieve_checkout_session(session_id):
+    return await _request("GET", f"/v1/checkout/sessions/{session_id}")
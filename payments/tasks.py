@@ -0,0 +1,195 @@
+import logging
+from datetime import timedelta
+
+import stripe
+from celery import shared_task
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from payments.models import Payment, StripeEvent
+from payments.utils import (
+    create_batch_checkout_session,
+    create_checkout_session
+)
+
+logger = logging.getLogger(__name__)
+
+STRIPE_EVENTS_BATCH_SIZE = 500
+STRIPE_RETRY_ERRORS = (
+    stripe.error.APIConnectionError,
+    stripe.error.APIError,
+    stripe.error.RateLimitError,
+)
+SESSION_REQUEUED_KEY = "payments:session-requeued:{}"
+# Polling clients queue the session task again at most this often
+SESSION_REQUEUE_INTERVAL = 60
+# Longer than creating a session takes, a crashed batch task's payments
+# can be claimed again after it
+SESSION_CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+def queue_payment_session(payment):
+    """
+    Queue the session task again, in case it was lost. A payment of
+    a desk check-out queues the session of its whole batch
+    """
+    if not cache.add(
+        SESSION_REQUEUED_KEY.format(payment.batch or payment.id),
+        True,
+        timeout=SESSION_REQUEUE_INTERVAL,
+    ):
+        return
+
+    if payment.batch:
+        create_batch_payment_session.delay(
+            list(
+                Payment.objects.filter(
+                    batch=payment.batch, session_id__isnull=True
+                ).values_list("id", flat=True)
+            )
+        )
+    else:
+        create_payment_session.delay(payment.id)
+
+
+@shared_task(bind=True, max_retries=5)
+def create_payment_session(self, payment_id):
+    """
+    Create Stripe session for a pending payment and save its URL.
+    Failures are logged, not raised: without a broker the task runs
+    in the request, after its transaction has been committed
+    """
+    payment = Payment.objects.select_related("borrowing__book").get(
+        pk=payment_id
+    )
+    if payment.session_id:
+        return payment.session_id
+    if payment.batch:
+        # Paid through the session of its batch, a session of its own
+        # would charge the patron twice
+        return None
+
+    try:
+        session = create_checkout_session(payment)
+    except STRIPE_RETRY_ERRORS as error:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=error, countdown=2 ** self.request.retries)
+        logger.error(f"Payment {payment_id} session failed: {error}")
+        return None
+    except stripe.error.StripeError as error:
+        logger.error(f"Payment {payment_id} session failed: {error}")
+        return None
+
+    Payment.objects.filter(pk=payment.pk, session_id__isnull=True).update(
+        session_id=session.id,
+        session_url=session.url,
+    )
+    return session.id
+
+
+def claim_payments(payment_ids):
+    """
+    Claim pending payments without a session for this run. Only the
+    claim is a transaction, Stripe is called after it commits and no
+    database lock is held for the round trip
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        payments = list(
+            Payment.objects.select_related("borrowing__book")
+            .filter(pk__in=payment_ids, session_id__isnull=True)
+            .filter(
+                Q(session_claimed_at__isnull=True)
+                | Q(session_claimed_at__lt=now - SESSION_CLAIM_TIMEOUT)
+            )
+            .order_by("id")
+            .select_for_update(skip_locked=True, of=("self",))
+        )
+        Payment.objects.filter(
+            pk__in=[payment.id for payment in payments]
+        ).update(session_claimed_at=now)
+    return payments
+
+
+def release_payments(payments):
+    Payment.objects.filter(
+        pk__in=[payment.id for payment in payments],
+        session_id__isnull=True,
+    ).update(session_claimed_at=None)
+
+
+@shared_task(bind=True, max_retries=5)
+def create_batch_payment_session(self, payment_ids):
+    """
+    One Stripe session for pending payments of one patron. Payments are
+    claimed first, a concurrent run leaves them out instead of opening
+    a second session for them. Failures release the claim and are
+    logged like in `create_payment_session`
+    """
+    payments = claim_payments(payment_ids)
+    if not payments:
+        return None
+
+    try:
+        session = create_batch_checkout_session(payments)
+    except STRIPE_RETRY_ERRORS as error:
+        release_payments(payments)
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=error, countdown=2 ** self.request.retries)
+        logger.error(f"Payments {payment_ids} session failed: {error}")
+        return None
+    except stripe.error.StripeError as error:
+        release_payments(payments)
+        logger.error(f"Payments {payment_ids} session failed: {error}")
+        return None
+
+    Payment.objects.filter(
+        pk__in=[payment.id for payment in payments],
+        session_id__isnull=True,
+    ).update(
+        session_id=session.id,
+        session_url=session.url,
+        session_claimed_at=None,
+    )
+    return session.id
+
+
+@shared_task
+def process_stripe_events(batch_size=STRIPE_EVENTS_BATCH_SIZE):
+    """
+    Drain the webhook inbox in batches, every batch is applied
+    with one bulk UPDATE per kind of change
+    """
+    processed = 0
+
+    while True:
+        with transaction.atomic():
+            # Concurrent consumers skip each other's batches
+            events = list(
+                StripeEvent.objects.filter(processed_at__isnull=True)
+                .order_by("id")
+                .select_for_update(skip_locked=True)[:batch_size]
+            )
+            if not events:
+                return processed
+
+            now = timezone.now()
+
+            paid_sessions = [
+                event.payload["data"]["object"]["id"]
+                for event in events
+                if event.type == "checkout.session.completed"
+            ]
+            if paid_sessions:
+                Payment.objects.filter(
+                    session_id__in=paid_sessions,
+                    status=Payment.PaymentStatus.PENDING,
+                ).update(status=Payment.PaymentStatus.PAID, paid_at=now)
+
+            StripeEvent.objects.filter(
+                id__in=[event.id for event in events]
+            ).update(processed_at=now)
+
+        processed += len(events)
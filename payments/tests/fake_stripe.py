@@ -0,0 +1,99 @@
+from itertools import count
+from unittest.mock import patch
+from urllib.parse import parse_qsl
+
+import httpx
+import stripe
+
+
+class FakeStripe:
+    """
+    Local in-memory stand-in for Stripe Checkout sessions API.
+    Honours idempotency keys like Stripe does and can be told
+    to fail the next `fail_times` calls with a connection error
+    """
+
+    def __init__(self, fail_times=0):
+        self.sessions = {}
+        self.idempotent_sessions = {}
+        self.create_calls = []
+        self.fail_times = fail_times
+        self._ids = count(1)
+        self._patchers = [
+            patch.object(stripe.checkout.Session, "create", self.create),
+            patch.object(stripe.checkout.Session, "retrieve", self.retrieve),
+            # The async views call the REST API with httpx
+            patch("payments.stripe_async.get_client", self.async_client),
+        ]
+
+    def __enter__(self):
+        for patcher in self._patchers:
+            patcher.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for patcher in reversed(self._patchers):
+            patcher.stop()
+
+    def create(self, idempotency_key=None, **params):
+        self.create_calls.append(params)
+
+        if self.fail_times:
+            self.fail_times -= 1
+            raise stripe.error.APIConnectionError("Stripe is unreachable")
+
+        if idempotency_key in self.idempotent_sessions:
+            return self.idempotent_sessions[idempotency_key]
+
+        session_id = f"cs_test_{next(self._ids)}"
+        session = stripe.checkout.Session.construct_from(
+            {
+                "id": session_id,
+                "object": "checkout.session",
+                "url": f"https://checkout.stripe.com/c/pay/{session_id}",
+                "payment_status": "unpaid",
+                "client_reference_id": params.get("client_reference_id"),
+                "amount_total": sum(
+                    item["price_data"]["unit_amount"] * item["quantity"]
+                    for item in params.get("line_items", [])
+                ),
+            },
+            "sk_test_fake",
+        )
+        self.sessions[session_id] = session
+        if idempotency_key:
+            self.idempotent_sessions[idempotency_key] = session
+        return session
+
+    def retrieve(self, session_id, **params):
+        if session_id not in self.sessions:
+            raise stripe.error.InvalidRequestError(
+                f"No such checkout.session: '{session_id}'", "id"
+            )
+        return self.sessions[session_id]
+
+    def pay(self, session_id):
+        self.sessions[session_id].payment_status = "paid"
+
+    def async_client(self):
+        return httpx.AsyncClient(
+            base_url="https://api.stripe.com",
+            transport=httpx.MockTransport(self.handle_request),
+        )
+
+    def handle_request(self, request):
+        try:
+            if request.method == "POST":
+                session = self.create(
+                    idempotency_key=request.headers.get("Idempotency-Key"),
+                    **dict(parse_qsl(request.content.decode())),
+                )
+            else:
+                session = self.retrieve(request.url.path.rsplit("/", 1)[-1])
+        except stripe.error.APIConnectionError as error:
+            raise httpx.ConnectError(str(error), request=request)
+        except stripe.error.InvalidRequestError as error:
+            return httpx.Response(
+                404, json={"error": {"message": error.user_message}}
+            )
+        return httpx.Response(200, json=session)
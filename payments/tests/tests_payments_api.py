@@ -1,9 +1,23 @@
+import json
 from unittest.mock import patch, MagicMock
+from uuid import uuid4
 
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
-from payments.models import Payment
+from rest_framework_simplejwt.tokens import AccessToken
+from payments.models import Payment, StripeEvent
+from payments.tasks import (
+    create_batch_payment_session,
+    create_payment_session,
+    process_stripe_events,
+    SESSION_CLAIM_TIMEOUT
+)
+from payments.tests.fake_stripe import FakeStripe
 from borrowings.models import Borrowing
 from django.contrib.auth import get_user_model
 import stripe
@@ -39,14 +53,151 @@ class PaymentsTests(APITestCase):
 
     def test_create_payment(self):
         url = reverse("payments:payment-create-checkout-session", args=[self.borrowing.id])
-        response = self.client.post(url)
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn("url", response.data)
+        with FakeStripe() as fake_stripe:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(url)
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertIn("url", response.data)
+
+            """Check if payment is created"""
+            payment = Payment.objects.get(borrowing=self.borrowing)
+            self.assertEqual(payment.id, response.data["payment"])
+            self.assertEqual(payment.status, Payment.PaymentStatus.PENDING)
+            self.assertEqual(payment.type, Payment.PaymentType.PAYMENT)
+
+            """Session is created after commit by the Celery task"""
+            self.assertTrue(payment.session_id.startswith("cs_test_"))
+            self.assertEqual(
+                fake_stripe.create_calls[0]["line_items"][0]["price_data"][
+                    "unit_amount"
+                ],
+                4500
+            )
+
+            """Repeated call returns the same session"""
+            response = self.client.post(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                response.data["url"],
+                fake_stripe.sessions[payment.session_id].url
+            )
+            self.assertEqual(len(fake_stripe.create_calls), 1)
+            self.assertEqual(Payment.objects.count(), 1)
+
+    def test_create_payment_session_task_retries(self):
+        payment = Payment.objects.create(
+            status=Payment.PaymentStatus.PENDING,
+            type=Payment.PaymentType.PAYMENT,
+            money_to_pay=45,
+            borrowing=self.borrowing
+        )
+
+        with FakeStripe(fail_times=2) as fake_stripe:
+            create_payment_session.apply(args=(payment.id,))
+
+        payment.refresh_from_db()
+        self.assertEqual(len(fake_stripe.create_calls), 3)
+        self.assertEqual(len(fake_stripe.sessions), 1)
+        self.assertEqual(
+            payment.session_url,
+            fake_stripe.sessions[payment.session_id].url
+        )
+
+    def test_create_payment_session_task_gives_up(self):
+        payment = Payment.objects.create(
+            status=Payment.PaymentStatus.PENDING,
+            type=Payment.PaymentType.PAYMENT,
+            money_to_pay=45,
+            borrowing=self.borrowing
+        )
+
+        # Logged, not raised into the request that queued it
+        with FakeStripe(fail_times=10) as fake_stripe:
+            result = create_payment_session.apply(args=(payment.id,))
+
+        self.assertIsNone(result.get())
+        self.assertEqual(len(fake_stripe.create_calls), 6)
+        payment.refresh_from_db()
+        self.assertIsNone(payment.session_id)
+
+    def test_create_batch_payment_session_task_gives_up(self):
+        payment = Payment.objects.create(
+            status=Payment.PaymentStatus.PENDING,
+            type=Payment.PaymentType.PAYMENT,
+            money_to_pay=45,
+            borrowing=self.borrowing,
+            batch=uuid4(),
+        )
 
-        """Check if payment is created"""
-        payment = Payment.objects.get(borrowing=self.borrowing)
-        self.assertEqual(payment.status, Payment.PaymentStatus.PENDING)
-        self.assertEqual(payment.type, Payment.PaymentType.PAYMENT)
+        with FakeStripe(fail_times=10) as fake_stripe:
+            result = create_batch_payment_session.apply(args=([payment.id],))
+
+        self.assertIsNone(result.get())
+        self.assertEqual(len(fake_stripe.create_calls), 6)
+        payment.refresh_from_db()
+        self.assertIsNone(payment.session_id)
+        # A later run can claim it again
+        self.assertIsNone(payment.session_claimed_at)
+
+    def test_batch_session_leaves_out_claimed_payments(self):
+        batch = uuid4()
+        claimed, free = (
+            Payment.objects.create(
+                status=Payment.PaymentStatus.PENDING,
+                type=Payment.PaymentType.PAYMENT,
+                money_to_pay=45,
+                borrowing=self.borrowing,
+                batch=batch,
+            )
+            for _ in range(2)
+        )
+        # Another run is creating its session
+        Payment.objects.filter(pk=claimed.pk).update(
+            session_claimed_at=timezone.now()
+        )
+        ids = [claimed.id, free.id]
+
+        with FakeStripe() as fake_stripe:
+            session_id = create_batch_payment_session(ids)
+
+            self.assertEqual(len(fake_stripe.create_calls), 1)
+            self.assertEqual(len(fake_stripe.create_calls[0]["line_items"]), 1)
+            free.refresh_from_db()
+            self.assertEqual(free.session_id, session_id)
+            self.assertIsNone(free.session_claimed_at)
+
+            # Claim of a run that died expires
+            Payment.objects.filter(pk=claimed.pk).update(
+                session_claimed_at=timezone.now() - SESSION_CLAIM_TIMEOUT
+            )
+            self.assertIsNotNone(create_batch_payment_session(ids))
+
+        claimed.refresh_from_db()
+        self.assertIsNotNone(claimed.session_id)
+        self.assertNotEqual(claimed.session_id, session_id)
+
+    def test_polling_requeues_session_once(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        url = reverse(
+            "payments:payment-create-checkout-session",
+            args=[self.borrowing.id]
+        )
+        Payment.objects.create(
+            status=Payment.PaymentStatus.PENDING,
+            type=Payment.PaymentType.PAYMENT,
+            money_to_pay=45,
+            borrowing=self.borrowing
+        )
+
+        with patch("payments.tasks.create_payment_session.delay") as delay:
+            for _ in range(3):
+                response = self.client.post(url)
+                self.assertEqual(
+                    response.status_code, status.HTTP_202_ACCEPTED
+                )
+
+        delay.assert_called_once()
 
     def test_list_payments(self):
         # Створимо кілька платежів для користувача
@@ -62,7 +213,7 @@ class PaymentsTests(APITestCase):
         url = reverse("payments:payment-list")
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)  # Має бути 1 платіж для цього користувача
+        self.assertEqual(len(response.data["results"]), 1)  # Має бути 1 платіж для цього користувача
 
     def test_stripe_webhook_success(self):
         # Створюємо Stripe сесію
@@ -77,6 +228,7 @@ class PaymentsTests(APITestCase):
 
         # Мокаємо Stripe API
         stripe.Webhook.construct_event = lambda *args, **kwargs: {
+            'id': 'evt_test_1',
             'type': 'checkout.session.completed',
             'data': {
                 'object': {
@@ -87,6 +239,7 @@ class PaymentsTests(APITestCase):
         }
 
         payload = {
+            'id': 'evt_test_1',
             'type': 'checkout.session.completed',
             'data': {
                 'object': {
@@ -97,13 +250,81 @@ class PaymentsTests(APITestCase):
         }
 
         url = reverse("payments:stripe-webhook")
-        response = self.client.post(url, data=payload, content_type='application/json')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data=payload, content_type='application/json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # Перевіряємо чи статус платежу змінився на PAID
         payment.refresh_from_db()
         self.assertEqual(payment.status, Payment.PaymentStatus.PAID)
 
+    def test_stripe_webhook_redelivery_is_dropped(self):
+        payload = {
+            "id": "evt_redelivered",
+            "type": "checkout.session.completed",
+            "data": {"object": {"id": "cs_test_redelivered"}},
+        }
+        url = reverse("payments:stripe-webhook")
+
+        with patch(
+            "stripe.Webhook.construct_event", return_value=payload
+        ), patch("payments.views.process_stripe_events.delay") as delay:
+            for _ in range(3):
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = self.client.post(
+                        url, data=payload, content_type="application/json"
+                    )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(
+            StripeEvent.objects.filter(event_id="evt_redelivered").count(), 1
+        )
+        self.assertEqual(delay.call_count, 3)
+
+    def test_process_stripe_events_in_batches(self):
+        payments = [
+            Payment.objects.create(
+                type=Payment.PaymentType.PAYMENT,
+                session_id=f"cs_test_batch_{i}",
+                money_to_pay=10,
+                borrowing=self.borrowing
+            )
+            for i in range(5)
+        ]
+        StripeEvent.objects.bulk_create(
+            StripeEvent(
+                event_id=f"evt_batch_{i}",
+                type="checkout.session.completed",
+                payload={"data": {"object": {"id": payment.session_id}}},
+            )
+            for i, payment in enumerate(payments[:4])
+        )
+        StripeEvent.objects.create(
+            event_id="evt_other",
+            type="checkout.session.expired",
+            payload={"data": {"object": {"id": payments[4].session_id}}},
+        )
+
+        with CaptureQueriesContext(connection) as ctx:
+            processed = process_stripe_events(batch_size=2)
+
+        self.assertEqual(processed, 5)
+        # One bulk UPDATE of payments per batch carrying completed sessions
+        payment_updates = [
+            query for query in ctx.captured_queries
+            if query["sql"].startswith('UPDATE "payments_payment"')
+        ]
+        self.assertEqual(len(payment_updates), 2)
+        self.assertFalse(
+            StripeEvent.objects.filter(processed_at__isnull=True).exists()
+        )
+        statuses = list(
+            Payment.objects.filter(id__in=[p.id for p in payments])
+            .order_by("id")
+            .values_list("status", flat=True)
+        )
+        self.assertEqual(statuses, ["PAID"] * 4 + ["PENDING"])
+
     # def test_payment_success_view(self):
     #     # Створюємо Stripe сесію
     #     payment = Payment.objects.create(
@@ -153,3 +374,198 @@ class PaymentsTests(APITestCase):
             # Перевіряємо, чи статус платежу змінився на PAID
             payment.refresh_from_db()
             self.assertEqual(payment.status, Payment.PaymentStatus.PAID)
+
+    async def test_async_create_payment(self):
+        url = reverse(
+            "payments:payment-create-checkout-session-async",
+            args=[self.borrowing.id]
+        )
+        headers = {"Authorize": f"Bearer {AccessToken.for_user(self.user)}"}
+        with FakeStripe() as fake_stripe:
+            response = await self.async_client.post(url, headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            """Session is created in the request, not by a task"""
+            payment = await Payment.objects.aget(borrowing=self.borrowing)
+            self.assertEqual(response.json()["payment"], payment.id)
+            self.assertEqual(
+                response.json()["url"],
+                fake_stripe.sessions[payment.session_id].url
+            )
+            self.assertEqual(
+                fake_stripe.create_calls[0][
+                    "line_items[0][price_data][unit_amount]"
+                ],
+                "4500"
+            )
+
+            """Repeated call returns the same session"""
+            response = await self.async_client.post(url, headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(fake_stripe.create_calls), 1)
+
+            """Only own borrowings"""
+            response = await self.async_client.post(url)
+            self.assertEqual(response.status_code, 401)
+
+    async def test_async_create_payment_falls_back_to_task(self):
+        url = reverse(
+            "payments:payment-create-checkout-session-async",
+            args=[self.borrowing.id]
+        )
+        headers = {"Authorize": f"Bearer {AccessToken.for_user(self.user)}"}
+        with FakeStripe(fail_times=1), patch(
+            "payments.tasks.create_payment_session.delay"
+        ) as delay:
+            response = await self.async_client.post(url, headers=headers)
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertIsNone(response.json()["url"])
+        delay.assert_called_once_with(response.json()["payment"])
+
+    async def test_async_create_payment_of_batch(self):
+        await cache.aclear()
+        self.addCleanup(cache.clear)
+        url = reverse(
+            "payments:payment-create-checkout-session-async",
+            args=[self.borrowing.id]
+        )
+        headers = {"Authorize": f"Bearer {AccessToken.for_user(self.user)}"}
+        payment = await Payment.objects.acreate(
+            status=Payment.PaymentStatus.PENDING,
+            type=Payment.PaymentType.PAYMENT,
+            money_to_pay=45,
+            borrowing=self.borrowing,
+            batch=uuid4(),
+        )
+
+        with FakeStripe() as fake_stripe, patch(
+            "payments.tasks.create_batch_payment_session.delay"
+        ) as delay:
+            response = await self.async_client.post(url, headers=headers)
+
+        """Batch session is queued instead of a session of its own"""
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(fake_stripe.create_calls, [])
+        delay.assert_called_once_with([payment.id])
+
+    async def test_async_payment_success_view(self):
+        url = reverse("payments:payment_success_async")
+        with FakeStripe() as fake_stripe:
+            session = fake_stripe.create(client_reference_id=1)
+            payment = await Payment.objects.acreate(
+                status=Payment.PaymentStatus.PENDING,
+                type=Payment.PaymentType.PAYMENT,
+                session_url=session.url,
+                session_id=session.id,
+                money_to_pay=50.00,
+                borrowing=self.borrowing
+            )
+
+            response = await self.async_client.get(
+                url, {"session_id": session.id}
+            )
+            self.assertEqual(response.status_code, 400)
+
+            fake_stripe.pay(session.id)
+            response = await self.async_client.get(
+                url, {"session_id": session.id}
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            await payment.arefresh_from_db()
+            self.assertEqual(payment.status, Payment.PaymentStatus.PAID)
+            self.assertIsNotNone(payment.paid_at)
+
+            response = await self.async_client.get(
+                url, {"session_id": "cs_test_missing"}
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_list_payments_sparse_fieldset(self):
+        Payment.objects.create(
+            type=Payment.PaymentType.PAYMENT,
+            session_url="https://checkout.stripe.com/test",
+            money_to_pay=10,
+            borrowing=self.borrowing
+        )
+
+        response = self.client.get(
+            reverse("payments:payment-list"), {"fields": "id,status"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(response.data["results"][0]), {"id", "status"}
+        )
+
+    def test_export_payments_by_status(self):
+        paid = Payment.objects.create(
+            status=Payment.PaymentStatus.PAID,
+            type=Payment.PaymentType.PAYMENT,
+            money_to_pay=10,
+            borrowing=self.borrowing
+        )
+        Payment.objects.create(
+            type=Payment.PaymentType.FINE,
+            money_to_pay=20,
+            borrowing=self.borrowing
+        )
+        self.user.is_staff = True
+        self.user.save()
+
+        response = self.client.get(
+            reverse("payments:payment-export"),
+            {"status": "PAID", "file_format": "jsonl"},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["id"], paid.id)
+        self.assertEqual(rows[0]["money_to_pay"], "10.00")
+        self.assertEqual(rows[0]["borrowing__user__email"], "test@email.com")
+
+
+class HotQueryPlanTests(APITestCase):
+    """Hot lookups must be served by an index, not a full table scan"""
+
+    def setUp(self):
+        if connection.vendor == "postgresql":
+            # Tiny test tables are cheaper to scan, make the planner
+            # show whether an index is usable at all. SET LOCAL is
+            # undone with the test transaction, there's no cursor to
+            # clean up after
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, table):
+        plan = queryset.explain()
+        if connection.vendor == "sqlite":
+            self.assertRegex(
+                plan, rf"SEARCH {table} USING (COVERING )?INDEX", plan
+            )
+            self.assertNotRegex(plan, rf"SCAN {table}\b", plan)
+        else:
+            self.assertNotIn(f"Seq Scan on {table}", plan)
+
+    def test_payment_by_session_id(self):
+        self.assertUsesIndex(
+            Payment.objects.filter(session_id="cs_test_1"),
+            "payments_payment"
+        )
+
+    def test_payments_of_user(self):
+        queryset = Payment.objects.filter(borrowing__user_id=1)
+        self.assertUsesIndex(queryset, "borrowings_borrowing")
+        self.assertUsesIndex(queryset, "payments_payment")
+
+    def test_active_borrowings_of_user(self):
+        self.assertUsesIndex(
+            Borrowing.objects.filter(
+                user_id=1, actual_return_date__isnull=True
+            ),
+            "borrowings_borrowing"
+        )
@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework import routers
 
+from payments import async_views
 from payments.views import (
     PaymentViewSet,
     CreateCheckoutSessionView,
@@ -19,7 +20,18 @@ urlpatterns = [
     ),
     # path("webhook/", stripe_webhook, name="stripe-webhook"),
     path("webhooks/stripe/", stripe_webhook, name="stripe-webhook"),
-    path("success/", PaymentSuccessView.as_view(), name="payment_success")
+    path("success/", PaymentSuccessView.as_view(), name="payment_success"),
+    # Async (ASGI) versions of the endpoints above
+    path(
+        "async/create_checkout_session/<int:pk>/",
+        async_views.create_checkout_session,
+        name="payment-create-checkout-session-async"
+    ),
+    path(
+        "async/success/",
+        async_views.payment_success,
+        name="payment_success_async"
+    ),
     # path("success/", success_view, name="success"),
     # path("cancel/", cancel_view, name="cancel"),
 ]
@@ -0,0 +1,84 @@
+from hashlib import sha256
+
+import stripe
+from django.conf import settings
+
+from library_service.metrics import track_external_call
+from payments.models import Payment
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+# Load tests point it at a local stub
+stripe.api_base = settings.STRIPE_API_BASE
+
+
+def checkout_idempotency_key(payment):
+    return f"checkout-session-payment-{payment.id}"
+
+
+def batch_idempotency_key(payments):
+    # Stripe keys are up to 255 characters, ids of a big batch aren't
+    ids = ",".join(str(payment.id) for payment in payments)
+    return f"checkout-session-payments-{sha256(ids.encode()).hexdigest()}"
+
+
+def line_item(payment):
+    book = payment.borrowing.book
+
+    if payment.type == Payment.PaymentType.FINE:
+        name = f'Stripe Fine Payment for "{book.title}"'
+    else:
+        name = book.title
+
+    return {
+        "price_data": {
+            "currency": "usd",
+            "product_data": {
+                "name": name,
+            },
+            # Stripe uses amount in cents
+            "unit_amount": int(payment.money_to_pay * 100),
+        },
+        "quantity": 1,
+    }
+
+
+def checkout_session_params(payment):
+    """Parameters of the Stripe Checkout session for the payment"""
+    return {
+        "payment_method_types": ["card"],
+        "line_items": [line_item(payment)],
+        "mode": "payment",
+        "success_url": settings.STRIPE_SUCCESS_URL,
+        "cancel_url": settings.STRIPE_CANCEL_URL,
+        "client_reference_id": payment.borrowing_id,
+    }
+
+
+def create_checkout_session(payment):
+    """
+    Create Stripe Checkout session for the payment. The idempotency key
+    makes a retried call return the session created by the first one
+    """
+    with track_external_call("stripe"):
+        return stripe.checkout.Session.create(
+            **checkout_session_params(payment),
+            idempotency_key=checkout_idempotency_key(payment),
+        )
+
+
+def create_batch_checkout_session(payments):
+    """One Stripe Checkout session paying for payments of one patron"""
+    params = {
+        **checkout_session_params(payments[0]),
+        "line_items": [line_item(payment) for payment in payments],
+        "client_reference_id": f"user-{payments[0].borrowing.user_id}",
+    }
+    with track_external_call("stripe"):
+        return stripe.checkout.Session.create(
+            **params, idempotency_key=batch_idempotency_key(payments)
+        )
+
+
+def retrieve_checkout_session(session_id):
+    with track_external_call("stripe"):
+        return stripe.checkout.Session.retrieve(session_id)
@@ -2,33 +2,77 @@ import logging
 
 import stripe
 from django.conf import settings
+from django.db import transaction
 from django.http import JsonResponse, HttpResponse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import (
+    extend_schema,
+    extend_schema_view,
+    OpenApiParameter
+)
 from rest_framework import viewsets, status, mixins
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import (
+    action,
+    api_view,
+    permission_classes,
+    throttle_classes
+)
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from borrowings.models import Borrowing
-from payments.models import Payment
+from borrowings.utils import create_pending_payment
+from library_service.fieldsets import FIELDSET_PARAMETERS, SparseFieldsetMixin
+from library_service.pagination import IdCursorPagination
+from library_service.streaming import (
+    EXPORT_PARAMETERS,
+    export_response,
+    parse_export_params
+)
+from payments.models import Payment, StripeEvent
 from payments.serializers import PaymentSerializer
-
-
+from payments.tasks import process_stripe_events, queue_payment_session
+from payments.utils import retrieve_checkout_session
+
+PAYMENT_EXPORT_COLUMNS = (
+    "id",
+    "borrowing_id",
+    "borrowing__user__email",
+    "type",
+    "status",
+    "money_to_pay",
+    "session_id",
+    "created_at",
+    "paid_at",
+)
+
+
+@extend_schema_view(
+    list=extend_schema(parameters=FIELDSET_PARAMETERS),
+    retrieve=extend_schema(parameters=FIELDSET_PARAMETERS),
+)
 class PaymentViewSet(
-    mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+    SparseFieldsetMixin,
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
 ):
-    queryset = Payment.objects.select_related("borrowing")
+    queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
         user = self.request.user
+        queryset = super().get_queryset()
         if not user.is_staff:
-            return Payment.objects.filter(borrowing__user=self.request.user)
-        return Payment.objects.all()
+            return queryset.filter(borrowing__user=self.request.user)
+        return queryset
 
     def perform_create(self, serializer):
         user = self.request.user
@@ -44,70 +88,96 @@ class PaymentViewSet(
         # serializer.save(user=self.request.user)
         serializer.save(user=user)
 
+    @extend_schema(
+        parameters=EXPORT_PARAMETERS + [
+            OpenApiParameter(
+                "status",
+                OpenApiTypes.STR,
+                enum=Payment.PaymentStatus.values,
+            ),
+        ],
+        responses={200: OpenApiTypes.BINARY},
+    )
+    @action(detail=False, methods=["GET"], permission_classes=[IsAdminUser])
+    def export(self, request):
+        """Stream payments as CSV or JSONL file (staff only)"""
+        params = parse_export_params(request.query_params)
+        queryset = Payment.objects.order_by("id")
+
+        """Filtration by creation date"""
+        if params["date_from"]:
+            queryset = queryset.filter(
+                created_at__date__gte=params["date_from"]
+            )
+        if params["date_to"]:
+            queryset = queryset.filter(created_at__date__lte=params["date_to"])
+
+        payment_status = request.query_params.get("status")
+        if payment_status is not None:
+            if payment_status not in Payment.PaymentStatus.values:
+                raise ValidationError(
+                    {"status": f"Supported: {Payment.PaymentStatus.values}"}
+                )
+            queryset = queryset.filter(status=payment_status)
+
+        return export_response(
+            queryset,
+            PAYMENT_EXPORT_COLUMNS,
+            "payments",
+            params["file_format"],
+            params["compress"],
+        )
+
 
 class CreateCheckoutSessionView(APIView):
     """
-    Create Stripe session for payment and returns URL for Stripe Checkout
+    Create pending payment for the borrowing and return its Stripe
+    Checkout URL once the session has been created in the background
     """
 
+    throttle_scope = "stripe"
+
     def post(self, request, pk):
         # Get Borrowing object by pk
         borrowing = get_object_or_404(Borrowing, pk=pk)
-        # Calculate amount to pay
-        amount_to_pay = borrowing.calculate_amount_to_pay()
-        # Use API key for Stripe
-        stripe.api_key = settings.STRIPE_SECRET_KEY
 
-        try:
-            """Create Stripe Checkout Session"""
-            session = stripe.checkout.Session.create(
-                payment_method_types=["card"],
-                line_items=[
-                    {
-                        "price_data": {
-                            "currency": "usd",
-                            "product_data": {
-                                "name": f"Book payment {borrowing.book.title}",
-                            },
-                            "unit_amount": int(
-                                amount_to_pay * 100
-                            ),  # calculate in cents
-                        },
-                        "quantity": 1,
-                    }
-                ],
-                mode="payment",
-                success_url=(
-                    "http://localhost:8000/api/payments/"
-                    "success/?session_id={CHECKOUT_SESSION_ID}"
-                ),
-                cancel_url=(
-                    "http://localhost:8000/api/payments/"
-                    "cancel/?session_id={CHECKOUT_SESSION_ID}"
-                ),
-                client_reference_id=borrowing.id,  # Add borrowing ID
-            )
-            Payment.objects.create(
-                status=Payment.PaymentStatus.PENDING,
-                type=Payment.PaymentType.PAYMENT,
-                session_url=session.url,
-                session_id=session.id,
-                money_to_pay=amount_to_pay,
-                borrowing=borrowing,
-            )
+        # Reuse pending payment, so repeated calls don't open new sessions
+        payment = borrowing.payments.filter(
+            status=Payment.PaymentStatus.PENDING,
+            type=Payment.PaymentType.PAYMENT,
+        ).first()
+
+        if payment is None:
+            with transaction.atomic():
+                payment = create_pending_payment(
+                    borrowing,
+                    borrowing.calculate_amount_to_pay(),
+                    Payment.PaymentType.PAYMENT,
+                )
+        elif not payment.session_id:
+            # Task is idempotent, queue it again in case it was lost
+            queue_payment_session(payment)
 
-            return Response({"url": session.url}, status=status.HTTP_200_OK)
-        except Exception as e:
+        if payment.session_url:
             return Response(
-                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"payment": payment.id, "url": payment.session_url},
+                status=status.HTTP_200_OK
             )
 
+        # Stripe session is being created, poll the payment for its URL
+        return Response(
+            {"payment": payment.id, "url": None},
+            status=status.HTTP_202_ACCEPTED
+        )
+
 
 logger = logging.getLogger(__name__)
 
 
 @api_view(["POST"])
 @permission_classes([AllowAny])
+# Stripe delivers bursts of events from a handful of IPs
+@throttle_classes([])
 @csrf_exempt
 def stripe_webhook(request):
     payload = request.body
@@ -128,29 +198,28 @@ def stripe_webhook(request):
         logger.error(f"Signature verification failed: {str(e)}")
         return HttpResponse(status=400)
 
-    # Process event
-    if event["type"] == "checkout.session.completed":
-        session = event["data"]["object"]
-        session_id = session.get("id")
-        logger.info(f"Processing session ID: {session_id}")
-
-        try:
-            payment = Payment.objects.get(session_id=session_id)
-            payment.status = Payment.PaymentStatus.PAID
-            payment.save()
-            logger.info(f"Payment {session_id} updated to PAID.")
-            return HttpResponse(status=200)
-        except Payment.DoesNotExist:
-            logger.error(
-                f"Payment with session ID {session_id} does not exist."
+    # Store event and acknowledge it right away, a Celery task applies it.
+    # Redeliveries of the same event are dropped by the unique event ID
+    StripeEvent.objects.bulk_create(
+        [
+            StripeEvent(
+                event_id=event["id"],
+                type=event["type"],
+                payload=event,
             )
-            return HttpResponse(status=404)
+        ],
+        ignore_conflicts=True,
+    )
+    transaction.on_commit(process_stripe_events.delay)
 
-    logger.info("Event processed successfully")
+    logger.info(f"Stripe event {event['id']} queued for processing")
     return HttpResponse(status=200)
 
 
 class PaymentSuccessView(APIView):
+    # Every call retrieves the session from Stripe
+    throttle_scope = "stripe"
+
     def get(self, request):
         session_id = request.query_params.get("session_id")
 
@@ -162,13 +231,23 @@ class PaymentSuccessView(APIView):
 
         try:
             # Get session Stripe for checking of status
-            session = stripe.checkout.Session.retrieve(session_id)
+            session = retrieve_checkout_session(session_id)
 
             if session.payment_status == "paid":
-                # If payment status "paid", update status in db
-                payment = Payment.objects.get(session_id=session_id)
-                payment.status = "PAID"
-                payment.save()
+                # If payment status "paid", update status in db. All
+                # payments of a desk check-out share the session
+                Payment.objects.filter(
+                    session_id=session_id,
+                    status=Payment.PaymentStatus.PENDING,
+                ).update(
+                    status=Payment.PaymentStatus.PAID,
+                    paid_at=timezone.now(),
+                )
+                payment = Payment.objects.filter(
+                    session_id=session_id
+                ).first()
+                if payment is None:
+                    raise Payment.DoesNotExist()
 
                 return Response(
                     {
@@ -0,0 +1,64 @@
+from django.db import models
+
+from books.models import Book
+from payments.models import Payment
+
+
+class DailyBookCirculation(models.Model):
+    """Loans and returns of a book per day"""
+
+    date = models.DateField()
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE,
+        related_name="daily_circulation"
+    )
+    loans = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "book"], name="daily_circulation_date_book"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date}: {self.book_id}"
+
+
+class DailyPaymentRollup(models.Model):
+    """
+    Payments created and paid per day and payment type,
+    paid ones are counted on the day they were paid
+    """
+
+    date = models.DateField()
+    type = models.CharField(max_length=7, choices=Payment.PaymentType)
+    created = models.PositiveIntegerField(default=0)
+    created_amount = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0
+    )
+    paid = models.PositiveIntegerField(default=0)
+    paid_amount = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "type"], name="daily_payment_date_type"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date}: {self.type}"
+
+
+class RollupWatermark(models.Model):
+    """Last day the rollups were computed up to"""
+
+    name = models.CharField(max_length=64, unique=True)
+    processed_until = models.DateField()
+
+    def __str__(self):
+        return f"{self.name}: {self.processed_until}"
@@ -0,0 +1,93 @@
+"""
+Daily rollups of book circulation and payments.
+
+A day is always recomputed as a whole from the raw tables with a few
+GROUP BY queries, so a rerun over the same days is harmless. The Celery
+task only recomputes the days since the last watermark.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from borrowings.models import Borrowing
+from payments.models import Payment
+from reports.models import DailyBookCirculation, DailyPaymentRollup
+
+ROLLUP_BATCH_SIZE = 1000
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def first_activity_date():
+    """Day of the oldest borrowing or payment, None for an empty library"""
+    days = [
+        Borrowing.objects.aggregate(day=Min("borrow_date"))["day"],
+        Payment.objects.aggregate(day=Min(TruncDate("created_at")))["day"],
+    ]
+    days = [day for day in days if day is not None]
+    return min(days) if days else None
+
+
+def rollup_circulation(start, end):
+    rows = defaultdict(dict)
+
+    for date_field, counter in (
+        ("borrow_date", "loans"),
+        ("actual_return_date", "returns"),
+    ):
+        counts = (
+            Borrowing.objects.filter(**{f"{date_field}__range": (start, end)})
+            .values_list(date_field, "book_id")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+        for day, book_id, count in counts:
+            rows[day, book_id][counter] = count
+
+    DailyBookCirculation.objects.filter(date__range=(start, end)).delete()
+    DailyBookCirculation.objects.bulk_create(
+        (
+            DailyBookCirculation(date=day, book_id=book_id, **counters)
+            for (day, book_id), counters in rows.items()
+        ),
+        batch_size=ROLLUP_BATCH_SIZE,
+    )
+    return len(rows)
+
+
+def rollup_payments(start, end):
+    rows = defaultdict(dict)
+    # Datetime range instead of __date lookups, so the indexes are used
+    since, until = _day_start(start), _day_start(end + timedelta(days=1))
+
+    for date_field, counter in (
+        ("created_at", "created"),
+        ("paid_at", "paid"),
+    ):
+        sums = (
+            Payment.objects.filter(
+                **{f"{date_field}__gte": since, f"{date_field}__lt": until}
+            )
+            .annotate(day=TruncDate(date_field))
+            .values_list("day", "type")
+            .annotate(count=Count("id"), amount=Sum("money_to_pay"))
+            .order_by()
+        )
+        for day, payment_type, count, amount in sums:
+            rows[day, payment_type][counter] = count
+            rows[day, payment_type][f"{counter}_amount"] = amount
+
+    DailyPaymentRollup.objects.filter(date__range=(start, end)).delete()
+    DailyPaymentRollup.objects.bulk_create(
+        (
+            DailyPaymentRollup(date=day, type=payment_type, **counters)
+            for (day, payment_type), counters in rows.items()
+        ),
+        batch_size=ROLLUP_BATCH_SIZE,
+    )
+    return len(rows)
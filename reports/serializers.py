@@ -0,0 +1,27 @@
+from rest_framework import serializers
+
+from payments.models import Payment
+
+
+class DailyCirculationSerializer(serializers.Serializer):
+    date = serializers.DateField()
+    loans = serializers.IntegerField()
+    returns = serializers.IntegerField()
+
+
+class BookCirculationSerializer(serializers.Serializer):
+    book = serializers.IntegerField(source="book_id")
+    title = serializers.CharField()
+    loans = serializers.IntegerField()
+    returns = serializers.IntegerField()
+
+
+class DailyRevenueSerializer(serializers.Serializer):
+    date = serializers.DateField()
+    type = serializers.ChoiceField(choices=Payment.PaymentType.choices)
+    created = serializers.IntegerField()
+    created_amount = serializers.DecimalField(
+        max_digits=12, decimal_places=2
+    )
+    paid = serializers.IntegerField()
+    paid_amount = serializers.DecimalField(max_digits=12, decimal_places=2)
@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.db import transaction
+from django.utils import timezone
+
+from reports.models import RollupWatermark
+from reports.rollups import (
+    first_activity_date,
+    rollup_circulation,
+    rollup_payments
+)
+
+ROLLUP_WATERMARK = "daily"
+# Days before the watermark which are recomputed as well,
+# picks up writes which landed after the previous run
+ROLLUP_LOOKBACK_DAYS = 2
+
+
+@shared_task
+def update_daily_rollups(lookback_days=ROLLUP_LOOKBACK_DAYS):
+    """
+    Recompute the rollups from the watermark (minus the lookback)
+    up to today. The first run backfills the whole history
+    """
+    today = timezone.localdate()
+
+    with transaction.atomic():
+        # Concurrent runs wait for each other instead of
+        # rewriting the same days at the same time
+        watermark = (
+            RollupWatermark.objects.select_for_update()
+            .filter(name=ROLLUP_WATERMARK)
+            .first()
+        )
+        if watermark is not None:
+            start = watermark.processed_until - timedelta(days=lookback_days)
+        else:
+            start = first_activity_date() or today
+        start = min(start, today)
+
+        rollup_circulation(start, today)
+        rollup_payments(start, today)
+
+        RollupWatermark.objects.update_or_create(
+            name=ROLLUP_WATERMARK, defaults={"processed_until": today}
+        )
+
+    return (today - start).days + 1
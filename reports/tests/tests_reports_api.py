@@ -0,0 +1,152 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from books.models import Book
+from borrowings.models import Borrowing
+from payments.models import Payment
+from reports.models import (
+    DailyBookCirculation,
+    DailyPaymentRollup,
+    RollupWatermark
+)
+from reports.tasks import update_daily_rollups
+
+User = get_user_model()
+
+
+class ReportsApiTests(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            email="admin@email.com", password="password", is_staff=True
+        )
+        self.client.force_authenticate(user=self.admin)
+        self.today = timezone.localdate()
+        self.dune = Book.objects.create(
+            title="Dune", author="Frank Herbert", inventory=5, daily_fee=1
+        )
+        self.emma = Book.objects.create(
+            title="Emma", author="Jane Austen", inventory=5, daily_fee=2
+        )
+
+        for days_ago, book in ((10, self.dune), (10, self.dune), (3, self.emma)):
+            borrowing = self.borrow(book, days_ago)
+        Borrowing.objects.filter(id=borrowing.id).update(
+            actual_return_date=self.today
+        )
+
+        now = timezone.now()
+        self.pay(Payment.PaymentType.PAYMENT, 10, now - timedelta(days=10))
+        self.pay(Payment.PaymentType.FINE, 4, now, paid_at=now)
+        self.pay(Payment.PaymentType.FINE, 6, now, paid_at=now)
+
+    def borrow(self, book, days_ago):
+        return Borrowing.objects.create(
+            book=book,
+            user=self.admin,
+            borrow_date=self.today - timedelta(days=days_ago),
+            expected_return_date=self.today + timedelta(days=7),
+        )
+
+    def pay(self, payment_type, amount, created_at, paid_at=None):
+        payment = Payment.objects.create(
+            borrowing=Borrowing.objects.first(),
+            type=payment_type,
+            money_to_pay=amount,
+            status="PAID" if paid_at else "PENDING",
+            paid_at=paid_at,
+        )
+        # created_at is auto_now_add
+        Payment.objects.filter(id=payment.id).update(created_at=created_at)
+
+    def test_first_run_backfills_history(self):
+        days = update_daily_rollups()
+
+        self.assertEqual(days, 11)
+        self.assertEqual(
+            RollupWatermark.objects.get().processed_until, self.today
+        )
+        dune = DailyBookCirculation.objects.get(book=self.dune)
+        self.assertEqual(dune.date, self.today - timedelta(days=10))
+        self.assertEqual((dune.loans, dune.returns), (2, 0))
+        emma_return = DailyBookCirculation.objects.get(
+            book=self.emma, date=self.today
+        )
+        self.assertEqual((emma_return.loans, emma_return.returns), (0, 1))
+        fines = DailyPaymentRollup.objects.get(type="FINE")
+        self.assertEqual((fines.created, fines.paid), (2, 2))
+        self.assertEqual(fines.paid_amount, Decimal("10.00"))
+
+    def test_incremental_run_recomputes_recent_days_only(self):
+        update_daily_rollups()
+        self.borrow(self.emma, 0)
+        # Too old for the lookback, stays as it was rolled up
+        self.borrow(self.dune, 10)
+
+        days = update_daily_rollups(lookback_days=2)
+
+        self.assertEqual(days, 3)
+        self.assertEqual(
+            DailyBookCirculation.objects.get(
+                book=self.emma, date=self.today
+            ).loans,
+            1,
+        )
+        self.assertEqual(
+            DailyBookCirculation.objects.get(book=self.dune).loans, 2
+        )
+
+    def test_circulation_report(self):
+        update_daily_rollups()
+        url = reverse("reports:circulation")
+
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(day["loans"], day["returns"]) for day in response.data["days"]],
+            [(2, 0), (1, 0), (0, 1)],
+        )
+        self.assertEqual(response.data["top_books"][0]["title"], "Dune")
+
+        response = self.client.get(
+            url, {"date_from": self.today - timedelta(days=5)}
+        )
+        self.assertEqual(len(response.data["days"]), 2)
+
+    def test_revenue_report(self):
+        update_daily_rollups()
+        url = reverse("reports:revenue")
+
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {"type": "FINE"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["days"]), 1)
+        self.assertEqual(response.data["days"][0]["paid_amount"], "10.00")
+        self.assertEqual(Decimal(response.data["revenue"]["FINE"]), 10)
+
+    def test_reports_are_staff_only(self):
+        self.client.force_authenticate(
+            user=User.objects.create_user(
+                email="reader@email.com", password="password"
+            )
+        )
+
+        for name in ("reports:circulation", "reports:revenue"):
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_invalid_range(self):
+        response = self.client.get(
+            reverse("reports:revenue"),
+            {"date_from": date(2024, 2, 1), "date_to": date(2024, 1, 1)},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,14 @@
+from django.urls import path
+
+from reports.views import CirculationReportView, RevenueReportView
+
+urlpatterns = [
+    path(
+        "circulation/",
+        CirculationReportView.as_view(),
+        name="circulation"
+    ),
+    path("revenue/", RevenueReportView.as_view(), name="revenue"),
+]
+
+app_name = "reports"
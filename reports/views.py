@@ -0,0 +1,138 @@
+from datetime import timedelta
+
+from django.db.models import F, Sum
+from django.utils import timezone
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from library_service.params import parse_date_range
+from payments.models import Payment
+from reports.models import DailyBookCirculation, DailyPaymentRollup
+from reports.serializers import (
+    BookCirculationSerializer,
+    DailyCirculationSerializer,
+    DailyRevenueSerializer
+)
+
+DEFAULT_REPORT_DAYS = 30
+TOP_BOOKS_LIMIT = 10
+
+REPORT_PARAMETERS = [
+    OpenApiParameter(
+        "date_from",
+        OpenApiTypes.DATE,
+        description=f"Defaults to {DEFAULT_REPORT_DAYS} days ago",
+    ),
+    OpenApiParameter(
+        "date_to", OpenApiTypes.DATE, description="Defaults to today"
+    ),
+]
+
+
+def report_range(request):
+    date_from, date_to = parse_date_range(request.query_params)
+    date_to = date_to or timezone.localdate()
+    date_from = date_from or date_to - timedelta(days=DEFAULT_REPORT_DAYS)
+    if date_from > date_to:
+        raise ValidationError("date_from must not be after date_to")
+    return date_from, date_to
+
+
+@extend_schema(
+    summary="Daily loans and returns",
+    description="Served from the daily rollups, which are refreshed "
+    "by a periodic task. Available for admins only.",
+    parameters=REPORT_PARAMETERS + [
+        OpenApiParameter("book", OpenApiTypes.INT),
+    ],
+    responses={200: OpenApiTypes.OBJECT},
+)
+class CirculationReportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        date_from, date_to = report_range(request)
+        rollups = DailyBookCirculation.objects.filter(
+            date__range=(date_from, date_to)
+        )
+
+        book = request.query_params.get("book")
+        if book is not None:
+            try:
+                rollups = rollups.filter(book_id=int(book))
+            except ValueError:
+                raise ValidationError("Invalid book parameter")
+
+        days = (
+            rollups.values("date")
+            .annotate(loans=Sum("loans"), returns=Sum("returns"))
+            .order_by("date")
+        )
+        top_books = (
+            rollups.values("book_id", title=F("book__title"))
+            .annotate(loans=Sum("loans"), returns=Sum("returns"))
+            .order_by("-loans", "book_id")[:TOP_BOOKS_LIMIT]
+        )
+
+        return Response(
+            {
+                "date_from": date_from,
+                "date_to": date_to,
+                "days": DailyCirculationSerializer(days, many=True).data,
+                "top_books": BookCirculationSerializer(
+                    top_books, many=True
+                ).data,
+            }
+        )
+
+
+@extend_schema(
+    summary="Daily revenue per payment type",
+    description="Amounts of created and paid payments per day, served "
+    "from the daily rollups. Available for admins only.",
+    parameters=REPORT_PARAMETERS + [
+        OpenApiParameter(
+            "type", OpenApiTypes.STR, enum=Payment.PaymentType.values
+        ),
+    ],
+    responses={200: OpenApiTypes.OBJECT},
+)
+class RevenueReportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        date_from, date_to = report_range(request)
+        rollups = DailyPaymentRollup.objects.filter(
+            date__range=(date_from, date_to)
+        )
+
+        payment_type = request.query_params.get("type")
+        if payment_type is not None:
+            if payment_type not in Payment.PaymentType.values:
+                raise ValidationError("Invalid type parameter")
+            rollups = rollups.filter(type=payment_type)
+
+        revenue = (
+            rollups.values_list("type")
+            .annotate(paid_amount=Sum("paid_amount"))
+            .order_by()
+        )
+
+        return Response(
+            {
+                "date_from": date_from,
+                "date_to": date_to,
+                "days": DailyRevenueSerializer(
+                    rollups.order_by("date", "type"), many=True
+                ).data,
+                # Paid amount over the whole range per payment type
+                "revenue": {
+                    payment_type: str(amount)
+                    for payment_type, amount in revenue
+                },
+            }
+        )
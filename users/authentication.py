@@ -0,0 +1,60 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import (
+    AuthenticationFailed,
+    InvalidToken
+)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from users.cache import USER_CACHE_TIMEOUT, user_cache_key
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication which serves the user from the cache,
+    the database is only hit once per user and USER_CACHE_TIMEOUT
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(
+                _("Token contained no recognizable user identification")
+            )
+
+        cache_key = user_cache_key(user_id)
+        user = cache.get(cache_key)
+        if user is None:
+            # Only active users with a valid token get here
+            user = super().get_user(validated_token)
+            cache.set(cache_key, user, USER_CACHE_TIMEOUT)
+            return user
+
+        # Token revocation is per token, the cached user is shared
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(
+                _("The user's password has been changed."),
+                code="password_changed",
+            )
+
+        return user
+
+
+async def authenticate_async(request):
+    """
+    JWT authentication for plain async Django views, which don't run DRF
+    authentication. Returns the user or None
+    """
+    try:
+        result = await sync_to_async(CachedJWTAuthentication().authenticate)(
+            request
+        )
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
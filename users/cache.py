@@ -0,0 +1,37 @@
+"""
+Short-lived cache of users resolved from JWT access tokens.
+
+The cache key carries a per-user version, saving or deleting the user
+bumps it, so the next request reads the fresh row from the database.
+"""
+import uuid
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+
+USER_VERSION_KEY = "users:user:{}:version"
+USER_CACHE_TIMEOUT = 60
+
+
+def _version(user_id):
+    return cache.get_or_set(
+        USER_VERSION_KEY.format(user_id), uuid.uuid4().hex, timeout=None
+    )
+
+
+def _bump_version(user_id):
+    cache.set(USER_VERSION_KEY.format(user_id), uuid.uuid4().hex, timeout=None)
+
+
+def invalidate_user(user_id):
+    """
+    Drop cached user right away and once more on commit, a concurrent
+    request could have cached the pre-commit row in between
+    """
+    _bump_version(user_id)
+    transaction.on_commit(partial(_bump_version, user_id))
+
+
+def user_cache_key(user_id):
+    return f"users:user:{user_id}:{_version(user_id)}"
@@ -2,9 +2,8 @@ from django.contrib.auth import get_user_model
 from drf_spectacular.utils import extend_schema
 from rest_framework import generics
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
 from rest_framework.settings import api_settings
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.authtoken.serializers import AuthTokenSerializer
 
 from users.serializers import UserSerializer
@@ -37,14 +36,16 @@ class CreateUserView(generics.CreateAPIView):
 )
 class ManageUserView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
-    authentication_classes = (JWTAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def get_object(self):
-        """Use prefetch_related method to retrieve and update user"""
-        return (get_user_model()
-                .objects.prefetch_related("groups", "user_permissions")
-                .get(id=self.request.user.id))
+        """
+        Profile is read from the authenticated (cached) user,
+        updates work on a fresh row
+        """
+        if self.request.method in SAFE_METHODS:
+            return self.request.user
+        return get_user_model().objects.get(id=self.request.user.id)
 
 
 @extend_schema(